@@ -0,0 +1,395 @@
+import asyncio
+from typing import Optional
+from game.session import SessionObject, session_manager
+from global_modules.db.baseclass import BaseClass
+from modules.db import just_db
+from global_modules.load_config import ALL_CONFIGS, Resources
+from modules.logs import game_logger
+from modules.websocket_manager import websocket_manager
+
+RESOURCES: Resources = ALL_CONFIGS["resources"]
+
+
+class BuyOrder(BaseClass, SessionObject):
+    """ Лимитная заявка на покупку на бирже
+
+        Компания хочет купить amount единиц resource по цене не выше unit_price.
+        Деньги под заявку (amount * unit_price) списываются при создании
+        и возвращаются при отмене или если сделка прошла дешевле.
+    """
+
+    __tablename__ = "buy_orders"
+    __unique_id__ = "id"
+    __db_object__ = just_db
+
+    def __init__(self, id: int = 0):
+        self.id: int = id
+
+        self.company_id: int = 0  # Компания-покупатель
+        self.session_id: str = ""
+
+        self.resource: str = ""  # Покупаемый ресурс
+        self.amount: int = 0  # Оставшееся количество к покупке
+        self.unit_price: int = 0  # Максимальная цена за единицу
+
+        self.created_at_step: int = 0
+
+    def escrow(self) -> int:
+        """ Сколько денег сейчас зарезервировано под заявку """
+        return self.amount * self.unit_price
+
+    async def create(self, company_id: int, session_id: str,
+                     resource: str, amount: int, unit_price: int):
+        """ Создание заявки на покупку и немедленное сопоставление со стаканом
+
+        Args:
+            company_id: ID компании-покупателя
+            session_id: ID сессии
+            resource: Покупаемый ресурс
+            amount: Количество единиц
+            unit_price: Максимальная цена за единицу
+        """
+        from game.company import Company
+        from game.item_price import item_price_cache
+
+        if amount <= 0 or unit_price <= 0:
+            raise ValueError("Количество и цена должны быть положительными целыми числами.")
+
+        if RESOURCES.get_resource(resource) is None:
+            raise ValueError(f"Ресурс '{resource}' не существует.")
+
+        self.session_id = session_id
+        session = await self.get_session_or_error()
+
+        average_price = await item_price_cache.get_price(session_id, resource)
+        if abs(unit_price - average_price) / average_price > 0.5:
+            raise ValueError(f"Цена отличается от средней более чем на 50%. Средняя цена: {average_price}, выставленная цена (за 1): {unit_price}. Выставите цену в диапазоне от {int(average_price * 0.5)} до {int(average_price * 1.5)}.")
+
+        company = await Company(id=company_id).reupdate()
+        if not company:
+            raise ValueError("Компания не найдена.")
+
+        if company.session_id != session_id:
+            raise ValueError("Компания должна быть в той же сессии.")
+
+        self.company_id = company_id
+        self.resource = resource
+        self.amount = amount
+        self.unit_price = unit_price
+        self.created_at_step = session.step
+
+        # Резервируем деньги под заявку
+        await company.remove_balance(self.escrow())
+
+        await self.insert()
+
+        await websocket_manager.broadcast({
+            "type": "api-buy_order_created",
+            "data": {
+                "session_id": self.session_id,
+                "order": self.to_dict()
+            }
+        })
+
+        await exchange_matcher.match_buy_order(self)
+        return self
+
+    async def cancel(self):
+        """ Отмена заявки с возвратом зарезервированных денег """
+        from game.company import Company
+
+        async with exchange_matcher.lock(self.session_id):
+            if not await self.reupdate():
+                raise ValueError("Заявка на покупку не найдена.")
+
+            company = await Company(id=self.company_id).reupdate()
+            if company and self.escrow() > 0:
+                await company.add_balance(self.escrow(), 0.0)
+
+            await self.delete()
+
+        await websocket_manager.broadcast({
+            "type": "api-buy_order_cancelled",
+            "data": {
+                "session_id": self.session_id,
+                "order_id": self.id,
+                "company_id": self.company_id
+            }
+        })
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "company_id": self.company_id,
+            "session_id": self.session_id,
+            "resource": self.resource,
+            "amount": self.amount,
+            "unit_price": self.unit_price,
+            "escrow": self.escrow(),
+            "created_at_step": self.created_at_step
+        }
+
+    async def delete(self):
+        await just_db.delete(self.__tablename__, **{self.__unique_id__: self.id})
+        return True
+
+
+class Settlement:
+    """ Итог одного прохода сопоставления
+
+        Накапливает все исполнения и записывает их пачкой:
+        одно обновление на компанию, предложение и заявку,
+        одна доставка на пару продавец-покупатель.
+
+        Запас предложений и остаток заявок списываются условно ($inc при $gte):
+        если что-то уже продано или исполнено мимо сопоставления, весь проход
+        откатывается и деньги с товаром не двигаются.
+    """
+
+    def __init__(self, session_id: str, resource: str):
+        self.session_id = session_id
+        self.resource = resource
+
+        self.balances: dict[int, int] = {}  # {company_id: изменение баланса}
+        self.economic_power: dict[int, int] = {}  # {company_id: прирост}
+        self.deliveries: dict[tuple[int, int], int] = {}  # {(продавец, покупатель): количество}
+        self.offers: dict = {}  # {offer_id: Exchange}
+        self.orders: dict[int, BuyOrder] = {}  # {order_id: BuyOrder}
+        self.sold: dict[int, int] = {}  # {offer_id: продано единиц}
+        self.filled: dict[int, int] = {}  # {order_id: исполнено единиц}
+
+        self.fills: list[dict] = []
+        self.volume: int = 0
+        self.turnover: int = 0
+
+    def fill(self, offer, order: BuyOrder, units: int, cost: int):
+        """ Исполнение: units единиц из предложения offer по заявке order за cost монет """
+        lots = units // offer.sell_amount_per_trade
+
+        offer.total_stock -= units
+        order.amount -= units
+
+        # Резерв покупателя был по его лимитной цене, разницу возвращаем
+        refund = units * order.unit_price - cost
+
+        self.balances[offer.company_id] = self.balances.get(offer.company_id, 0) + cost
+        if refund > 0:
+            self.balances[order.company_id] = self.balances.get(order.company_id, 0) + refund
+
+        from game.company import Company
+
+        self.economic_power[offer.company_id] = self.economic_power.get(
+            offer.company_id, 0) + Company.economic_power_for(units, self.resource, "exchange")
+
+        route = (offer.company_id, order.company_id)
+        self.deliveries[route] = self.deliveries.get(route, 0) + units
+
+        self.offers[offer.id] = offer
+        self.orders[order.id] = order
+        self.sold[offer.id] = self.sold.get(offer.id, 0) + units
+        self.filled[order.id] = self.filled.get(order.id, 0) + units
+
+        self.volume += units
+        self.turnover += cost
+        self.fills.append({
+            "offer_id": offer.id,
+            "order_id": order.id,
+            "seller_id": offer.company_id,
+            "buyer_id": order.company_id,
+            "amount": units,
+            "lots": lots,
+            "price": cost,
+            "unit_price": cost // units
+        })
+
+    async def _claim(self) -> bool:
+        """ Условно списать проданное с предложений и исполненное с заявок
+
+            Возвращает False (и откатывает уже списанное), если запаса
+            или остатка заявки не хватило
+        """
+        from game.exchange import Exchange
+
+        claims = [(Exchange.__tablename__, "total_stock", offer_id, units)
+                  for offer_id, units in self.sold.items()]
+        claims += [(BuyOrder.__tablename__, "amount", order_id, units)
+                   for order_id, units in self.filled.items()]
+
+        claimed = []
+        documents: dict[tuple[str, int], dict] = {}
+        for table, field, obj_id, units in claims:
+            document = await just_db.find_one_and_update(
+                table,
+                {"id": obj_id, field: {"$gte": units}},
+                {"$inc": {field: -units}}
+            )
+            if document is None:
+                for c_table, c_field, c_id, c_units in claimed:
+                    await just_db.find_one_and_update(
+                        c_table, {"id": c_id}, {"$inc": {c_field: c_units}})
+
+                game_logger.warning(f"Сопоставление биржи по {self.resource} в сессии {self.session_id} отменено: запись {table}:{obj_id} изменилась.")
+                return False
+
+            claimed.append((table, field, obj_id, units))
+            documents[(table, obj_id)] = document
+
+        for offer in self.offers.values():
+            offer.load_from_base(documents[(Exchange.__tablename__, offer.id)])
+        for order in self.orders.values():
+            order.load_from_base(documents[(BuyOrder.__tablename__, order.id)])
+        return True
+
+    async def apply(self):
+        from game.company import Company
+        from game.logistics import Logistics
+        from game.item_price import ItemPrice
+        from game.exchange import order_book
+
+        if not self.fills: return
+        if not await self._claim():
+            # Возвращаем объектам состояние из базы, снятые предложения убираем из стакана
+            for offer in self.offers.values():
+                if await offer.reupdate(): order_book.upsert(offer)
+                else: order_book.remove(self.session_id, offer.id)
+            for order in self.orders.values():
+                await order.reupdate()
+            self.fills = []
+            return
+
+        await just_db.bulk_update(Company.__tablename__, [
+            ({"id": company_id}, {"$inc": {
+                "balance": self.balances.get(company_id, 0),
+                "economic_power": self.economic_power.get(company_id, 0)
+            }})
+            for company_id in set(self.balances) | set(self.economic_power)
+        ])
+
+        for offer in self.offers.values():
+            if offer.total_stock <= 0:
+                await offer.delete()
+            else:
+                order_book.upsert(offer)
+
+        for order in self.orders.values():
+            if order.amount <= 0:
+                await order.delete()
+
+        for (seller_id, buyer_id), amount in self.deliveries.items():
+            await Logistics().create(
+                sender_no_delete=True, # Товар уже списан с продавца при создании предложения
+                from_company_id=seller_id,
+                to_company_id=buyer_id,
+                resource_type=self.resource,
+                amount=amount,
+                session_id=self.session_id,
+                source="exchange:match"
+            )
+
+        item_price = await ItemPrice().create(
+            session_id=self.session_id,
+            item_id=self.resource
+        )
+        await item_price.add_popularity(len(self.fills))
+
+        session = await session_manager.get_session(self.session_id)
+        if session:
+            # Средневзвешенная цена прохода за единицу
+            await session.update_item_price(
+                self.resource, self.turnover // self.volume, self.volume)
+
+        await websocket_manager.broadcast({
+            "type": "api-exchange_orders_matched",
+            "data": {
+                "session_id": self.session_id,
+                "resource": self.resource,
+                "fills": self.fills,
+                "volume": self.volume,
+                "turnover": self.turnover
+            }
+        })
+
+
+class ExchangeMatcher:
+    """ Сопоставление заявок на покупку с предложениями биржи
+
+        Приоритет цена-время: лучшая цена, при равной - более ранняя запись.
+        Сделка проходит по цене стоящей в стакане стороны. Каждый проход
+        выполняется под блокировкой сессии и рассчитывается одним Settlement.
+        Участвуют только денежные предложения, сделки идут целыми лотами предложения.
+    """
+
+    def __init__(self):
+        self._locks: dict[str, asyncio.Lock] = {}
+
+    def lock(self, session_id: str) -> asyncio.Lock:
+        """ Блокировка биржи сессии (сопоставление и ручные покупки) """
+        return self._locks.setdefault(session_id, asyncio.Lock())
+
+    async def match_buy_order(self, order: BuyOrder) -> Settlement:
+        """ Сопоставить новую заявку на покупку с предложениями продавцов """
+        from game.exchange import Exchange, order_book
+
+        async with self.lock(order.session_id):
+            settlement = Settlement(order.session_id, order.resource)
+
+            # Заявку могли исполнить или отменить до взятия блокировки
+            if not await order.reupdate() or order.amount <= 0:
+                return settlement
+
+            asks, _ = await order_book.query(
+                order.session_id, sell_resource=order.resource,
+                offer_type='money', max_price=order.unit_price
+            )
+            for ask in asks:
+                if order.amount <= 0: break
+                if ask["company_id"] == order.company_id: continue
+
+                offer = Exchange()
+                offer.load_from_base(ask)
+
+                lot = offer.sell_amount_per_trade
+                lots = min(offer.total_stock // lot, order.amount // lot)
+                if lots <= 0: continue
+
+                settlement.fill(offer, order, lots * lot, lots * offer.price)
+
+            await settlement.apply()
+            return settlement
+
+    async def match_sell_offer(self, offer) -> Settlement:
+        """ Сопоставить денежное предложение с заявками покупателей """
+        async with self.lock(offer.session_id):
+            settlement = Settlement(offer.session_id, offer.sell_resource)
+
+            # Предложение могли продать или снять до взятия блокировки
+            if not await offer.reupdate() or offer.offer_type != 'money':
+                return settlement
+
+            bids: list[BuyOrder] = await just_db.find(
+                BuyOrder.__tablename__, to_class=BuyOrder,
+                sort=[("unit_price", -1), ("id", 1)],
+                session_id=offer.session_id,
+                resource=offer.sell_resource,
+                unit_price={"$gte": offer.unit_price()}
+            ) # type: ignore
+
+            lot = offer.sell_amount_per_trade
+            for bid in bids:
+                if offer.total_stock < lot: break
+                if bid.company_id == offer.company_id: continue
+
+                lots = min(offer.total_stock // lot, bid.amount // lot)
+                if lots <= 0: continue
+
+                units = lots * lot
+                settlement.fill(offer, bid, units, units * bid.unit_price)
+
+            await settlement.apply()
+            return settlement
+
+    def discard(self, session_id: str):
+        self._locks.pop(session_id, None)
+
+
+exchange_matcher = ExchangeMatcher()
@@ -1,5 +1,7 @@
 import copy
 import random
+import zlib
+import numpy as np
 from typing import Optional
 from game.statistic import Statistic
 from game.session import SessionObject
@@ -62,13 +64,17 @@ class Citie(BaseClass, SessionObject):
     async def create(self, 
                      session_id: str, 
                      x: int, y: int, 
-                     name: Optional[str] = None):
+                     name: Optional[str] = None,
+                     branch: Optional[str] = None,
+                     generator: Optional['CityDemandGenerator'] = None):
         """ Создание нового города
         
         Args:
             session_id: ID сессии
             x: координата X
             y: координата Y
+            branch: приоритетная ветка, если уже выбрана (например, для всех городов карты сразу)
+            generator: генератор спроса хода, общий для всех городов карты
         """
 
         self.session_id = session_id
@@ -77,14 +83,14 @@ class Citie(BaseClass, SessionObject):
         self.cell_position = f"{x}.{y}"
 
         # Определяем приоритетную ветку на основе соседних клеток
-        self.branch = await determine_city_branch(
+        self.branch = branch or await determine_city_branch(
             x, y, session_id, session.cells, session.map_size
         )
 
         self.name = name if name else random.choice(NAMES)
 
         # Инициализируем спрос
-        await self._update_demands(session)
+        await self._update_demands(session, generator)
 
         await self.insert()
         await websocket_manager.broadcast({
@@ -96,11 +102,13 @@ class Citie(BaseClass, SessionObject):
 
         return self
 
-    async def _update_demands(self, session=None):
+    async def _update_demands(self, session=None,
+                              generator: Optional['CityDemandGenerator'] = None):
         """Обновляет спрос города на товары
         
         Args:
             session: объект Session (опционально, для оптимизации)
+            generator: готовый генератор спроса (опционально)
         """
         if session is None:
             session = await self.get_session_or_error()
@@ -108,110 +116,14 @@ class Citie(BaseClass, SessionObject):
         if not session:
             return
 
-        # Получаем количество пользователей в сессии (минимум 1 для расчётов)
-        users_count = max(len(await session.users), 1)
-
-        # Рассчитываем модификаторы спроса на основе разности между сохраненным и текущим спросом
-        demand_modifiers = {}
-        
-        for resource_id in self.demands_save:
-            old_amount = self.demands_save.get(resource_id, {}).get('amount', 0)
-            current_amount = self.demands.get(resource_id, {}).get('amount', 0)
-
-            if old_amount > 0:
-                modifier = round(current_amount / old_amount, 2)
-            else:
-                modifier = 1.0
-            demand_modifiers[resource_id] = max(modifier, 0.1)
-
-        # Очищаем старый спрос
-        self.demands = {}
-
-        # Получаем все ресурсы, которые не являются сырьем
-        for resource_id, resource in RESOURCES.resources.items():
-            if not resource.raw:
-                # Базовое количество: massModifier определяет масштаб
-                # Для товаров с massModifier=100 будет ~100 единиц на игрока
-                base_amount = resource.massModifier * users_count
-                
-                # Применяем модификатор, основанный на продажах прошлого хода
-                previous_demand_modifier = demand_modifiers.get(resource_id, 1.0)
-                base_amount *= previous_demand_modifier
-
-                mod_price = session.get_event_effects().get(
-                    'increase_price', {}
-                ).get(resource_id, 1.0)
-                mod_count = session.get_event_effects().get(
-                    'increase_demand', {}
-                ).get(resource_id, 1.0)
-
-                # Модификатор для приоритетной ветки (увеличиваем спрос на 50%)
-                branch_modifier = 1.5 if resource.branch == self.branch else 1.0
-
-                # Применяем модификатор продаж прошлого хода
-                previous_demand_modifier = demand_modifiers.get(resource_id, 1.0)
-                if previous_demand_modifier != 1.0:
-                    rand_demand = random.uniform(previous_demand_modifier, 1.0)
-                else:
-                    rand_demand = random.uniform(0.8, 1.5)
-
-                # Рандомизация ±60%
-                amount_variation = random.uniform(0.4, 1.6)
-
-                # Рассчитываем финальное количество
-                amount = int(base_amount * branch_modifier * rand_demand * amount_variation)
-
-                # Ограничение: минимум зависит от massModifier
-                min_min = 0
-                branch_modifier = 1.0
-                if resource.branch == self.branch:
-                    min_min = random.randint(0, 1)
-                    branch_modifier = 1.5
-
-                min_amount = random.randint(min_min, max(int(resource.massModifier * 0.5), 2))
-                max_amount = int(
-                    resource.massModifier * users_count * 2 * mod_count * branch_modifier * SETTINGS.city_mod
-                    )
-                amount = random.randint(min_amount, max(min_amount, max_amount, amount))
-
-
-                # Цена с рандомизацией ±20%
-                current_item_price = await session.get_item_price(resource_id)
-                price_variation = random.uniform(0.8, 1.2)
-                price = int(current_item_price * price_variation * mod_price)
-
-                # Бонус к цене для приоритетной ветки (+50%)
-                if resource.branch == self.branch:
-                    price = int(price * 1.5)
-
-                # Минимальная цена не может быть меньше базовой
-                # price = max(resource.basePrice, price)
-                
-                self.demands[resource_id] = {
-                    'amount': amount,
-                    'price': price
-                }
-
-        # Обновляем demands_save для следующего хода (сохраняем только что созданный спрос)
-        self.demands_save = copy.deepcopy(self.demands)
+        if generator is None:
+            generator = await CityDemandGenerator.for_session(session)
+        generator.fill([self])
 
     async def on_new_game_stage(self):
         """Вызывается при начале нового игрового хода"""
         session = await self.get_session_or_error()
-        
-        # Обновляем спрос на товары
-        await self._update_demands(session)
-        
-        await self.save_to_base()
-        
-        await websocket_manager.broadcast({
-            "type": "api-city-update-demands",
-            "data": {
-                "city_id": self.id,
-                "session_id": self.session_id,
-                "demands": self.demands
-            }
-        })
+        await CityDemandGenerator.update_session(session, [self])
 
     async def sell_resource(self, company_id: int, 
                       resource_id: str, amount: int):
@@ -228,20 +140,21 @@ class Citie(BaseClass, SessionObject):
         from game.logistics import Logistics
         from game.item_price import ItemPrice
 
-        await Logistics().create(
-            session_id=self.session_id,
-            resource_type=resource_id,
-            amount=amount,
-            from_company_id=company_id,
-            to_city_id=self.id
-        )
-        
-        # Уменьшаем спрос
-        self.demands[resource_id]['amount'] -= amount
-        if self.demands[resource_id]['amount'] <= 0:
-            del self.demands[resource_id]
-
-        await self.save_to_base()
+        # Спрос списывается атомарно до отправки и возвращается, если отправка не удалась
+        price = await self.reserve_demand(resource_id, amount)
+        try:
+            await Logistics().create(
+                session_id=self.session_id,
+                resource_type=resource_id,
+                amount=amount,
+                from_company_id=company_id,
+                to_city_id=self.id,
+                source=f"city:{self.id}",
+                city_price=price
+            )
+        except Exception:
+            await self.release_demand(resource_id, amount)
+            raise
 
         await websocket_manager.broadcast({
             "type": "api-city-trade",
@@ -275,6 +188,243 @@ class Citie(BaseClass, SessionObject):
 
         return True
 
+    async def sell_resources(self, company_id: int, lines: list[dict]):
+        """Продает городу несколько ресурсов одним заказом
+
+        Товар со склада компании и спрос города по всем позициям
+        списываются двумя условными обновлениями ($inc при $gte): заказ
+        проходит целиком или не проходит.
+
+        Args:
+            company_id: ID компании
+            lines: [{'resource_id': str, 'amount': int}, ...]
+
+        Returns:
+            tuple[list[dict], Optional[str]]: проданные позиции
+                {'resource_id', 'amount', 'price'} и ошибка, если часть
+                позиций отправить не удалось (они возвращены на склад)
+        """
+        from game.company import Company
+        from game.logistics import Logistics
+        from game.item_price import ItemPrice
+
+        order: dict[str, int] = {}
+        for line in lines:
+            resource_id = line.get('resource_id')
+            amount = line.get('amount')
+
+            if RESOURCES.get_resource(resource_id) is None:
+                raise ValueError(f"Ресурс '{resource_id}' не существует.")
+            if not isinstance(amount, int) or amount <= 0:
+                raise ValueError("Количество должно быть положительным целым числом.")
+
+            order[resource_id] = order.get(resource_id, 0) + amount
+
+        if not order:
+            raise ValueError("Заказ пуст.")
+
+        company = await Company(id=company_id).reupdate()
+        if not company or company.session_id != self.session_id:
+            raise ValueError("Компания не найдена.")
+
+        conditions: dict = {"id": company_id}
+        for resource_id, amount in order.items():
+            conditions[f"warehouses.{resource_id}"] = {"$gte": amount}
+        document = await just_db.find_one_and_update(
+            Company.__tablename__, conditions,
+            {"$inc": {f"warehouses.{resource_id}": -amount
+                      for resource_id, amount in order.items()}}
+        )
+        if document is None:
+            for resource_id, amount in order.items():
+                if company.warehouses.get(resource_id, 0) < amount:
+                    raise ValueError(f"Недостаточно ресурса '{resource_id}' на складе.")
+            raise ValueError("Склад компании изменился, повторите заказ.")
+
+        try:
+            prices = await self.reserve_demands(order)
+        except Exception:
+            await self._return_to_warehouse(company_id, order)
+            raise
+
+        # Исчерпанные позиции убираются со склада, как в Company.remove_resource
+        for resource_id in order:
+            if document["warehouses"].get(resource_id) == 0:
+                await just_db.find_one_and_update(
+                    Company.__tablename__,
+                    {"id": company_id, f"warehouses.{resource_id}": 0},
+                    {"$unset": {f"warehouses.{resource_id}": ""}}
+                )
+
+        for resource_id, amount in order.items():
+            await websocket_manager.broadcast({
+                "type": "api-company_resource_removed",
+                "data": {
+                    "session_id": self.session_id,
+                    "company_id": company_id,
+                    "resource": resource_id,
+                    "amount": amount
+                }
+            })
+
+        sold = []
+        error = None
+        try:
+            for resource_id, amount in order.items():
+                await Logistics().create(
+                    session_id=self.session_id,
+                    resource_type=resource_id,
+                    amount=amount,
+                    from_company_id=company_id,
+                    to_city_id=self.id,
+                    sender_no_delete=True, # Товар уже списан со склада
+                    source=f"city:{self.id}",
+                    city_price=prices[resource_id]
+                )
+                sold.append({
+                    "resource_id": resource_id,
+                    "amount": amount,
+                    "price": prices[resource_id]
+                })
+        except Exception as e:
+            # Неотправленные позиции возвращаются на склад и в спрос города,
+            # отправленные остаются проданными
+            shipped = {line["resource_id"] for line in sold}
+            unshipped = {resource_id: amount for resource_id, amount in order.items()
+                         if resource_id not in shipped}
+            for resource_id, amount in unshipped.items():
+                await self.release_demand(resource_id, amount)
+            await self._return_to_warehouse(company_id, unshipped)
+
+            error = str(e)
+            game_logger.error(f"Ошибка отправки заказа города {self.id} компании {company_id}: {e}")
+
+        for line in sold:
+            await websocket_manager.broadcast({
+                "type": "api-city-trade",
+                "data": {
+                    "city_id": self.id,
+                    "company_id": company_id,
+                    "resource_id": line["resource_id"],
+                    "amount": line["amount"]
+                }
+            })
+
+            try:
+                item_price = await ItemPrice().create(
+                    session_id=self.session_id,
+                    item_id=line["resource_id"]
+                )
+                await item_price.add_popularity(line["amount"])
+            except Exception as e:
+                game_logger.error(f"Ошибка при увеличении популярности товара {line['resource_id']}: {e}")
+
+        session = await self.get_session_or_error()
+        st = await Statistic().create(
+            session_id=self.session_id,
+            company_id=company_id,
+            step=session.step
+        )
+        if st:
+            await st.update_me(
+                total_products_produced=sum(line["amount"] for line in sold)
+            )
+
+        return sold, error
+
+    async def _return_to_warehouse(self, company_id: int, resources: dict[str, int]):
+        """ Возвращает списанный под заказ товар на склад компании """
+        from game.company import Company
+
+        if not resources: return
+        await just_db.find_one_and_update(
+            Company.__tablename__, {"id": company_id},
+            {"$inc": {f"warehouses.{resource_id}": amount
+                      for resource_id, amount in resources.items()}}
+        )
+
+        for resource_id, amount in resources.items():
+            await websocket_manager.broadcast({
+                "type": "api-company_resource_added",
+                "data": {
+                    "session_id": self.session_id,
+                    "company_id": company_id,
+                    "resource": resource_id,
+                    "amount": amount
+                }
+            })
+
+    async def reserve_demands(self, order: dict[str, int]) -> dict[str, int]:
+        """ Атомарно уменьшает спрос сразу по нескольким товарам
+
+            Заказ {resource_id: amount} списывается целиком одним условным
+            обновлением или не списывается вовсе.
+
+            Returns:
+                dict[str, int]: цена за единицу по каждому товару
+        """
+        conditions: dict = {"id": self.id, "session_id": self.session_id}
+        decrements = {}
+        for resource_id, amount in order.items():
+            conditions[f"demands.{resource_id}.amount"] = {"$gte": amount}
+            decrements[f"demands.{resource_id}.amount"] = -amount
+
+        document = await just_db.find_one_and_update(
+            self.__tablename__, conditions, {"$inc": decrements})
+
+        if document is None:
+            for resource_id, amount in order.items():
+                demand = self.demands.get(resource_id)
+                if not demand or demand.get('amount', 0) <= 0:
+                    raise ValueError(f"Город не принимает ресурс '{resource_id}'")
+                if demand['amount'] < amount:
+                    raise ValueError(f"Город принимает только {demand['amount']} единиц ресурса '{resource_id}'")
+            raise ValueError("Спрос города изменился, повторите заказ.")
+
+        prices = {}
+        for resource_id in order:
+            self.demands[resource_id] = document["demands"][resource_id]
+            prices[resource_id] = self.demands[resource_id]['price']
+        return prices
+
+    async def reserve_demand(self, resource_id: str, amount: int) -> int:
+        """ Атомарно уменьшает спрос города на amount единиц
+
+            Списание проходит одним условным обновлением в базе, только если
+            спроса хватает, поэтому одновременные продажи не могут выбрать
+            один и тот же спрос. Исчерпанный спрос остаётся с amount = 0.
+
+            Returns:
+                int: цена за единицу
+        """
+        if not isinstance(amount, int) or amount <= 0:
+            raise ValueError("Количество должно быть положительным целым числом.")
+
+        if RESOURCES.get_resource(resource_id) is None:
+            raise ValueError("Неверный тип ресурса")
+
+        prices = await self.reserve_demands({resource_id: amount})
+        return prices[resource_id]
+
+    async def release_demand(self, resource_id: str, amount: int):
+        """ Возвращает зарезервированный спрос (отправка не состоялась) """
+        document = await just_db.find_one_and_update(
+            self.__tablename__,
+            {
+                "id": self.id,
+                "session_id": self.session_id,
+                f"demands.{resource_id}": {"$exists": True}
+            },
+            {"$inc": {f"demands.{resource_id}.amount": amount}}
+        )
+        if document is not None:
+            self.demands[resource_id] = document["demands"][resource_id]
+
+    def active_demands(self) -> dict:
+        """ Спрос без исчерпанных товаров """
+        return {resource_id: demand for resource_id, demand in self.demands.items()
+                if demand.get('amount', 0) > 0}
+
     def get_position(self) -> tuple[int, int]:
         """Возвращает координаты города"""
         if not self.cell_position:
@@ -288,7 +438,7 @@ class Citie(BaseClass, SessionObject):
             "session_id": self.session_id,
             "cell_position": self.cell_position,
             "branch": self.branch,
-            "demands": self.demands,
+            "demands": self.active_demands(),
             
             "name": self.name
         }
@@ -306,4 +456,153 @@ class Citie(BaseClass, SessionObject):
             }
         })
 
-        return True
\ No newline at end of file
+        return True
+
+
+# Ресурсы, на которые у городов бывает спрос (всё, кроме сырья)
+DEMAND_RESOURCES = [
+    (resource_id, resource)
+    for resource_id, resource in RESOURCES.resources.items()
+    if not resource.raw
+]
+
+
+class CityDemandGenerator:
+    """ Генерация спроса городов сессии на ход
+
+        Цены, количество игроков и эффекты события читаются один раз на ход,
+        затем спрос считается матрицей города × товары (numpy). Случайность
+        берётся из генератора с зерном (сессия, ход, клетка города), поэтому
+        спрос воспроизводим и не зависит от порядка обхода городов.
+    """
+
+    # Случайных величин на одну ячейку матрицы
+    DRAWS = 6
+
+    def __init__(self, session_id: str, step: int, users_count: int,
+                 prices: dict[str, int], effects: dict):
+        self.session_id = session_id
+        self.step = step
+        self.users_count = max(users_count, 1)
+
+        increase_price = effects.get('increase_price', {})
+        increase_demand = effects.get('increase_demand', {})
+
+        # Столбцы матрицы: всё, что не зависит от города
+        self.resource_ids = [resource_id for resource_id, _ in DEMAND_RESOURCES]
+        self.branches = np.array([resource.branch for _, resource in DEMAND_RESOURCES], dtype=object)
+        self.mass = np.array([resource.massModifier for _, resource in DEMAND_RESOURCES], dtype=float)
+        self.prices = np.array([
+            prices.get(resource_id, resource.basePrice)
+            for resource_id, resource in DEMAND_RESOURCES], dtype=float)
+        self.mod_price = np.array([
+            increase_price.get(resource_id, 1.0) for resource_id in self.resource_ids], dtype=float)
+        self.mod_count = np.array([
+            increase_demand.get(resource_id, 1.0) for resource_id in self.resource_ids], dtype=float)
+
+    @classmethod
+    async def for_session(cls, session) -> 'CityDemandGenerator':
+        from game.item_price import item_price_cache
+
+        users_count = await just_db.count("users", session_id=session.session_id)
+        prices = await item_price_cache.get_prices(session.session_id)
+
+        return cls(session.session_id, session.step, users_count,
+                   prices, session.get_event_effects())
+
+    def _draws(self, city: Citie) -> np.ndarray:
+        """ Равномерные [0, 1) для строки города: (DRAWS, товары) """
+        seed = zlib.crc32(f"{self.session_id}:{self.step}:{city.cell_position}".encode())
+        return np.random.default_rng(seed).random((self.DRAWS, len(self.resource_ids)))
+
+    def _modifiers(self, city: Citie) -> np.ndarray:
+        """ Модификаторы спроса по разности между сохраненным и текущим спросом """
+        modifiers = np.ones(len(self.resource_ids))
+        for index, resource_id in enumerate(self.resource_ids):
+            old_amount = city.demands_save.get(resource_id, {}).get('amount', 0)
+            if old_amount <= 0: continue
+
+            current_amount = city.demands.get(resource_id, {}).get('amount', 0)
+            modifiers[index] = max(round(current_amount / old_amount, 2), 0.1)
+        return modifiers
+
+    def table(self, cities: list[Citie]) -> list[dict]:
+        """ Спрос городов: [{resource_id: {'amount': int, 'price': int}}, ...] в порядке cities """
+        if not cities: return []
+
+        # (DRAWS, города, товары)
+        u = np.stack([self._draws(city) for city in cities], axis=1)
+        previous = np.stack([self._modifiers(city) for city in cities])
+        in_branch = np.array([city.branch for city in cities], dtype=object)[:, None] == self.branches[None, :]
+        branch_modifier = np.where(in_branch, 1.5, 1.0)
+
+        # Базовое количество (massModifier на игрока) с поправкой на продажи прошлого хода
+        base_amount = self.mass * self.users_count * previous
+
+        changed = previous != 1.0
+        low = np.where(changed, previous, 0.8)
+        high = np.where(changed, 1.0, 1.5)
+        rand_demand = low + (high - low) * u[0]
+
+        # Рандомизация ±60%
+        amount_variation = 0.4 + 1.2 * u[1]
+        amount = np.floor(base_amount * branch_modifier * rand_demand * amount_variation)
+
+        # Ограничение: минимум зависит от massModifier
+        min_min = np.where(in_branch, np.floor(u[2] * 2), 0)
+        min_top = np.maximum(np.floor(self.mass * 0.5), 2)
+        min_amount = min_min + np.floor(u[3] * (min_top - min_min + 1))
+        max_amount = np.floor(
+            self.mass * self.users_count * 2 * self.mod_count * branch_modifier * SETTINGS.city_mod)
+        top = np.maximum(np.maximum(min_amount, max_amount), amount)
+        amount = min_amount + np.floor(u[4] * (top - min_amount + 1))
+
+        # Цена с рандомизацией ±20%, бонус приоритетной ветке +50%
+        price = np.floor(self.prices * (0.8 + 0.4 * u[5]) * self.mod_price)
+        price = np.where(in_branch, np.floor(price * 1.5), price)
+
+        amounts = amount.astype(np.int64).tolist()
+        prices = price.astype(np.int64).tolist()
+        return [
+            {
+                resource_id: {'amount': amounts[row][col], 'price': prices[row][col]}
+                for col, resource_id in enumerate(self.resource_ids)
+            }
+            for row in range(len(cities))
+        ]
+
+    def fill(self, cities: list[Citie]):
+        for city, demands in zip(cities, self.table(cities)):
+            city.demands = demands
+            # Сохраняем только что созданный спрос для расчёта модификаторов следующего хода
+            city.demands_save = copy.deepcopy(city.demands)
+
+    @classmethod
+    async def update_session(cls, session, cities: Optional[list[Citie]] = None):
+        """ Новый спрос всех городов сессии с записью одним запросом """
+        if cities is None:
+            cities = await session.cities
+        if not cities: return
+
+        generator = await cls.for_session(session)
+
+        generator.fill(cities)
+
+        operations = []
+        for city in cities:
+            operations.append((
+                {"id": city.id, "session_id": city.session_id},
+                {"$set": {"demands": city.demands, "demands_save": city.demands_save}}
+            ))
+
+        await just_db.bulk_update(Citie.__tablename__, operations)
+
+        for city in cities:
+            await websocket_manager.broadcast({
+                "type": "api-city-update-demands",
+                "data": {
+                    "city_id": city.id,
+                    "session_id": city.session_id,
+                    "demands": city.active_demands()
+                }
+            })
@@ -24,6 +24,14 @@ SETTINGS: Settings = ALL_CONFIGS['settings']
 CAPITAL: Capital = ALL_CONFIGS['capital']
 REPUTATION: Reputation = ALL_CONFIGS['reputation']
 
+# Множители экономической силы по типу операции
+ECONOMIC_POWER_MODIFIERS = {
+    "production": 1,
+    "exchange": 2,
+    "city_sell": 3,
+    "contract": 4
+}
+
 class Company(BaseClass, SessionObject):
 
     __tablename__ = "companies"
@@ -187,6 +195,7 @@ class Company(BaseClass, SessionObject):
         await websocket_manager.broadcast({
             "type": "api-company_set_position",
             "data": {
+                "session_id": self.session_id,
                 "company_id": self.id,
                 "old_position": old_position,
                 "new_position": self.cell_position
@@ -210,11 +219,13 @@ class Company(BaseClass, SessionObject):
         for user in await self.users: await user.leave_from_company()
         for factory in await self.get_factories(): await factory.delete()
         for exchange in await self.exchanges: await exchange.delete()
+        await just_db.delete('buy_orders', company_id=self.id)
         for contract in await self.get_contracts(): await contract.delete()
 
         await websocket_manager.broadcast({
             "type": "api-company_deleted",
             "data": {
+                "session_id": self.session_id,
                 "company_id": self.id
             }
         })
@@ -268,6 +279,7 @@ class Company(BaseClass, SessionObject):
         await websocket_manager.broadcast({
             "type": "api-company_resource_added",
             "data": {
+                "session_id": self.session_id,
                 "company_id": self.id,
                 "resource": resource,
                 "amount": amount
@@ -298,6 +310,7 @@ class Company(BaseClass, SessionObject):
         await websocket_manager.broadcast({
             "type": "api-company_resource_removed",
             "data": {
+                "session_id": self.session_id,
                 "company_id": self.id,
                 "resource": resource,
                 "amount": amount
@@ -312,17 +325,10 @@ class Company(BaseClass, SessionObject):
             count += amount
         return count
 
-    async def set_economic_power(self, count: int, item: str, e_type: str):
-        mod = 1
-
-        if e_type == "production":
-            mod = 1
-        elif e_type == "exchange":
-            mod = 2
-        elif e_type == "city_sell":
-            mod = 3
-        elif e_type == "contract":
-            mod = 4
+    @staticmethod
+    def economic_power_for(count: int, item: str, e_type: str) -> int:
+        """ Прирост экономической силы за count единиц item по типу операции """
+        mod = ECONOMIC_POWER_MODIFIERS.get(e_type, 1)
 
         resource = RESOURCES.get_resource(item)  # type: ignore
         if not resource:
@@ -330,7 +336,10 @@ class Company(BaseClass, SessionObject):
         else:
             dif = resource.basePrice
 
-        self.economic_power += int(count * dif * mod)
+        return int(count * dif * mod)
+
+    async def set_economic_power(self, count: int, item: str, e_type: str):
+        self.economic_power += self.economic_power_for(count, item, e_type)
         await self.save_to_base()
 
     async def get_my_cell_info(self):
@@ -392,6 +401,7 @@ class Company(BaseClass, SessionObject):
         await websocket_manager.broadcast({
             "type": "api-company_balance_changed",
             "data": {
+                "session_id": self.session_id,
                 "company_id": self.id,
                 "old_balance": old_balance,
                 "new_balance": self.balance
@@ -418,6 +428,7 @@ class Company(BaseClass, SessionObject):
         await websocket_manager.broadcast({
             "type": "api-company_balance_changed",
             "data": {
+                "session_id": self.session_id,
                 "company_id": self.id,
                 "old_balance": old_balance,
                 "new_balance": self.balance
@@ -469,6 +480,7 @@ class Company(BaseClass, SessionObject):
         await websocket_manager.broadcast({
             "type": "api-company_improvement_upgraded",
             "data": {
+                "session_id": self.session_id,
                 "company_id": self.id,
                 "improvement_type": improvement_type,
                 "new_level": self.improvements[improvement_type]
@@ -490,6 +502,7 @@ class Company(BaseClass, SessionObject):
         await websocket_manager.broadcast({
             "type": "api-company_reputation_changed",
             "data": {
+                "session_id": self.session_id,
                 "company_id": self.id,
                 "old_reputation": old_reputation,
                 "new_reputation": self.reputation
@@ -515,6 +528,7 @@ class Company(BaseClass, SessionObject):
             await websocket_manager.broadcast({
                 "type": "api-company_reputation_changed",
                 "data": {
+                    "session_id": self.session_id,
                     "company_id": self.id,
                     "old_reputation": old_reputation,
                     "new_reputation": self.reputation
@@ -593,6 +607,7 @@ class Company(BaseClass, SessionObject):
         await websocket_manager.broadcast({
             "type": "api-company_credit_taken",
             "data": {
+                "session_id": self.session_id,
                 "company_id": self.id,
                 "amount": c_sum,
                 "steps": steps
@@ -645,6 +660,7 @@ class Company(BaseClass, SessionObject):
         await websocket_manager.broadcast({
             "type": "api-company_credit_removed",
             "data": {
+                "session_id": self.session_id,
                 "company_id": self.id,
                 "credit_index": credit_index
             }
@@ -706,6 +722,7 @@ class Company(BaseClass, SessionObject):
         await websocket_manager.broadcast({
             "type": "api-company_credit_paid",
             "data": {
+                "session_id": self.session_id,
                 "company_id": self.id,
                 "credit_index": credit_index,
                 "amount": amount,
@@ -756,6 +773,7 @@ class Company(BaseClass, SessionObject):
         await websocket_manager.broadcast({
             "type": "api-company_to_prison",
             "data": {
+                "session_id": self.session_id,
                 "company_id": self.id,
                 "end_step": end_step
             }
@@ -777,6 +795,7 @@ class Company(BaseClass, SessionObject):
         await websocket_manager.broadcast({
             "type": "api-company_left_prison",
             "data": {
+                "session_id": self.session_id,
                 "company_id": self.id
             }
         })
@@ -879,6 +898,7 @@ class Company(BaseClass, SessionObject):
         await websocket_manager.broadcast({
             "type": "api-company_tax_paid",
             "data": {
+                "session_id": self.session_id,
                 "company_id": self.id,
                 "amount": amount,
                 "remaining": self.tax_debt
@@ -950,6 +970,7 @@ class Company(BaseClass, SessionObject):
         await websocket_manager.broadcast({
             "type": "api-company_deposit_taken",
             "data": {
+                "session_id": self.session_id,
                 "company_id": self.id,
                 "amount": d_sum,
                 "steps": steps
@@ -1014,6 +1035,7 @@ class Company(BaseClass, SessionObject):
         await websocket_manager.broadcast({
             "type": "api-company_deposit_withdrawn",
             "data": {
+                "session_id": self.session_id,
                 "company_id": self.id,
                 "deposit_index": deposit_index,
                 "amount": amount_to_return
@@ -1105,21 +1127,23 @@ class Company(BaseClass, SessionObject):
 
         await factory.set_produce(produce)
 
-    async def get_contracts(self) -> list['Contract']:
-        """ Получает все контракты компании """
-        from game.contract import Contract
+    async def get_contracts(self, status: Optional[str] = None) -> list['Contract']:
+        """ Получает контракты компании
 
-        contracts: list[Contract] = await just_db.find(
-            Contract.__tablename__, to_class=Contract,
-            supplier_company_id=self.id
-        ) # type: ignore
+            По умолчанию - все контракты компании в базе, как и раньше
+            (завершившиеся из базы удаляются). status сужает выборку:
+            active, pending или expired (завершившиеся за текущий ход)
+        """
+        from game.contract import contract_index
 
-        contracts += await just_db.find(
-            Contract.__tablename__, to_class=Contract,
-            customer_company_id=self.id
-        ) # type: ignore
+        return await contract_index.get_company_contracts(
+            self.session_id, self.id, status)
+
+    async def count_contracts(self, status: Optional[str] = None) -> int:
+        """ Количество контрактов компании без загрузки самих контрактов """
+        from game.contract import contract_index
 
-        return contracts
+        return await contract_index.count(self.session_id, self.id, status)
 
     async def get_max_contracts(self) -> int:
         """ Получает максимальное количество активных контрактов """
@@ -1146,7 +1170,7 @@ class Company(BaseClass, SessionObject):
     async def can_create_contract(self) -> bool:
         """ Проверяет, может ли компания создать новый контракт """
 
-        return len(await self.get_contracts()
+        return await self.count_contracts(
                    ) < await self.get_max_contracts()
 
     async def on_new_game_stage(self, step: int):
@@ -1321,6 +1345,7 @@ class Company(BaseClass, SessionObject):
         await websocket_manager.broadcast({
             "type": "api-company_fast_logistic_set",
             "data": {
+                "session_id": self.session_id,
                 "company_id": self.id,
                 "fast_logistic": self.fast_logistic
             }
@@ -1339,6 +1364,7 @@ class Company(BaseClass, SessionObject):
         await websocket_manager.broadcast({
             "type": "api-company_fast_complectation_set",
             "data": {
+                "session_id": self.session_id,
                 "company_id": self.id,
                 "fast_complectation": self.fast_complectation
             }
@@ -1369,6 +1395,7 @@ class Company(BaseClass, SessionObject):
         await websocket_manager.broadcast({
             "type": "api-company_set_position",
             "data": {
+                "session_id": self.session_id,
                 "company_id": self.id,
                 "old_position": old_position,
                 "new_position": self.cell_position
@@ -1392,6 +1419,7 @@ class Company(BaseClass, SessionObject):
         await websocket_manager.broadcast({
             "type": "api-company_set_autopay_taxes",
             "data": {
+                "session_id": self.session_id,
                 "company_id": self.id
             }
         })
\ No newline at end of file
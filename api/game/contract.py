@@ -1,3 +1,6 @@
+import asyncio
+import copy
+from typing import Optional
 from game.session import SessionObject
 from global_modules.db.baseclass import BaseClass
 from modules.db import just_db
@@ -23,6 +26,9 @@ class Contract(BaseClass, SessionObject):
         5. При успешном завершении - удаление и повышение репутации
         6. Непринятые контракты удаляются в конце хода
 
+        Проверка в конце хода (истечение, невыполненная поставка, возврат и штраф)
+        выполняется для всей сессии сразу в ContractSettlement.
+
     """
 
     __tablename__ = "contracts"
@@ -175,7 +181,8 @@ class Contract(BaseClass, SessionObject):
                 to_company_id=customer.id,
                 resource_type=self.resource,
                 amount=self.amount_per_turn,
-                session_id=self.session_id
+                session_id=self.session_id,
+                source=f"contract:{self.id}"
             )
 
             self.successful_deliveries += 1
@@ -344,40 +351,6 @@ class Contract(BaseClass, SessionObject):
         step_now = (await self.get_session_or_error()).step
         return (self.created_at_step == step_now)
 
-    async def on_new_game_step(self):
-        """ Проверка контракта при новом ходе
-
-            Сбрасывает статус доставки
-            Удаляет непринятые контракты в конце хода
-        """
-        # Если контракт не принят в конце хода - удаляем
-        if not self.accepted:
-            await websocket_manager.broadcast({
-                "type": "api-contract_expired",
-                "data": {
-                    "session_id": self.session_id,
-                    "contract_id": self.id,
-                    "reason": "Контракт не был принят до конца хода"
-                }
-            })
-
-            game_logger.info(f"Контракт {self.id} не принят и удален.")
-            await self.delete()
-            return True  # Контракт удален
-
-        else:
-
-            if not self.delivered_this_turn:
-                if not await self.is_first_step:
-
-                    # Отменяем контракт с возвратом части денег и штрафом репутации
-                    await self.cancel_with_refund(self.who_creator)
-                    return True
-
-            self.delivered_this_turn = False
-            await self.save_to_base()
-            return True
-
     def to_dict(self) -> dict:
         return {
             "id": self.id,
@@ -394,8 +367,21 @@ class Contract(BaseClass, SessionObject):
             "delivered_this_turn": self.delivered_this_turn
         }
 
+    async def insert(self):
+        await super().insert()
+        contract_index.upsert(self, created=True)
+
+    async def save_to_base(self):
+        await super().save_to_base()
+        contract_index.upsert(self)
+
+    def status(self) -> str:
+        """ active - принят и выполняется, pending - ждёт принятия """
+        return "active" if self.accepted else "pending"
+
     async def delete(self):
         await just_db.delete(self.__tablename__, id=self.id)
+        contract_index.remove(self)
 
         await websocket_manager.broadcast({
             "type": "api-contract_deleted",
@@ -403,4 +389,358 @@ class Contract(BaseClass, SessionObject):
                     "session_id": self.session_id,
                     "contract_id": self.id
                 }
-            })
\ No newline at end of file
+            })
+
+
+class ContractSettlement:
+    """ Расчёт контрактов сессии в конце хода
+
+        Все контракты сессии проверяются за один проход:
+        - непринятые истекают и удаляются
+        - принятые без поставки за ход (кроме хода создания) отменяются
+          с возвратом части денег заказчику и штрафом репутации поставщику
+        - остальным сбрасывается статус доставки
+
+        Изменения денег и репутации компаний ($inc), удаление и обновление
+        контрактов записываются пачкой, каждая компания получает одно событие
+        api-contracts_settled. События api-contract_expired, api-contract_cancelled
+        и api-contract_deleted по каждому контракту отправляются как раньше.
+    """
+
+    def __init__(self, session_id: str, step: int):
+        self.session_id = session_id
+        self.step = step
+
+        self.expired: list[Contract] = []
+        self.missed: list[Contract] = []
+        self.continued: list[Contract] = []
+
+        self.balances: dict[int, int] = {}  # {company_id: изменение баланса}
+        self.penalties: dict[int, int] = {}  # {company_id: штраф репутации}
+        self.reports: dict[int, dict] = {}  # {company_id: итог для компании}
+
+    def add(self, contract: Contract):
+        if not contract.accepted:
+            self.expired.append(contract)
+        elif not contract.delivered_this_turn and contract.created_at_step != self.step:
+            self.missed.append(contract)
+        else:
+            self.continued.append(contract)
+
+    def _report(self, company_id: int) -> dict:
+        if company_id not in self.reports:
+            self.reports[company_id] = {"expired": [], "cancelled": []}
+        return self.reports[company_id]
+
+    def _settle_missed(self, companies: dict):
+        """ Возвраты и штрафы по невыполненным контрактам в порядке их создания """
+        available = {company_id: company.balance for company_id, company in companies.items()}
+
+        for contract in sorted(self.missed, key=lambda c: c.id):
+            supplier_id = contract.supplier_company_id
+            customer_id = contract.customer_company_id
+
+            refund = 0
+            if supplier_id in companies and customer_id in companies:
+                not_executed = contract.duration_turns - contract.successful_deliveries
+                amount = contract.payment_amount // not_executed if not_executed > 0 else 0
+
+                if amount > 0 and available[supplier_id] >= amount:
+                    refund = amount
+                    available[supplier_id] -= refund
+                    available[customer_id] += refund
+
+                    self.balances[supplier_id] = self.balances.get(supplier_id, 0) - refund
+                    self.balances[customer_id] = self.balances.get(customer_id, 0) + refund
+
+                if amount > 0:
+                    penalty = REPUTATION.contract.failed
+                else:
+                    # Возвращать нечего - больший штраф, как в cancel_with_refund
+                    penalty = REPUTATION.contract.failed * 2
+
+                self.penalties[supplier_id] = self.penalties.get(supplier_id, 0) + penalty
+
+            for company_id, role in ((supplier_id, "supplier"), (customer_id, "customer")):
+                self._report(company_id)["cancelled"].append({
+                    "contract_id": contract.id,
+                    "role": role,
+                    "refund": refund
+                })
+
+            game_logger.info(f"Контракт {contract.id} отменен с возвратом {refund} монет.")
+
+    async def apply(self):
+        from game.company import Company
+
+        ended = self.expired + self.missed
+        if not ended and not self.continued: return
+
+        for contract in self.expired:
+            for company_id in (contract.supplier_company_id, contract.customer_company_id):
+                self._report(company_id)["expired"].append(contract.id)
+
+        company_ids = {company_id for contract in self.missed
+                       for company_id in (contract.supplier_company_id, contract.customer_company_id)}
+        companies: dict[int, Company] = {}
+        if company_ids:
+            loaded: list[Company] = await just_db.find(
+                Company.__tablename__, to_class=Company,
+                id={"$in": list(company_ids)}) # type: ignore
+            companies = {company.id: company for company in loaded}
+
+        self._settle_missed(companies)
+
+        # Деньги и репутация - приращениями одним запросом на все компании,
+        # затем репутация не ниже нуля
+        changed_ids = list(set(self.balances) | set(self.penalties))
+        await just_db.bulk_update(Company.__tablename__, [
+            ({"id": company_id}, {"$inc": {
+                "balance": self.balances.get(company_id, 0),
+                "reputation": -self.penalties.get(company_id, 0)
+            }})
+            for company_id in changed_ids
+        ])
+        await just_db.bulk_update(Company.__tablename__, [
+            ({"id": company_id}, {"$max": {"reputation": 0}})
+            for company_id in changed_ids if self.penalties.get(company_id)
+        ])
+
+        changed: list[tuple[Company, int, int]] = []
+        if changed_ids:
+            updated: list[Company] = await just_db.find(
+                Company.__tablename__, to_class=Company,
+                id={"$in": changed_ids}) # type: ignore
+
+            for company in updated:
+                old = companies[company.id]
+                changed.append((company, old.balance, old.reputation))
+
+                report = self._report(company.id)
+                report["balance"] = {"old": old.balance, "new": company.balance}
+                report["reputation"] = {"old": old.reputation, "new": company.reputation}
+
+        # Завершившиеся контракты удаляются одним запросом
+        if ended:
+            await just_db.delete(
+                Contract.__tablename__, session_id=self.session_id,
+                id={"$in": [contract.id for contract in ended]})
+            for contract in ended:
+                contract_index.remove(contract)
+
+            # Пособытийные уведомления, которые слушают бот и веб
+            for contract in self.expired:
+                await websocket_manager.broadcast({
+                    "type": "api-contract_expired",
+                    "data": {
+                        "session_id": self.session_id,
+                        "contract_id": contract.id,
+                        "reason": "Контракт не был принят до конца хода"
+                    }
+                })
+            for contract in self.missed:
+                await websocket_manager.broadcast({
+                    "type": "api-contract_cancelled",
+                    "data": {
+                        "session_id": self.session_id,
+                        "contract_id": contract.id,
+                        "reason": "Поставщик не смог выполнить поставку"
+                    }
+                })
+            for contract in ended:
+                await websocket_manager.broadcast({
+                    "type": "api-contract_deleted",
+                    "data": {
+                        "session_id": self.session_id,
+                        "contract_id": contract.id
+                    }
+                })
+
+        delivered = [contract for contract in self.continued if contract.delivered_this_turn]
+        if delivered:
+            await just_db.update(
+                Contract.__tablename__,
+                {"session_id": self.session_id,
+                 "id": {"$in": [contract.id for contract in delivered]}},
+                {"delivered_this_turn": False}
+            )
+            for contract in delivered:
+                contract.delivered_this_turn = False
+                contract_index.upsert(contract)
+
+        for company_id, report in self.reports.items():
+            await websocket_manager.broadcast({
+                "type": "api-contracts_settled",
+                "data": {
+                    "session_id": self.session_id,
+                    "company_id": company_id,
+                    "step": self.step,
+                    **report
+                }
+            })
+
+        for company, old_balance, old_reputation in changed:
+            if company.reputation != old_reputation and \
+                    company.reputation <= REPUTATION.prison.on_reputation:
+                await company.to_prison(
+                    "Достигнута критическая репутация для получения санкций. "
+                    f"Репутация снижена на {old_reputation - company.reputation} за невыполнение контрактов."
+                )
+
+        game_logger.info(f"Расчёт контрактов сессии {self.session_id} за ход {self.step}: истекло {len(self.expired)}, отменено {len(self.missed)}, продолжается {len(self.continued)}.")
+
+
+class ContractIndex:
+    """ Индекс контрактов сессии в памяти
+
+        Для каждой компании хранит множества id по статусам:
+        active (принятые), pending (ждут принятия) и expired (завершились,
+        отменены или истекли за текущий ход). Списки и количество контрактов
+        компании отдаются без запросов в базу. Обновляется из Contract.insert,
+        save_to_base и delete. Хранит и отдаёт копии контрактов, изменения
+        вызывающего кода попадают в индекс только через эти методы.
+    """
+
+    statuses = ("active", "pending", "expired")
+
+    def __init__(self):
+        # {session_id: {contract_id: Contract}}
+        self._contracts: dict[str, dict[int, Contract]] = {}
+        # {session_id: {company_id: {status: {contract_id}}}}
+        self._by_company: dict[str, dict[int, dict[str, set[int]]]] = {}
+        # {session_id: {contract_id: Contract}} - завершившиеся за ход
+        self._expired: dict[str, dict[int, Contract]] = {}
+
+        self._loading: dict[str, list[tuple]] = {}
+        self._locks: dict[str, asyncio.Lock] = {}
+
+    def _company_sets(self, session_id: str, company_id: int) -> dict[str, set[int]]:
+        companies = self._by_company[session_id]
+        if company_id not in companies:
+            companies[company_id] = {status: set() for status in self.statuses}
+        return companies[company_id]
+
+    def _sides(self, contract: Contract) -> set[int]:
+        return {contract.supplier_company_id, contract.customer_company_id}
+
+    def _apply_upsert(self, contract: Contract, created: bool = False):
+        session_id = contract.session_id
+        if contract.id in self._expired[session_id]:
+            # Сохранение уже удалённого контракта не возвращает его в индекс,
+            # новый контракт мог получить освободившийся id
+            if not created: return
+            old = self._expired[session_id].pop(contract.id)
+            for company_id in self._sides(old):
+                self._company_sets(session_id, company_id)["expired"].discard(contract.id)
+
+        self._apply_discard(session_id, contract.id)
+
+        self._contracts[session_id][contract.id] = copy.copy(contract)
+        for company_id in self._sides(contract):
+            self._company_sets(session_id, company_id)[contract.status()].add(contract.id)
+
+    def _apply_discard(self, session_id: str, contract_id: int) -> Optional[Contract]:
+        old = self._contracts[session_id].pop(contract_id, None)
+        if old:
+            for company_id in self._sides(old):
+                sets = self._company_sets(session_id, company_id)
+                sets["active"].discard(contract_id)
+                sets["pending"].discard(contract_id)
+        return old
+
+    def _apply_remove(self, contract: Contract):
+        session_id = contract.session_id
+        self._apply_discard(session_id, contract.id)
+
+        self._expired[session_id][contract.id] = copy.copy(contract)
+        for company_id in self._sides(contract):
+            self._company_sets(session_id, company_id)["expired"].add(contract.id)
+
+    def upsert(self, contract: Contract, created: bool = False):
+        if contract.session_id in self._loading:
+            self._loading[contract.session_id].append(
+                ("create" if created else "upsert", contract))
+        elif contract.session_id in self._contracts:
+            self._apply_upsert(contract, created)
+
+    def remove(self, contract: Contract):
+        if contract.session_id in self._loading:
+            self._loading[contract.session_id].append(("remove", contract))
+        elif contract.session_id in self._contracts:
+            self._apply_remove(contract)
+
+    async def _ensure_loaded(self, session_id: str):
+        if session_id in self._contracts: return
+
+        lock = self._locks.setdefault(session_id, asyncio.Lock())
+        async with lock:
+            if session_id in self._contracts: return
+
+            self._loading[session_id] = []
+            try:
+                contracts: list[Contract] = await just_db.find(
+                    Contract.__tablename__, to_class=Contract,
+                    session_id=session_id) # type: ignore
+            except Exception:
+                self._loading.pop(session_id, None)
+                raise
+
+            self._contracts[session_id] = {}
+            self._by_company[session_id] = {}
+            self._expired[session_id] = {}
+            for contract in contracts:
+                self._apply_upsert(contract)
+
+            for operation, contract in self._loading.pop(session_id):
+                if operation == "remove":
+                    self._apply_remove(contract)
+                else:
+                    self._apply_upsert(contract, created=operation == "create")
+
+    async def get_company_contracts(self, session_id: str, company_id: int,
+                                    status: Optional[str] = None) -> list[Contract]:
+        """ Контракты компании (обе стороны). Без status - все записанные в базе
+            (принятые и ожидающие принятия). Возвращаются копии: индекс
+            обновляется только через save_to_base / delete
+        """
+        await self._ensure_loaded(session_id)
+        sets = self._company_sets(session_id, company_id)
+
+        if status == "expired":
+            expired = self._expired[session_id]
+            return [copy.copy(expired[i]) for i in sorted(sets["expired"])]
+
+        ids = sets[status] if status else sets["active"] | sets["pending"]
+        contracts = self._contracts[session_id]
+        return [copy.copy(contracts[i]) for i in sorted(ids)]
+
+    async def count(self, session_id: str, company_id: int,
+                    status: Optional[str] = None) -> int:
+        """ Количество контрактов компании. Без status - активные и ожидающие """
+        await self._ensure_loaded(session_id)
+        sets = self._company_sets(session_id, company_id)
+
+        if status: return len(sets[status])
+        return len(sets["active"]) + len(sets["pending"])
+
+    async def get_session_contracts(self, session_id: str) -> list[Contract]:
+        """ Все текущие контракты сессии (копии) """
+        await self._ensure_loaded(session_id)
+        contracts = self._contracts[session_id]
+        return [copy.copy(contracts[i]) for i in sorted(contracts)]
+
+    def start_step(self, session_id: str):
+        """ Новый ход: сбрасывает список завершившихся контрактов """
+        if session_id not in self._expired: return
+
+        self._expired[session_id] = {}
+        for sets in self._by_company[session_id].values():
+            sets["expired"].clear()
+
+    def invalidate(self, session_id: str):
+        self._contracts.pop(session_id, None)
+        self._by_company.pop(session_id, None)
+        self._expired.pop(session_id, None)
+
+
+contract_index = ContractIndex()
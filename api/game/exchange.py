@@ -1,4 +1,7 @@
 
+import asyncio
+from bisect import bisect_left, bisect_right, insort
+from heapq import merge
 from typing import Optional, Literal
 from game.session import SessionObject
 from global_modules.models.cells import Cells
@@ -89,13 +92,11 @@ class Exchange(BaseClass, SessionObject):
         if offer_type == 'money':
             if price <= 0:
                 raise ValueError("Цена должна быть положительным целым числом.")
-            from game.item_price import ItemPrice
+            from game.item_price import item_price_cache
 
-            item_price = await ItemPrice().create(
-                session_id=self.session_id,
-                item_id=sell_resource
+            average_price = await item_price_cache.get_price(
+                session_id, sell_resource
             )
-            average_price = item_price.get_effective_price()
 
             if abs((price // sell_amount_per_trade) - average_price) / average_price > 0.5:
                 raise ValueError(f"Цена отличается от средней более чем на 50%. Средняя цена: {average_price}, выставленная цена (за 1): {price // sell_amount_per_trade}. Выставите цену в диапазоне от {int(average_price * 0.5) * sell_amount_per_trade} до {int(average_price * 1.5) * sell_amount_per_trade}.")
@@ -132,6 +133,8 @@ class Exchange(BaseClass, SessionObject):
             await self.delete()
             raise ValueError(f"Не удалось зарезервировать ресурсы: {str(e)}")
 
+        order_book.upsert(self)
+
         await websocket_manager.broadcast({
             "type": "api-exchange_offer_created",
             "data": {
@@ -140,6 +143,10 @@ class Exchange(BaseClass, SessionObject):
             }
         })
 
+        # Встречные заявки на покупку исполняются сразу
+        from game.buy_order import exchange_matcher
+        await exchange_matcher.match_sell_offer(self)
+
         return self
 
     async def update_offer(self, 
@@ -149,44 +156,57 @@ class Exchange(BaseClass, SessionObject):
                     ):
         """ Изменение параметров предложения
 
+        Выполняется под блокировкой биржи сессии и пишет только изменённые поля,
+        чтобы не затереть параллельные продажи (total_stock)
+
         Args:
             sell_amount_per_trade: Новое количество за одну сделку
             price: Новая цена (для money)
             barter_amount: Новое количество для обмена (для barter)
         """
+        from game.buy_order import exchange_matcher
 
-        if sell_amount_per_trade is not None:
-            if sell_amount_per_trade <= 0:
-                raise ValueError("Количество для продажи должно быть положительным.")
+        async with exchange_matcher.lock(self.session_id):
+            if not await self.reupdate():
+                raise ValueError("Предложение не найдено.")
 
-            if sell_amount_per_trade > self.total_stock:
-                raise ValueError("Количество для продажи не может превышать общий запас.")
-            self.sell_amount_per_trade = sell_amount_per_trade
+            changes = {}
 
-        if self.offer_type == 'money' and price is not None:
-            if price <= 0:
-                raise ValueError("Цена должна быть положительной.")
+            if sell_amount_per_trade is not None:
+                if sell_amount_per_trade <= 0:
+                    raise ValueError("Количество для продажи должно быть положительным.")
 
-            from game.item_price import ItemPrice
+                if sell_amount_per_trade > self.total_stock:
+                    raise ValueError("Количество для продажи не может превышать общий запас.")
+                changes["sell_amount_per_trade"] = sell_amount_per_trade
 
-            item_price = await ItemPrice().create(
-                session_id=self.session_id,
-                item_id=self.sell_resource
-            )
-            average_price = item_price.get_effective_price()
+            if self.offer_type == 'money' and price is not None:
+                if price <= 0:
+                    raise ValueError("Цена должна быть положительной.")
 
-            if abs((price // self.sell_amount_per_trade) - average_price) / average_price > 0.5:
-                raise ValueError(f"Цена отличается от средней более чем на 50%. Средняя цена: {average_price}, выставленная цена: {price}")
+                from game.item_price import item_price_cache
 
-            self.price = price
+                average_price = await item_price_cache.get_price(
+                    self.session_id, self.sell_resource
+                )
 
-        if self.offer_type == \
-                'barter' and barter_amount is not None:
-            if barter_amount <= 0:
-                raise ValueError("Количество для бартера должно быть положительным.")
-            self.barter_amount = barter_amount
+                amount_per_trade = changes.get("sell_amount_per_trade", self.sell_amount_per_trade)
+                if abs((price // amount_per_trade) - average_price) / average_price > 0.5:
+                    raise ValueError(f"Цена отличается от средней более чем на 50%. Средняя цена: {average_price}, выставленная цена: {price}")
 
-        await self.save_to_base()
+                changes["price"] = price
+
+            if self.offer_type == \
+                    'barter' and barter_amount is not None:
+                if barter_amount <= 0:
+                    raise ValueError("Количество для бартера должно быть положительным.")
+                changes["barter_amount"] = barter_amount
+
+            if changes:
+                await just_db.update(self.__tablename__, {self.__unique_id__: self.id}, changes)
+                for key, value in changes.items():
+                    setattr(self, key, value)
+                order_book.upsert(self)
 
         await websocket_manager.broadcast({
             "type": "api-exchange_offer_updated",
@@ -197,10 +217,22 @@ class Exchange(BaseClass, SessionObject):
             }
         })
 
+        # Новая цена могла пересечься с заявками на покупку
+        await exchange_matcher.match_sell_offer(self)
+
         return self
 
     async def cancel_offer(self):
         """ Отмена предложения (возврат товара компании) """
+        from game.buy_order import exchange_matcher
+
+        async with exchange_matcher.lock(self.session_id):
+            if not await self.reupdate():
+                raise ValueError("Предложение не найдено.")
+
+            await self._execute_cancel()
+
+    async def _execute_cancel(self):
         from game.company import Company
 
         company = await Company(id=self.company_id).reupdate()
@@ -240,6 +272,16 @@ class Exchange(BaseClass, SessionObject):
             buyer_company_id: ID компании-покупателя
             quantity: Количество сделок (по умолчанию 1)
         """
+        from game.buy_order import exchange_matcher
+
+        # Не даём ручной покупке пересечься с автоматическим сопоставлением
+        async with exchange_matcher.lock(self.session_id):
+            if not await self.reupdate():
+                raise ValueError("Предложение не найдено.")
+
+            return await self._execute_buy(buyer_company_id, quantity)
+
+    async def _execute_buy(self, buyer_company_id: int, quantity: int):
         from game.company import Company
         from game.logistics import Logistics
         from game.item_price import ItemPrice
@@ -301,7 +343,8 @@ class Exchange(BaseClass, SessionObject):
                 to_company_id=seller.id,
                 resource_type=self.barter_resource,
                 amount=total_barter_amount,
-                session_id=self.session_id
+                session_id=self.session_id,
+                source=f"exchange:{self.id}"
             )
 
         await Logistics().create(
@@ -310,7 +353,8 @@ class Exchange(BaseClass, SessionObject):
             to_company_id=buyer.id,
             resource_type=self.sell_resource,
             amount=total_sell_amount,
-            session_id=self.session_id
+            session_id=self.session_id,
+            source=f"exchange:{self.id}"
         )
 
         item_price = await ItemPrice().create(
@@ -320,7 +364,8 @@ class Exchange(BaseClass, SessionObject):
         await item_price.add_popularity(quantity)
 
         if unit_price > 0:
-            await session.update_item_price(self.sell_resource, unit_price)
+            await session.update_item_price(
+                self.sell_resource, unit_price, total_sell_amount)
 
         await seller.set_economic_power(
             total_sell_amount, self.sell_resource, 'exchange'
@@ -333,6 +378,7 @@ class Exchange(BaseClass, SessionObject):
             await self.delete()
         else:
             await self.save_to_base()
+            order_book.upsert(self)
 
         await websocket_manager.broadcast({
             "type": "api-exchange_trade_completed",
@@ -370,9 +416,17 @@ class Exchange(BaseClass, SessionObject):
             "created_at_step": self.created_at_step
         }
 
+    def unit_price(self) -> float:
+        """ Цена за единицу товара: монеты для money, бартерный ресурс для barter """
+        if self.sell_amount_per_trade <= 0: return 0
+        if self.offer_type == 'barter':
+            return self.barter_amount / self.sell_amount_per_trade
+        return self.price / self.sell_amount_per_trade
+
     async def delete(self):
         """ Удаление предложения из базы данных """
         await just_db.delete(self.__tablename__, **{self.__unique_id__: self.id})
+        order_book.remove(self.session_id, self.id)
 
         await websocket_manager.broadcast({
             "type": "api-exchange_offer_deleted",
@@ -382,4 +436,147 @@ class Exchange(BaseClass, SessionObject):
             }
         })
 
-        return True
\ No newline at end of file
+        return True
+
+
+class OrderBook:
+    """ Стакан предложений биржи в памяти
+
+        Для каждой сессии предложения разложены по ключу (sell_resource, offer_type)
+        и отсортированы по цене за единицу, затем по id (порядку создания).
+        Поддерживается в Exchange.create, update_offer, buy, cancel_offer и delete,
+        поэтому лучшие предложения, диапазоны цен и страницы отдаются без запросов в базу.
+    """
+
+    def __init__(self):
+        # {session_id: {(sell_resource, offer_type): [(unit_price, id)]}}
+        self._books: dict[str, dict[tuple[str, str], list[tuple]]] = {}
+        # {session_id: {id: (ключ стакана, запись в стакане, данные предложения)}}
+        self._offers: dict[str, dict[int, tuple]] = {}
+        # Изменения, пришедшие во время загрузки сессии из базы
+        self._loading: dict[str, list[tuple]] = {}
+        self._locks: dict[str, asyncio.Lock] = {}
+
+    def _apply_upsert(self, session_id: str, offer: Exchange):
+        self._apply_remove(session_id, offer.id)
+
+        book_key = (offer.sell_resource, offer.offer_type)
+        entry = (offer.unit_price(), offer.id)
+
+        insort(self._books[session_id].setdefault(book_key, []), entry)
+        self._offers[session_id][offer.id] = (
+            book_key, entry, dict(offer.to_dict(), unit_price=entry[0]))
+
+    def _apply_remove(self, session_id: str, offer_id: int):
+        stored = self._offers[session_id].pop(offer_id, None)
+        if not stored: return
+
+        book_key, entry, _ = stored
+        entries = self._books[session_id][book_key]
+        index = bisect_left(entries, entry)
+        if index < len(entries) and entries[index] == entry:
+            entries.pop(index)
+        if not entries:
+            del self._books[session_id][book_key]
+
+    def upsert(self, offer: Exchange):
+        """ Добавить или обновить предложение в стакане """
+        session_id = offer.session_id
+        if session_id in self._loading:
+            self._loading[session_id].append(("upsert", offer))
+        elif session_id in self._books:
+            self._apply_upsert(session_id, offer)
+
+    def remove(self, session_id: str, offer_id: int):
+        """ Убрать предложение из стакана """
+        if session_id in self._loading:
+            self._loading[session_id].append(("remove", offer_id))
+        elif session_id in self._books:
+            self._apply_remove(session_id, offer_id)
+
+    def invalidate(self, session_id: str):
+        self._books.pop(session_id, None)
+        self._offers.pop(session_id, None)
+
+    async def _ensure_loaded(self, session_id: str):
+        if session_id in self._books: return
+
+        lock = self._locks.setdefault(session_id, asyncio.Lock())
+        async with lock:
+            if session_id in self._books: return
+
+            self._loading[session_id] = []
+            try:
+                offers: list[Exchange] = await just_db.find(
+                    Exchange.__tablename__, to_class=Exchange,
+                    session_id=session_id) # type: ignore
+            except Exception:
+                self._loading.pop(session_id, None)
+                raise
+
+            self._books[session_id] = {}
+            self._offers[session_id] = {}
+            for offer in offers:
+                self._apply_upsert(session_id, offer)
+
+            for operation, value in self._loading.pop(session_id):
+                if operation == "upsert":
+                    self._apply_upsert(session_id, value)
+                else:
+                    self._apply_remove(session_id, value)
+
+    async def query(self, session_id: str,
+                    sell_resource: Optional[str] = None,
+                    offer_type: Optional[str] = None,
+                    company_id: Optional[int] = None,
+                    min_price: Optional[float] = None,
+                    max_price: Optional[float] = None,
+                    after: Optional[tuple] = None,
+                    offset: int = 0,
+                    limit: Optional[int] = None
+                    ) -> tuple[list[dict], int]:
+        """ Предложения сессии по возрастанию цены за единицу
+
+            min_price / max_price - границы цены за единицу (включительно)
+            after - (unit_price, id) последнего предложения предыдущей страницы
+            Возвращает (страница предложений, общее количество подходящих)
+        """
+        await self._ensure_loaded(session_id)
+
+        books = self._books[session_id]
+        offers = self._offers[session_id]
+
+        selected = []
+        for (resource, o_type), entries in books.items():
+            if sell_resource is not None and resource != sell_resource: continue
+            if offer_type is not None and o_type != offer_type: continue
+
+            start = 0 if min_price is None else bisect_left(entries, (min_price,))
+            end = len(entries) if max_price is None else bisect_right(
+                entries, (max_price, float('inf')))
+            selected.append(entries[start:end])
+
+        ordered = selected[0] if len(selected) == 1 else list(merge(*selected))
+        if company_id is not None:
+            ordered = [entry for entry in ordered
+                       if offers[entry[1]][2]["company_id"] == company_id]
+
+        total = len(ordered)
+        if after is not None:
+            ordered = ordered[bisect_right(ordered, tuple(after)):]
+
+        page = ordered[offset:] if limit is None else ordered[offset:offset + limit]
+
+        return [offers[entry[1]][2] for entry in page], total
+
+    async def best(self, session_id: str, sell_resource: str,
+                   offer_type: str = 'money', count: int = 1) -> list[dict]:
+        """ Лучшие (самые дешёвые за единицу) предложения по ресурсу """
+        offers, _ = await self.query(
+            session_id, sell_resource=sell_resource,
+            offer_type=offer_type, limit=count
+        )
+        return offers
+
+
+order_book = OrderBook()
@@ -65,12 +65,19 @@ class Factory(BaseClass, SessionObject):
         await websocket_manager.broadcast({
             "type": "api-factory-create",
             "data": {
+                "session_id": await self.get_session_id(),
                 "factory": await self.to_dict(),
                 "company_id": self.company_id
             }
         })
         return self
 
+    async def get_session_id(self) -> Optional[str]:
+        """ Сессия фабрики (по компании-владельцу)
+        """
+        company = await just_db.find_one("companies", id=self.company_id)
+        return company["session_id"] if company else None
+
     @property
     async def is_working(self) -> bool:
         """ Проверка, работает ли фабрика
@@ -136,6 +143,7 @@ class Factory(BaseClass, SessionObject):
         await websocket_manager.broadcast({
             "type": "api-factory-start-complectation",
             "data": {
+            'session_id': company.session_id if company else None,
             'factory_id': self.id,
             'company_id': self.company_id
             }
@@ -166,6 +174,7 @@ class Factory(BaseClass, SessionObject):
                 await websocket_manager.broadcast({
                     "type": "api-factory-end-complectation",
                     "data": {
+                        'session_id': company.session_id,
                         'factory_id': self.id,
                         'company_id': self.company_id
                     }
@@ -268,6 +277,7 @@ class Factory(BaseClass, SessionObject):
                 await websocket_manager.broadcast({
                     "type": "api-factory-end-production",
                     "data": {
+                        'session_id': company.session_id,
                         'factory_id': self.id,
                         'company_id': self.company_id
                     }
@@ -344,6 +354,7 @@ class Factory(BaseClass, SessionObject):
         """
         company_id = self.company_id
         factory_id = self.id
+        session_id = await self.get_session_id()
 
         await self.__db_object__.delete(self.__tablename__, 
                                   **{self.__unique_id__: self.id})
@@ -351,6 +362,7 @@ class Factory(BaseClass, SessionObject):
         await websocket_manager.broadcast({
             "type": "api-factory-delete",
             "data": {
+                "session_id": session_id,
                 "factory_id": factory_id,
                 "company_id": company_id
             }
@@ -5,7 +5,7 @@ from global_modules.db.baseclass import BaseClass
 from modules.db import just_db
 from global_modules.load_config import ALL_CONFIGS, Resources, Improvements, Settings, Capital, Reputation
 from modules.utils import *
-from modules.websocket_manager import websocket_manager
+from modules.price_ticker import price_ticker
 
 RESOURCES: Resources = ALL_CONFIGS["resources"]
 CELLS: Cells = ALL_CONFIGS['cells']
@@ -17,6 +17,21 @@ REPUTATION: Reputation = ALL_CONFIGS['reputation']
 RESET = 100
 ON_EVERY = 8
 
+# Порядок пересчёта материальных цен: материалы раньше продуктов
+PRODUCTION_ORDER: list[str] = RESOURCES.get_production_order()
+
+
+def _effective_price(current_price: int,
+                     average_price: float | None,
+                     material_based_price: int) -> int:
+    """ Итоговая цена: материальная, если она выше средней рыночной
+    """
+    if material_based_price > 0 and average_price is not None:
+        if material_based_price > average_price:
+            return material_based_price
+
+    return current_price
+
 class ItemPrice(BaseClass, SessionObject):
 
     __tablename__ = "item_price"
@@ -26,21 +41,107 @@ class ItemPrice(BaseClass, SessionObject):
     def __init__(self, id: str = ""):
         self.id: str = id
         self.session_id: str = ""
-        self.prices: list[int] = []
         self.current_price: int = 0
         self.material_based_price: int = 0
 
+        # Кольцевой буфер последних RESET цен и агрегаты для среднего
+        self.prices: list[int] = [0] * RESET  # Слоты буфера
+        self.prices_head: int = 0  # Индекс слота для следующей записи
+        self.prices_filled: int = 0  # Сколько слотов буфера заполнено
+        self.prices_sum: int = 0  # Сумма цен с последнего сброса
+        self.prices_count: int = 0  # Количество цен с последнего сброса
+
         self.popularity: int = 0  # Как часто покупают этот товар
         self.popularity_on_step: int = 0  # Популярность за текущий шаг
 
         self.price_on_last_step: int = 0  # Цена на последнем шаге
 
+        self._dirty_slots: set[int] = set()  # Изменённые слоты буфера для сохранения
+
+    def load_from_base(self, data):
+        res = super().load_from_base(data)
+
+        # Старый формат: prices - список цен с последнего сброса без агрегатов
+        if res and 'prices_count' not in data:
+            legacy_prices = list(self.prices)[-RESET:]
+
+            self.prices = [0] * RESET
+            self.prices_head = 0
+            self.prices_filled = 0
+            self.prices_sum = sum(legacy_prices)
+            self.prices_count = len(legacy_prices)
+
+            for price in legacy_prices:
+                self._write_slot(price)
+            # При следующем сохранении буфер перезапишется целиком
+            self._dirty_slots = set(range(RESET))
+
+        return res
+
+    async def reupdate(self):
+        res = self.load_from_base(
+            await just_db.find_one(self.__tablename__,
+                                   id=self.id, session_id=self.session_id)
+        )
+        if res: return self
+        return None
+
+    async def save_to_base(self):
+        """ Сохраняет документ целиком (id товара уникален только в рамках сессии)
+        """
+        data_to_save = {key: value for key, value in self.__dict__.items() if not key.startswith('_')}
+
+        await just_db.update(self.__tablename__,
+                             {"id": self.id, "session_id": self.session_id},
+                             data_to_save
+                             )
+        self._dirty_slots.clear()
+
+    async def _save_fields(self, *fields: str):
+        """ Сохраняет только указанные поля и изменённые слоты буфера цен
+        """
+        updates = {field: getattr(self, field) for field in fields}
+        for slot in self._dirty_slots:
+            updates[f"prices.{slot}"] = self.prices[slot]
+
+        await just_db.update(self.__tablename__,
+                             {"id": self.id, "session_id": self.session_id},
+                             updates
+                             )
+        self._dirty_slots.clear()
+
+    def _write_slot(self, price: int):
+        """ Записывает цену в кольцевой буфер истории
+        """
+        self.prices[self.prices_head] = price
+        self._dirty_slots.add(self.prices_head)
+
+        self.prices_head = (self.prices_head + 1) % RESET
+        self.prices_filled = min(self.prices_filled + 1, RESET)
+
+    def _push_price(self, price: int):
+        """ Добавляет цену в историю и в агрегаты среднего
+        """
+        self._write_slot(price)
+        self.prices_sum += price
+        self.prices_count += 1
+
+    def get_prices_history(self) -> list[int]:
+        """ Последние цены из кольцевого буфера в хронологическом порядке
+        """
+        start = (self.prices_head - self.prices_filled) % RESET
+        return [self.prices[(start + i) % RESET] for i in range(self.prices_filled)]
+
+    def get_average_price(self) -> float:
+        if self.prices_count <= 0:
+            return float(self.current_price)
+        return self.prices_sum / self.prices_count
 
     async def add_popularity(self, amount: int = 1):
         self.popularity += amount
         self.popularity_on_step += amount
 
-        await self.save_to_base()
+        await self._save_fields("popularity", "popularity_on_step")
         return True
 
     async def create(self, session_id: str, item_id: str) -> 'ItemPrice':
@@ -54,9 +155,9 @@ class ItemPrice(BaseClass, SessionObject):
             return self
 
         self.current_price = RESOURCES.resources[item_id].basePrice
-        self.prices = [self.current_price]
-        self.material_based_price = await self.calculate_material_price()
+        self._push_price(self.current_price)
         self.price_on_last_step = self.current_price
+        await item_price_cache.update_item(self)
 
         await self.insert()
         return self
@@ -69,7 +170,7 @@ class ItemPrice(BaseClass, SessionObject):
         return {
             "id": self.id,
             "session_id": self.session_id,
-            "prices": self.prices,
+            "prices": self.get_prices_history(),
             "current_price": self.current_price,
             "material_based_price": self.material_based_price,
             "popularity": self.popularity,
@@ -77,69 +178,180 @@ class ItemPrice(BaseClass, SessionObject):
             "price_on_last_step": self.price_on_last_step
         }
 
-    async def calculate_material_price(self) -> int:
-        resource = RESOURCES.resources.get(self.id)
-        if not resource or not resource.production:
-            return 0
-
-        total_cost = 0
-        for mat_id, qty in resource.production.materials.items():
-            mat_price_obj = await just_db.find_one("item_price", 
-                                        id=mat_id,
-                                        session_id=self.session_id,
-                                        to_class=ItemPrice
-                                        )
-            if mat_price_obj:
-                mat_price = mat_price_obj.get_effective_price()
-            else:
-                # Если нет в базе, использовать basePrice
-                mat_resource = RESOURCES.resources.get(mat_id)
-                mat_price = mat_resource.basePrice if mat_resource else 0
-            total_cost += mat_price * qty
-
-        # Цена за единицу выхода
-        return int(total_cost / resource.production.output)
-
     def get_effective_price(self) -> int:
-        if self.material_based_price > 0 and self.prices:
-            avg_price = sum(self.prices) / len(self.prices)
-
-            if self.material_based_price > avg_price:
-                return self.material_based_price
-
-        return self.current_price
+        return _effective_price(
+            self.current_price,
+            self.get_average_price() if self.prices_count > 0 else None,
+            self.material_based_price
+        )
 
     async def add_price(self, new_price: int):
-        self.prices.append(new_price)
+        self._push_price(new_price)
 
-        if len(self.prices) % ON_EVERY == 0:
+        if self.prices_count % ON_EVERY == 0:
             base_price = RESOURCES.resources[self.id].basePrice
-            self.prices.append(base_price)
+            self._push_price(base_price)
 
-        if len(self.prices) > RESET:
-            # Вычислить среднее из REST элементов и начать заново
-            avg_price = int(sum(self.prices) / len(self.prices))
-            self.prices = [avg_price]
+        if self.prices_count > RESET:
+            # Сворачиваем накопленное в одно среднее значение и начинаем заново
+            avg_price = int(self.prices_sum / self.prices_count)
+            self.prices_sum = avg_price
+            self.prices_count = 1
 
-        self.current_price = int(
-            sum(self.prices) / len(self.prices)
-            )
+        self.current_price = int(self.get_average_price())
 
-        self.material_based_price = await self.calculate_material_price()
-        await self.save_to_base()
+        # Пересчёт материальных цен этого товара и всех зависимых от него
+        changed_prices = await item_price_cache.update_item(self)
+        await self._save_fields(
+            "prices_head", "prices_filled", "prices_sum", "prices_count",
+            "current_price", "material_based_price"
+        )
 
-        await websocket_manager.broadcast({
-            "type": "api-item_price_updated",
-            "data": {
-                "item_id": self.id,
-                "session_id": self.session_id,
-                "price": self.get_effective_price(),
-            }
-        })
+        # Цены уходят клиентам пачкой в api-item_prices_tick
+        price_ticker.add(self.session_id, self.id, self.get_effective_price())
+        for item_id, price in changed_prices.items():
+            price_ticker.add(self.session_id, item_id, price)
 
     async def on_new_game_step(self):
         self.popularity_on_step = 0
         self.price_on_last_step = self.get_effective_price()
 
-        await self.save_to_base()
-        return True
\ No newline at end of file
+        await self._save_fields("popularity_on_step", "price_on_last_step")
+        return True
+
+
+class ItemPriceCache:
+    """ Кэш цен товаров по сессиям
+
+        Хранит рыночные агрегаты каждого товара и пересчитывает материальные
+        цены одним проходом по PRODUCTION_ORDER, поэтому изменение цены сырья
+        сразу доходит до всех продуктов, которые из него производятся.
+    """
+
+    def __init__(self):
+        # {session_id: {item_id: состояние цены}}
+        self._sessions: dict[str, dict[str, dict]] = {}
+
+    @staticmethod
+    def _state_of(item: ItemPrice) -> dict:
+        return {
+            "current_price": item.current_price,
+            "average_price": item.get_average_price() if item.prices_count > 0 else None,
+            "material_based_price": item.material_based_price
+        }
+
+    @staticmethod
+    def _effective_of(state: dict) -> int:
+        return _effective_price(
+            state["current_price"],
+            state["average_price"],
+            state["material_based_price"]
+        )
+
+    async def _get_states(self, session_id: str) -> dict[str, dict]:
+        states = self._sessions.get(session_id)
+        if states is None:
+            items: list[ItemPrice] = await just_db.find(
+                ItemPrice.__tablename__, to_class=ItemPrice,
+                session_id=session_id) # type: ignore
+            states = {item.id: self._state_of(item) for item in items}
+            self._sessions[session_id] = states
+        return states
+
+    def _recompute(self, states: dict[str, dict]) -> dict[str, int]:
+        """ Пересчитывает материальные цены в памяти
+            Возвращает {item_id: material_based_price} изменившихся товаров
+        """
+        effective: dict[str, int] = {}
+        changed: dict[str, int] = {}
+
+        for item_id in PRODUCTION_ORDER:
+            state = states.get(item_id)
+            if state is None: continue
+
+            production = RESOURCES.resources[item_id].production
+            material_price = 0
+            if production:
+                total_cost = 0
+                for mat_id, qty in production.materials.items():
+                    mat_price = effective.get(mat_id)
+                    if mat_price is None:
+                        # Если нет в базе, использовать basePrice
+                        mat_resource = RESOURCES.resources.get(mat_id)
+                        mat_price = mat_resource.basePrice if mat_resource else 0
+                    total_cost += mat_price * qty
+
+                # Цена за единицу выхода
+                material_price = int(total_cost / production.output)
+
+            if state["material_based_price"] != material_price:
+                state["material_based_price"] = material_price
+                changed[item_id] = material_price
+
+            effective[item_id] = self._effective_of(state)
+
+        return changed
+
+    async def _save_material_prices(self, session_id: str,
+                                    changed: dict[str, int],
+                                    exclude: str = ""):
+        for item_id, material_price in changed.items():
+            if item_id == exclude: continue
+            await just_db.update(ItemPrice.__tablename__,
+                                 {"id": item_id, "session_id": session_id},
+                                 {"material_based_price": material_price}
+                                 )
+
+    async def update_item(self, item: ItemPrice) -> dict[str, int]:
+        """ Обновляет цену товара в кэше и пересчитывает зависимые товары
+
+            Материальная цена самого товара записывается в item (сохраняет вызывающий),
+            цены зависимых товаров сохраняются здесь.
+            Возвращает {item_id: итоговая цена} других товаров, чья цена изменилась
+        """
+        states = await self._get_states(item.session_id)
+        before = {item_id: self._effective_of(state) for item_id, state in states.items()}
+
+        states[item.id] = self._state_of(item)
+        changed = self._recompute(states)
+        item.material_based_price = states[item.id]["material_based_price"]
+
+        await self._save_material_prices(item.session_id, changed, exclude=item.id)
+
+        return {
+            item_id: price for item_id, state in states.items()
+            if item_id != item.id and item_id in before
+            and (price := self._effective_of(state)) != before[item_id]
+        }
+
+    async def recompute_session(self, session_id: str):
+        """ Полный пересчёт цен сессии по данным из базы (раз в ход)
+        """
+        self._sessions.pop(session_id, None)
+        states = await self._get_states(session_id)
+
+        changed = self._recompute(states)
+        await self._save_material_prices(session_id, changed)
+
+    async def get_price(self, session_id: str, item_id: str) -> int:
+        """ Итоговая цена товара в сессии
+        """
+        states = await self._get_states(session_id)
+        state = states.get(item_id)
+        if state is None:
+            item = await ItemPrice().create(session_id, item_id)
+            return item.get_effective_price()
+
+        return self._effective_of(state)
+
+    async def get_prices(self, session_id: str) -> dict[str, int]:
+        """ Итоговые цены всех товаров сессии
+        """
+        states = await self._get_states(session_id)
+        return {item_id: self._effective_of(state) for item_id, state in states.items()}
+
+    def invalidate(self, session_id: str):
+        self._sessions.pop(session_id, None)
+
+
+item_price_cache = ItemPriceCache()
@@ -45,6 +45,9 @@ class Logistics(BaseClass, SessionObject):
         self.city_price: int = 0  # Цена за единицу при доставке в город
         self.created_step: int = 0  # На каком ходу была создана логистика
 
+        # Позиции консолидированного груза: [{'amount', 'city_price', 'source', 'delivered'}]
+        self.lines: list[dict] = []
+
     async def get_delivery_speed(self) -> float:
         """Возвращает скорость доставки в клетках за ход"""
         from game.company import Company
@@ -70,9 +73,20 @@ class Logistics(BaseClass, SessionObject):
                amount: int, from_company_id: int, 
                to_company_id: Optional[int] = None,
                to_city_id: Optional[int] = None,
-               sender_no_delete: bool = False
+               sender_no_delete: bool = False,
+               source: str = "",
+               city_price: Optional[int] = None
                ) -> 'Logistics':
-        """Создает новую логистическую доставку"""
+        """Создает новую логистическую доставку
+
+            Грузы с тем же маршрутом, ресурсом и ходом создания, которые ещё
+            не тронулись с места, объединяются в одну консолидированную
+            доставку с отдельной позицией на каждую отправку.
+
+            source - откуда пришла отправка (например "exchange:12", "contract:3")
+            city_price - цена за единицу, если спрос города уже зарезервирован
+                (Citie.reserve_demand), тогда спрос здесь не проверяется
+        """
         
         if resource_type not in RESOURCES.resources:
             raise ValueError("Неверный тип ресурса")
@@ -134,23 +148,26 @@ class Logistics(BaseClass, SessionObject):
             if not target_city:
                 raise ValueError("Город получатель не найден")
 
-            # Проверяем, что город принимает этот ресурс
-            if resource_type not in target_city.demands:
-                raise ValueError("Город не принимает этот ресурс")
+            if city_price is None:
+                # Проверяем, что город принимает этот ресурс
+                if resource_type not in target_city.demands:
+                    raise ValueError("Город не принимает этот ресурс")
+
+                # Проверяем, что города достаточно спроса
+                if amount > target_city.demands[resource_type]['amount']:
+                    raise ValueError(f"Город принимает только {target_city.demands[resource_type]['amount']} единиц этого ресурса")
 
-            # Проверяем, что города достаточно спроса
-            if amount > target_city.demands[resource_type]['amount']:
-                raise ValueError(f"Город принимает только {target_city.demands[resource_type]['amount']} единиц этого ресурса")
+                city_price = target_city.demands[resource_type]['price']
 
             self.destination_type = "city"
             self.to_company_id = 0
             self.to_city_id = to_city_id if to_city_id is not None else 0
             self.target_position = target_city.cell_position
-            self.city_price = target_city.demands[resource_type]['price']
+            self.city_price = city_price
 
             # Обновляем цену ресурса в сессии
             await session.update_item_price(
-                self.resource_type, self.city_price)
+                self.resource_type, self.city_price, amount)
 
         # Рассчитываем начальное расстояние до цели
         self.distance_left = self._calculate_distance()
@@ -160,6 +177,27 @@ class Logistics(BaseClass, SessionObject):
             await sender_company.remove_resource(
                 resource_type, amount)
 
+        line = {
+            "amount": amount,
+            "city_price": self.city_price,
+            "source": source,
+            "delivered": 0
+        }
+
+        # Пробуем дописать груз в уже существующую доставку по этому маршруту
+        if await self._merge_into_consignment(line):
+            await websocket_manager.broadcast({
+                "type": "api-logistics_merged",
+                "data": {
+                    "session_id": self.session_id,
+                    "logistics": self.to_dict(),
+                    "line": line
+                }
+            })
+            return self
+
+        self.lines = [line]
+
         # Сохраняем в базу
         await self.insert()
 
@@ -174,6 +212,38 @@ class Logistics(BaseClass, SessionObject):
 
         return self
 
+    async def _merge_into_consignment(self, line: dict) -> bool:
+        """Атомарно добавляет позицию в доставку с тем же маршрутом, ресурсом
+           и ходом создания, если она ещё стоит на точке отправления.
+           При успехе загружает объединённую доставку в текущий объект.
+        """
+
+        merged = await just_db.find_one_and_update(
+            self.__tablename__,
+            {
+                "session_id": self.session_id,
+                "resource_type": self.resource_type,
+                "from_company_id": self.from_company_id,
+                "to_company_id": self.to_company_id,
+                "to_city_id": self.to_city_id,
+                "destination_type": self.destination_type,
+                "created_step": self.created_step,
+                "status": "in_transit",
+                "current_position": self.current_position,
+                "lines": {"$exists": True}
+            },
+            {
+                "$inc": {"amount": line["amount"]},
+                "$push": {"lines": line}
+            }
+        )
+
+        if not merged:
+            return False
+
+        self.load_from_base(merged)
+        return True
+
     def _calculate_distance(self) -> float:
         """Рассчитывает манхэттенское расстояние между текущей и целевой позицией"""
 
@@ -215,6 +285,7 @@ class Logistics(BaseClass, SessionObject):
         await websocket_manager.broadcast({
             "type": "api-logistics_moved",
             "data": {
+                "session_id": self.session_id,
                 "logistics_id": self.id,
                 "new_position": self.current_position,
                 "distance_left": self.distance_left
@@ -283,12 +354,14 @@ class Logistics(BaseClass, SessionObject):
             # Полная доставка
             await target_company.add_resource(self.resource_type, self.amount)
 
+            self._mark_lines_delivered(self.amount)
             self.status = "delivered"
             await self.save_to_base()
 
             await websocket_manager.broadcast({
                 "type": "api-logistics_delivered",
                 "data": {
+                    "session_id": self.session_id,
                     "logistics_id": self.id,
                     "company_id": self.to_company_id,
                     "resource": self.resource_type,
@@ -306,6 +379,7 @@ class Logistics(BaseClass, SessionObject):
             await websocket_manager.broadcast({
                 "type": "api-logistics_waiting",
                 "data": {
+                    "session_id": self.session_id,
                     "logistics_id": self.id,
                     "reason": "insufficient_warehouse_space"
                 }
@@ -328,8 +402,8 @@ class Logistics(BaseClass, SessionObject):
             await self.save_to_base()
             return False
 
-        # Зачисляем деньги компании за проданный товар
-        total_payment = self.city_price * self.amount
+        # Зачисляем деньги компании за проданный товар (по цене каждой позиции)
+        total_payment = self.get_total_payment()
         await sender_company.add_balance(total_payment)
 
         # Добавляем экономическое влияние за продажу городу
@@ -338,12 +412,14 @@ class Logistics(BaseClass, SessionObject):
         )
 
         # Помечаем логистику как доставленную
+        self._mark_lines_delivered(self.amount)
         self.status = "delivered"
         await self.save_to_base()
 
         await websocket_manager.broadcast({
             "type": "api-logistics_delivered_to_city",
             "data": {
+                "session_id": self.session_id,
                 "logistics_id": self.id,
                 "city_id": self.to_city_id,
                 "company_id": self.from_company_id,
@@ -396,17 +472,20 @@ class Logistics(BaseClass, SessionObject):
             # Остаток теряется
             lost_amount = self.amount - delivered_amount
 
+            self._mark_lines_delivered(delivered_amount)
             self.status = "delivered"
             await self.save_to_base()
 
             await websocket_manager.broadcast({
                 "type": "api-logistics_partial_delivery",
                 "data": {
+                    "session_id": self.session_id,
                     "logistics_id": self.id,
                     "company_id": self.to_company_id,
                     "resource": self.resource_type,
                     "delivered_amount": delivered_amount,
-                    "lost_amount": lost_amount
+                    "lost_amount": lost_amount,
+                    "lines": self.lines
                 }
             })
 
@@ -419,6 +498,7 @@ class Logistics(BaseClass, SessionObject):
             await websocket_manager.broadcast({
                 "type": "api-logistics_failed",
                 "data": {
+                    "session_id": self.session_id,
                     "logistics_id": self.id,
                     "reason": "no_warehouse_space",
                     "lost_amount": self.amount
@@ -453,12 +533,14 @@ class Logistics(BaseClass, SessionObject):
         # Добавляем ресурсы компании
         await company.add_resource(self.resource_type, self.amount)
 
+        self._mark_lines_delivered(self.amount)
         self.status = "delivered"
         await self.save_to_base()
 
         await websocket_manager.broadcast({
             "type": "api-logistics_picked_up",
             "data": {
+                "session_id": self.session_id,
                 "logistics_id": self.id,
                 "company_id": company_id,
                 "resource": self.resource_type,
@@ -468,6 +550,111 @@ class Logistics(BaseClass, SessionObject):
 
         return True
 
+    @classmethod
+    async def pick_up_many(cls, company_id: int,
+                           logistics_ids: list[int]) -> list['Logistics']:
+        """Забирает несколько ожидающих грузов компании за один раз
+
+        Все грузы проверяются по одному снимку склада: либо помещаются
+        все, либо не забирается ни один. Зачисляются только грузы,
+        которые удалось перевести в delivered, склад - одним $inc.
+        """
+        from game.company import Company
+
+        ids = list(dict.fromkeys(logistics_ids))
+        if not ids:
+            raise ValueError("Не указаны грузы для получения")
+
+        company = cast(Company,
+                       await just_db.find_one("companies",
+                                              id=company_id,
+                                              to_class=Company
+                                              ))
+        if not company:
+            raise ValueError("Компания не найдена")
+
+        shipments: list[Logistics] = await just_db.find(
+            cls.__tablename__, to_class=cls,
+            id={"$in": ids}) # type: ignore
+
+        found = {logistics.id: logistics for logistics in shipments}
+        for logistics_id in ids:
+            logistics = found.get(logistics_id)
+            if not logistics:
+                raise ValueError(f"Логистика {logistics_id} не найдена")
+            if logistics.status != "waiting_pickup":
+                raise ValueError(f"Груз {logistics_id} не ожидает получения")
+            if logistics.to_company_id != company_id:
+                raise ValueError(f"Только компания-получатель может забрать груз {logistics_id}")
+
+        total_amount = sum(logistics.amount for logistics in shipments)
+        free_space = await company.get_warehouse_free_size()
+        if free_space < total_amount:
+            raise ValueError(f"Недостаточно места на складе: нужно {total_amount}, свободно {free_space}")
+
+        # Забираем условно по статусу: груз, полученный параллельным запросом,
+        # не зачисляется второй раз
+        claimed: list[Logistics] = []
+        for logistics in shipments:
+            logistics._mark_lines_delivered(logistics.amount)
+            document = await just_db.find_one_and_update(
+                cls.__tablename__,
+                {"id": logistics.id, "status": "waiting_pickup"},
+                {"$set": {"status": "delivered", "lines": logistics.lines}}
+            )
+            if document is None: continue
+
+            logistics.status = "delivered"
+            claimed.append(logistics)
+
+        if not claimed:
+            raise ValueError("Грузы уже получены")
+        shipments = claimed
+        total_amount = sum(logistics.amount for logistics in shipments)
+
+        resources: dict[str, int] = {}
+        for logistics in shipments:
+            resources[logistics.resource_type] = resources.get(
+                logistics.resource_type, 0) + logistics.amount
+
+        document = await just_db.find_one_and_update(
+            "companies", {"id": company_id},
+            {"$inc": {f"warehouses.{resource}": amount
+                      for resource, amount in resources.items()}}
+        )
+        company.load_from_base(document)
+
+        await websocket_manager.broadcast({
+            "type": "api-logistics_picked_up_batch",
+            "data": {
+                "session_id": company.session_id,
+                "company_id": company_id,
+                "logistics_ids": [logistics.id for logistics in shipments],
+                "resources": resources,
+                "amount": total_amount
+            }
+        })
+
+        return shipments
+
+    def get_total_payment(self) -> int:
+        """Сумма оплаты городом за весь груз (по цене каждой позиции)"""
+
+        if not self.lines:
+            return self.city_price * self.amount
+
+        return sum(
+            line["amount"] * line.get("city_price", self.city_price) for line in self.lines
+        )
+
+    def _mark_lines_delivered(self, delivered_amount: int):
+        """Распределяет доставленное количество по позициям в порядке их добавления"""
+
+        left = delivered_amount
+        for line in self.lines:
+            line["delivered"] = min(line["amount"], max(left, 0))
+            left -= line["amount"]
+
     async def delete(self) -> bool:
         """Удаляет логистическую доставку"""
 
@@ -476,6 +663,7 @@ class Logistics(BaseClass, SessionObject):
         await websocket_manager.broadcast({
             "type": "api-logistics_deleted",
             "data": {
+                "session_id": self.session_id,
                 "logistics_id": self.id
             }
         })
@@ -500,5 +688,6 @@ class Logistics(BaseClass, SessionObject):
             "distance_left": self.distance_left,
             "waiting_turns": self.waiting_turns,
             "city_price": self.city_price,
-            "created_step": self.created_step
+            "created_step": self.created_step,
+            "lines": self.lines
         }
\ No newline at end of file
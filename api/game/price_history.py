@@ -0,0 +1,121 @@
+from datetime import datetime
+from math import ceil
+from typing import Optional
+from modules.db import just_db
+
+
+class PriceHistory:
+    """ История цен товаров по сессиям
+
+        price_history - журнал сделок (только добавление):
+            session_id, item_id, step, tick, price, volume, ts
+        price_history_steps - свёртка за ход (OHLC):
+            session_id, item_id, step, open, high, low, close, volume, trades
+    """
+
+    ticks_table = "price_history"
+    steps_table = "price_history_steps"
+
+    async def record(self, session_id: str, item_id: str,
+                     step: int, price: int, volume: int = 0) -> int:
+        """ Записать сделку и обновить свёртку хода
+            Возвращает номер сделки (tick) внутри хода
+        """
+        rollup = await just_db.find_one_and_update(
+            self.steps_table,
+            {"session_id": session_id, "item_id": item_id, "step": step},
+            {
+                "$setOnInsert": {"open": price},
+                "$set": {"close": price},
+                "$max": {"high": price},
+                "$min": {"low": price},
+                "$inc": {"volume": volume, "trades": 1}
+            },
+            upsert=True
+        )
+        tick = rollup["trades"] if rollup else 1
+
+        await just_db.append(self.ticks_table, {
+            "session_id": session_id,
+            "item_id": item_id,
+            "step": step,
+            "tick": tick,
+            "price": price,
+            "volume": volume,
+            "ts": datetime.now()
+        })
+        return tick
+
+    async def get_series(self, session_id: str,
+                         item_ids: Optional[list[str]] = None,
+                         from_step: int = 0,
+                         to_step: Optional[int] = None,
+                         max_points: int = 0) -> dict[str, list[dict]]:
+        """ Серии OHLC по ходам для графиков
+
+            max_points > 0 объединяет соседние ходы в интервалы так,
+            чтобы в серии каждого товара было не больше max_points точек
+        """
+        conditions: dict = {"session_id": session_id}
+        if item_ids:
+            conditions["item_id"] = {"$in": item_ids}
+
+        step_range: dict = {"$gte": from_step}
+        if to_step is not None:
+            step_range["$lte"] = to_step
+        conditions["step"] = step_range
+
+        rollups = await just_db.find(
+            self.steps_table,
+            sort=[("item_id", 1), ("step", 1)],
+            **conditions
+        )
+
+        series: dict[str, list[dict]] = {}
+        for rollup in rollups:
+            series.setdefault(rollup["item_id"], []).append({
+                "step_from": rollup["step"],
+                "step_to": rollup["step"],
+                "open": rollup["open"],
+                "high": rollup["high"],
+                "low": rollup["low"],
+                "close": rollup["close"],
+                "volume": rollup["volume"],
+                "trades": rollup["trades"]
+            })
+
+        if max_points > 0:
+            series = {item_id: self._downsample(points, max_points)
+                      for item_id, points in series.items()}
+        return series
+
+    @staticmethod
+    def _downsample(points: list[dict], max_points: int) -> list[dict]:
+        if len(points) <= max_points: return points
+
+        first_step = points[0]["step_from"]
+        bucket_size = ceil((points[-1]["step_to"] - first_step + 1) / max_points)
+
+        buckets: list[dict] = []
+        for point in points:
+            bucket_start = first_step + (point["step_from"] - first_step) // bucket_size * bucket_size
+
+            if buckets and buckets[-1]["step_from"] == bucket_start:
+                bucket = buckets[-1]
+                bucket["step_to"] = point["step_to"]
+                bucket["high"] = max(bucket["high"], point["high"])
+                bucket["low"] = min(bucket["low"], point["low"])
+                bucket["close"] = point["close"]
+                bucket["volume"] += point["volume"]
+                bucket["trades"] += point["trades"]
+            else:
+                buckets.append(dict(point, step_from=bucket_start))
+
+        return buckets
+
+    async def delete_session(self, session_id: str):
+        await just_db.delete(self.ticks_table, session_id=session_id)
+        await just_db.delete(self.steps_table, session_id=session_id)
+
+
+price_history = PriceHistory()
@@ -21,6 +21,7 @@ from modules.db import just_db
 from modules.generate import generate_code
 from modules.logs import game_logger
 from modules.sheduler import scheduler
+from modules.price_ticker import price_ticker
 
 if TYPE_CHECKING:
     from game.user import User
@@ -124,6 +125,12 @@ class Session(BaseClass):
 
     async def update_stage(self, new_stage: SessionStages, 
                      whitout_shedule: bool = False):
+        # Клиенты с пакетной доставкой получат события перехода одним api-batch
+        async with websocket_manager.batch_scope(self.session_id):
+            return await self._update_stage(new_stage, whitout_shedule)
+
+    async def _update_stage(self, new_stage: SessionStages, 
+                     whitout_shedule: bool = False):
         from game.statistic import Statistic
 
         if not isinstance(new_stage, SessionStages):
@@ -149,8 +156,9 @@ class Session(BaseClass):
 
         elif new_stage == SessionStages.Game:
             from game.logistics import Logistics
-            from game.item_price import ItemPrice
-            from game.contract import Contract
+            from game.item_price import ItemPrice, item_price_cache
+            from game.contract import contract_index, ContractSettlement
+            from game.citie import CityDemandGenerator
 
             if self.step == 0:
                 companies = await self.companies
@@ -202,8 +210,7 @@ class Session(BaseClass):
                         self.step + 1)
 
             # Обновляем города
-            for city in await self.cities:
-                await city.on_new_game_stage()
+            await CityDemandGenerator.update_session(self)
 
             # Обновляем логистику
             logistics_list: list[Logistics] = await just_db.find(Logistics.__tablename__,
@@ -211,16 +218,20 @@ class Session(BaseClass):
             for logistics in logistics_list:
                 await logistics.on_new_turn()
 
+            # Пересчёт материальных цен сессии раз в ход
+            await item_price_cache.recompute_session(self.session_id)
+
             items_prices: list[ItemPrice] = await self.item_prices
             for item_price in items_prices:
                 await item_price.on_new_game_step()
 
-            session_contracts = await just_db.find(
-                Contract.__tablename__, Contract,
-                session_id=self.session_id
-            )
+            contract_index.start_step(self.session_id)
+            session_contracts = await contract_index.get_session_contracts(
+                self.session_id)
+            settlement = ContractSettlement(self.session_id, self.step)
             for contract in session_contracts:
-                await contract.on_new_game_step()
+                settlement.add(contract)
+            await settlement.apply()
 
             self.step += 1
             await self.execute_step_schedule(self.step)
@@ -295,8 +306,8 @@ class Session(BaseClass):
                             await company.get_factories()),
                         "exchanges": len(
                             await company.exchanges),
-                        "contracnts": len(
-                            await company.get_contracts()),
+                        "contracnts": 
+                            await company.count_contracts(),
                         "free_warehouse": 
                             await company.get_warehouse_free_size()
                     }
@@ -332,6 +343,9 @@ class Session(BaseClass):
         game_logger.info(
             f"В сессии {self.session_id} изменена стадия с {old_stage} на {self.stage}.")
 
+        # Цены, накопленные за стадию, уходят до события смены стадии
+        await price_ticker.flush(self.session_id)
+
         await websocket_manager.broadcast({
             "type": "api-update_session_stage",
             "data": {
@@ -344,18 +358,14 @@ class Session(BaseClass):
         return self
 
     async def execute_step_schedule(self, step):
-        from game.step_shedule import StepSchedule
+        from game.step_shedule import TurnContext, run_step_schedules
 
-        schedules: list[StepSchedule] = await just_db.find(
-            "step_schedule", session_id=self.session_id, in_step=step,
-            to_class=StepSchedule
-        )
+        summary = await run_step_schedules(TurnContext(self, step))
 
-        for schedule in schedules:
-            asyncio.create_task(schedule.execute())
-
-        game_logger.info(f"В сессии {self.session_id} выполнено {len(schedules)} запланированных задач для шага {step}.")
-        return True
+        game_logger.info(f"В сессии {self.session_id} выполнено {summary['executed']} запланированных функций из {summary['schedules']} расписаний для шага {step}.")
+        if summary["failed"]:
+            game_logger.error(f"В сессии {self.session_id} на шаге {step} с ошибкой завершились: {', '.join(map(str, summary['failed']))}")
+        return summary
 
     async def create_step_schedule(self, in_step: int, 
                              function, **kwargs):
@@ -539,32 +549,40 @@ class Session(BaseClass):
 
     async def _create_cities(self):
         """Создаёт города на клетках типа 'city'"""
-        from game.citie import Citie, NAMES
+        from game.citie import Citie, NAMES, CityDemandGenerator
+
+        from modules.utils import NeighbourhoodStats, get_occupied_branches
 
         cities_count = self.cell_counts['city']
         city_names = random.sample(NAMES, cities_count)
-        city_index = 0
 
+        occupied = await get_occupied_branches(self.session_id)
+        positions = []
         for index, cell_type in enumerate(self.cells):
             if cell_type == 'city':
                 # Вычисляем координаты из индекса
                 x = index // self.map_size["cols"]
                 y = index % self.map_size["cols"]
-                
-                # Проверяем, нет ли уже города на этой позиции
-                existing_city = await just_db.find_one(
-                    "cities", 
-                    session_id=self.session_id, 
-                    cell_position=f"{x}.{y}"
-                )
 
-                if not existing_city:
-                    city = await Citie().create(self.session_id, x, y,
-                                          city_names[city_index]
-                                        )
-                    city_index += 1
+                # Пропускаем позиции, где город уже есть
+                if (x, y) not in occupied:
+                    positions.append((x, y))
+
+        # Ветки всех городов карты за один проход по префиксным суммам
+        stats = NeighbourhoodStats(self.cells, self.map_size)
+        branches = stats.choose_branches(positions, occupied)
+
+        # Игроки, цены и эффекты события читаются один раз на все города
+        generator = await CityDemandGenerator.for_session(self)
+
+        for city_index, (x, y) in enumerate(positions):
+            city = await Citie().create(self.session_id, x, y,
+                                  city_names[city_index],
+                                  branch=branches[(x, y)],
+                                  generator=generator
+                                )
 
-                    game_logger.info(f"В сессии {self.session_id} создан город в позиции {x}.{y} с отраслью {city.branch}.")
+            game_logger.info(f"В сессии {self.session_id} создан город в позиции {x}.{y} с отраслью {city.branch}.")
 
     async def can_select_cell(self, 
             x: int, y: int, 
@@ -606,19 +624,9 @@ class Session(BaseClass):
     async def get_item_price(self, item_id: str) -> int:
         """ Получить цену предмета в данной сессии
         """
-        from game.item_price import ItemPrice
-        
-        item_price_data: dict = await just_db.find_one(
-                        "item_price", 
-                        id=item_id, 
-                        session_id=self.session_id) # type: ignore
-        if not item_price_data:
-            item_price_obj = await ItemPrice().create(self.session_id, item_id)
-            return item_price_obj.get_effective_price()
-        else:
-            item_price_obj = ItemPrice(item_id)
-            item_price_obj.load_from_base(item_price_data)
-            return item_price_obj.get_effective_price()
+        from game.item_price import item_price_cache
+
+        return await item_price_cache.get_price(self.session_id, item_id)
 
     async def initialize_all_item_prices(self):
         """ Инициализировать цены для всех предметов из конфига
@@ -634,10 +642,11 @@ class Session(BaseClass):
 
         return True
 
-    async def update_item_price(self, item_id: str, new_price: int):
-        """ Обновить цену предмета
+    async def update_item_price(self, item_id: str, new_price: int, volume: int = 0):
+        """ Обновить цену предмета и записать сделку в историю цен
         """
         from game.item_price import ItemPrice
+        from game.price_history import price_history
         
         item_price_data: dict = await just_db.find_one(
                         "item_price", 
@@ -651,15 +660,16 @@ class Session(BaseClass):
             item_price.load_from_base(item_price_data)
             
         await item_price.add_price(new_price)
+        await price_history.record(
+            self.session_id, item_id, self.step, new_price, volume)
         return item_price
 
     async def get_all_item_prices_dict(self) -> dict[str, int]:
         """ Получить словарь всех цен предметов в сессии
         """
-        prices_dict = {}
-        for item_price in await self.item_prices:
-            prices_dict[item_price.id] = item_price.get_effective_price()
-        return prices_dict
+        from game.item_price import item_price_cache
+
+        return await item_price_cache.get_prices(self.session_id)
 
     async def delete(self):
         for company in await self.companies: 
@@ -668,6 +678,23 @@ class Session(BaseClass):
         for city in await self.cities: await city.delete()
         for item_price in await self.item_prices: await item_price.delete()
 
+        from game.item_price import item_price_cache
+        item_price_cache.invalidate(self.session_id)
+        price_ticker.discard(self.session_id)
+
+        from game.price_history import price_history
+        await price_history.delete_session(self.session_id)
+
+        from game.exchange import order_book
+        order_book.invalidate(self.session_id)
+
+        from game.buy_order import exchange_matcher
+        await just_db.delete('buy_orders', session_id=self.session_id)
+        exchange_matcher.discard(self.session_id)
+
+        from game.contract import contract_index
+        contract_index.invalidate(self.session_id)
+
         await just_db.delete('logistics', 
                        session_id=self.session_id)
 
@@ -678,7 +705,7 @@ class Session(BaseClass):
                        session_id=self.session_id)
 
         if self.change_turn_schedule_id:
-            await just_db.delete("time_schedule", 
+            await scheduler.cancel_where(
                                  **{
                         "kwargs.session_id": self.session_id
                                   })
@@ -766,8 +793,8 @@ class Session(BaseClass):
                             await company.get_factories()),
                         "exchanges": len(
                             await company.exchanges),
-                        "contracnts": len(
-                            await company.get_contracts()),
+                        "contracnts": 
+                            await company.count_contracts(),
                         "free_warehouse": 
                             await company.get_warehouse_free_size()
                     }
@@ -826,21 +853,29 @@ class Session(BaseClass):
             }
         })
 
-        await just_db.delete("time_schedule", 
-                       id=self.change_turn_schedule_id)
+        await scheduler.cancel(self.change_turn_schedule_id)
 
 
-    async def get_time_to_next_stage(self) -> int:
-        """ Возвращает время в секундах до следующей стадии игры.
-            Если стадия не связана со временем, возвращает 0.
+    async def get_next_stage_at(self) -> Optional[datetime]:
+        """ Возвращает время следующей смены стадии.
+            Если стадия не связана со временем, возвращает None.
         """
 
         get_schedule: dict = await scheduler.get_scheduled_tasks(
             self.change_turn_schedule_id
             ) # type: ignore
         if get_schedule:
-            return int((datetime.fromisoformat(
-                get_schedule['execute_at']) - datetime.now()).total_seconds()) + 1
+            return datetime.fromisoformat(get_schedule['execute_at'])
+        return None
+
+    async def get_time_to_next_stage(self) -> int:
+        """ Возвращает время в секундах до следующей стадии игры.
+            Если стадия не связана со временем, возвращает 0.
+        """
+
+        next_stage_at = await self.get_next_stage_at()
+        if next_stage_at:
+            return int((next_stage_at - datetime.now()).total_seconds()) + 1
         return 0
 
     async def set_event(self, event_id: str, start_step: int, end_step: int):
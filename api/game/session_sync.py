@@ -0,0 +1,207 @@
+import asyncio
+import json
+from collections import deque
+from typing import Optional
+from global_modules.state_patch import diff
+from modules.logs import game_logger
+from modules.websocket_manager import websocket_manager
+
+# Задержка сборки патча после события сессии (мс): события одного перехода дают один патч
+SYNC_DEBOUNCE_MS = 200
+# Сколько последних патчей хранится для клиентов, догоняющих с известной версии
+PATCH_HISTORY = 64
+
+# Коллекции состояния, которые хранятся словарём по id (стабильные пути в патчах)
+KEYED_COLLECTIONS = ("companies", "users", "cities", "item_prices")
+
+
+class SessionStateSync:
+    """ Версионированная синхронизация состояния сессии
+
+        Подписчик получает снимок состояния с версией, дальше - патчи
+        api-session-state-patch {session_id, version, base_version, ops}.
+        Версия растёт на 1 с каждым патчем. Если base_version патча
+        не совпадает с версией клиента, клиент переподписывается со своей
+        версией и получает недостающие патчи (или новый снимок).
+
+        Состояние пересобирается не на каждое изменение, а после
+        broadcast-событий сессии с задержкой SYNC_DEBOUNCE_MS - одна
+        сборка на всех подписчиков. Пока у сессии нет подписчиков,
+        состояние не хранится и не пересобирается.
+    """
+
+    def __init__(self):
+        # {session_id: {client_id}}
+        self._subscribers: dict[str, set[str]] = {}
+        # {session_id: последнее разосланное состояние}
+        self._states: dict[str, dict] = {}
+        self._versions: dict[str, int] = {}
+        # {session_id: deque[(версия, операции)]}
+        self._history: dict[str, deque] = {}
+
+        self._timers: dict[str, asyncio.Task] = {}
+        self._locks: dict[str, asyncio.Lock] = {}
+
+    async def build_state(self, session_id: str) -> Optional[dict]:
+        """ Состояние сессии для синхронизации (None, если сессии нет) """
+        from game.session import Session
+
+        # Отдельный экземпляр: кэшированную сессию менеджера может в этот
+        # момент изменять смена стадии, reupdate() сбросил бы её несохранённые поля
+        session = await Session(session_id).reupdate()
+        if not session: return None
+
+        state = await session.to_dict()
+
+        # Оставшееся время меняется каждую секунду, в состоянии - момент смены стадии
+        state.pop("time_to_next_stage", None)
+        next_stage_at = await session.get_next_stage_at()
+        state["next_stage_at"] = next_stage_at.isoformat() if next_stage_at else None
+
+        for key in KEYED_COLLECTIONS:
+            state[key] = {str(item["id"]): item for item in state[key]}
+
+        # Ключи и значения в том виде, в каком их увидит JSON-клиент
+        return json.loads(json.dumps(state, ensure_ascii=False, default=str))
+
+    def _lock(self, session_id: str) -> asyncio.Lock:
+        return self._locks.setdefault(session_id, asyncio.Lock())
+
+    async def subscribe(self, client_id: str, session_id: str,
+                        version: Optional[int] = None) -> dict:
+        """ Подписать клиента на состояние сессии
+
+            С известной клиенту version возвращает только недостающие патчи,
+            если они ещё хранятся, иначе - снимок
+        """
+        async with self._lock(session_id):
+            if session_id not in self._states:
+                state = await self.build_state(session_id)
+                if state is None:
+                    raise ValueError("Сессия не найдена.")
+
+                self._states[session_id] = state
+                self._versions[session_id] = 1
+                self._history[session_id] = deque(maxlen=PATCH_HISTORY)
+
+            self._subscribers.setdefault(session_id, set()).add(client_id)
+            current = self._versions[session_id]
+
+            if version is not None and version <= current:
+                patches = [
+                    {"version": v, "base_version": v - 1, "ops": ops}
+                    for v, ops in self._history[session_id] if v > version
+                ]
+                if version == current or (patches and patches[0]["base_version"] == version):
+                    return {"session_id": session_id, "version": current, "patches": patches}
+
+            return {"session_id": session_id, "version": current,
+                    "snapshot": self._states[session_id]}
+
+    def unsubscribe(self, client_id: str, session_id: Optional[str] = None):
+        """ Отписать клиента от одной сессии или от всех """
+        session_ids = [session_id] if session_id else list(self._subscribers)
+
+        for sid in session_ids:
+            subscribers = self._subscribers.get(sid)
+            if subscribers is None: continue
+
+            subscribers.discard(client_id)
+            if not subscribers:
+                self._drop(sid)
+
+    def _drop(self, session_id: str):
+        self._subscribers.pop(session_id, None)
+        self._states.pop(session_id, None)
+        self._versions.pop(session_id, None)
+        self._history.pop(session_id, None)
+
+        timer = self._timers.pop(session_id, None)
+        if timer and timer is not asyncio.current_task():
+            timer.cancel()
+
+    def on_broadcast(self, message: dict):
+        """ Наблюдатель broadcast: событие сессии помечает её состояние устаревшим """
+        data = message.get("data")
+        if not isinstance(data, dict): return
+
+        session_id = data.get("session_id")
+        if session_id is None and "company_id" in data:
+            session_id = self._session_of_company(data["company_id"])
+        if session_id not in self._subscribers: return
+
+        if message.get("type") == "api-session_deleted":
+            self._drop(session_id)
+            return
+
+        if session_id not in self._timers:
+            self._timers[session_id] = asyncio.create_task(
+                self._publish_later(session_id))
+
+    def _session_of_company(self, company_id) -> Optional[str]:
+        """ Сессия компании по последнему разосланному состоянию """
+        for session_id, state in self._states.items():
+            if str(company_id) in state.get("companies", {}):
+                return session_id
+        return None
+
+    async def _publish_later(self, session_id: str):
+        try:
+            await asyncio.sleep(SYNC_DEBOUNCE_MS / 1000)
+        except asyncio.CancelledError:
+            return
+
+        self._timers.pop(session_id, None)
+        try:
+            await self.publish(session_id)
+        except Exception as e:
+            game_logger.error(f"Ошибка синхронизации состояния сессии {session_id}: {e}")
+
+    async def publish(self, session_id: str) -> Optional[int]:
+        """ Пересобрать состояние и разослать патч подписчикам
+
+            Возвращает новую версию (None, если изменений нет)
+        """
+        async with self._lock(session_id):
+            if session_id not in self._states: return None
+
+            # Отключившиеся клиенты выбывают из подписчиков
+            subscribers = {client_id for client_id in self._subscribers[session_id]
+                           if websocket_manager.is_connected(client_id)}
+            if not subscribers:
+                self._drop(session_id)
+                return None
+            self._subscribers[session_id] = subscribers
+
+            state = await self.build_state(session_id)
+            if state is None:
+                self._drop(session_id)
+                return None
+
+            ops = diff(self._states[session_id], state)
+            if not ops: return None
+
+            base_version = self._versions[session_id]
+            version = base_version + 1
+
+            self._states[session_id] = state
+            self._versions[session_id] = version
+            self._history[session_id].append((version, ops))
+
+            # Под блокировкой, чтобы патчи уходили строго по версиям
+            message = {
+                "type": "api-session-state-patch",
+                "data": {
+                    "session_id": session_id,
+                    "version": version,
+                    "base_version": base_version,
+                    "ops": ops
+                }
+            }
+            for client_id in subscribers:
+                await websocket_manager.send_message(client_id, message, log=False)
+            return version
+
+
+session_sync = SessionStateSync()
+websocket_manager.add_listener(session_sync.on_broadcast)
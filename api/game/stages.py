@@ -3,7 +3,6 @@ from modules.sheduler import scheduler
 from datetime import datetime, timedelta
 from global_modules.load_config import ALL_CONFIGS, Settings
 from modules.logs import game_logger
-from modules.db import just_db
 
 settings: Settings = ALL_CONFIGS['settings']
 
@@ -22,12 +21,9 @@ async def stage_game_updater(session_id: str):
         except Exception as e:
             game_logger.error(f"Ошибка при обновлении стадии сессии {session_id}: {e}")
 
-        await just_db.update(
-            "time_schedule",
-            conditions={"id": session.change_turn_schedule_id},
-            updates={
-                "execute_at": (datetime.now() + timedelta(seconds=session.time_on_game_stage * 60)).isoformat()
-            }
+        await scheduler.reschedule(
+            session.change_turn_schedule_id,
+            datetime.now() + timedelta(seconds=session.time_on_game_stage * 60)
         )
 
     elif session.stage == SessionStages.Game.value:
@@ -40,22 +36,22 @@ async def stage_game_updater(session_id: str):
         except Exception as e:
             game_logger.error(f"Ошибка при смене хода в сессии {session_id}: {traceback.format_exc()}")
 
-        await just_db.update(
-            "time_schedule",
-            conditions={"id": session.change_turn_schedule_id},
-            updates={
-                "execute_at": (datetime.now() + timedelta(seconds=session.time_on_change_stage * 60)).isoformat()
-            }
+        await scheduler.reschedule(
+            session.change_turn_schedule_id,
+            datetime.now() + timedelta(seconds=session.time_on_change_stage * 60)
         )
 
-async def leave_from_prison(session_id: str, company_id: int):
+async def leave_from_prison(session_id: str, company_id: int, context=None):
     """ Фнукция для выхода из тюрьмы по времени
+
+        context - TurnContext хода, если функция вызвана из расписания шага
     """
     from game.company import Company
     from game.session import session_manager
 
-    session = await session_manager.get_session(session_id)
-    if not session: return 0
+    if context is None:
+        session = await session_manager.get_session(session_id)
+        if not session: return 0
 
     company = await Company(company_id).reupdate()
     if not company: return 0
@@ -63,19 +59,26 @@ async def leave_from_prison(session_id: str, company_id: int):
     await company.leave_prison()
     return 1
 
-async def clear_session_event(session_id: str):
+async def clear_session_event(session_id: str, context=None):
     """ Функция для очистки события сессии (вызывается через шедулер)
+
+        context - TurnContext хода: сессия берётся из него и сохраняется
+        пайплайном хода вместе с остальными изменениями
     """
     from game.session import session_manager
 
-    session = await session_manager.get_session(session_id)
-    if not session: 
-        return 0
+    if context is not None:
+        session = context.session
+    else:
+        session = await session_manager.get_session(session_id)
+        if not session: 
+            return 0
 
     session.event_type = None
     session.event_start = None
     session.event_end = None
-    await session.save_to_base()
+    if context is None:
+        await session.save_to_base()
 
     game_logger.info(f"Ивент очищен для сессии {session_id}")
     return 1
\ No newline at end of file
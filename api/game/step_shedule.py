@@ -1,10 +1,13 @@
 import asyncio
+import inspect
+from typing import Optional
 from global_modules.models.cells import Cells
 from global_modules.db.baseclass import BaseClass
 from modules.db import just_db
 from game.session import SessionObject
 from global_modules.load_config import ALL_CONFIGS, Resources, Improvements, Settings, Capital, Reputation
 from modules.utils import *
+from modules.logs import game_logger
 
 RESOURCES: Resources = ALL_CONFIGS["resources"]
 CELLS: Cells = ALL_CONFIGS['cells']
@@ -13,6 +16,9 @@ SETTINGS: Settings = ALL_CONFIGS['settings']
 CAPITAL: Capital = ALL_CONFIGS['capital']
 REPUTATION: Reputation = ALL_CONFIGS['reputation']
 
+# Сколько расписаний шага выполняется одновременно
+STEP_SCHEDULE_CONCURRENCY = 4
+
 class StepSchedule(BaseClass, SessionObject):
 
     __tablename__ = "step_schedule"
@@ -58,50 +64,107 @@ class StepSchedule(BaseClass, SessionObject):
         if not session.step <= self.in_step:
             raise ValueError("Неверный шаг для добавления функции.")
 
-        self.functions.append({
+        entry = {
             "function": func_to_str(function),
             "args": kwargs
-        })
-        await self.save_to_base()
-        await self.reupdate()
+        }
+        # $push не перетирает функции, добавленные параллельно
+        document = await just_db.find_one_and_update(
+            self.__tablename__, {"id": self.id},
+            {"$push": {"functions": entry}}
+        )
+        if document:
+            self.load_from_base(document)
         return True
 
-    async def execute(self):
+    async def execute(self, context: Optional['TurnContext'] = None) -> dict:
         """ Выполняет все функции в расписании шага
+
+            context - состояние текущего хода, без него сессия читается заново.
+            Функции, принимающие параметр context, получают его и не читают
+            сессию сами. Возвращает отчёт {'schedule_id', 'executed', 'failed'}
         """
-        session = await self.get_session()
+        report = {"schedule_id": self.id, "executed": 0, "failed": []}
+
+        session = context.session if context else await self.get_session()
 
         if not session:
             await just_db.delete(self.__tablename__, id=self.id)
-            print(f'Session {self.session_id} not found. Deleting schedule {self.id}.')
-            return False
+            game_logger.warning(f"Сессия {self.session_id} не найдена. Расписание {self.id} удалено.")
+            return report
 
         if session.step != self.in_step:
-            return False
+            return report
 
         for func_entry in self.functions:
             func_name = func_entry.get("function")
             args = func_entry.get("args", {})
 
             if not func_name:
-                print("Function name is missing.")
+                game_logger.error(f"В расписании {self.id} нет имени функции.")
+                report["failed"].append(None)
                 continue
 
             # Импортируем функцию по имени
             function = str_to_func(func_name)
 
             if not callable(function):
-                print(f"{func_name} is not callable.")
+                game_logger.error(f"{func_name} не вызываемая (расписание {self.id}).")
+                report["failed"].append(func_name)
                 continue
 
+            if context and "context" in inspect.signature(function).parameters:
+                args = {**args, "context": context}
+
             # Выполняем функцию
             try:
                 if asyncio.iscoroutinefunction(function):
                     await function(**args)
                 else:
                     function(**args)
+                report["executed"] += 1
             except Exception as e:
-                print(f"Error executing function {func_name}: {e}")
+                game_logger.error(f"Ошибка выполнения {func_name} в расписании {self.id}: {e}")
+                report["failed"].append(func_name)
 
         await just_db.delete(self.__tablename__, id=self.id)
-        return True
\ No newline at end of file
+        return report
+
+
+class TurnContext:
+    """ Состояние хода, передаваемое задачам шага
+
+        Сессия уже загружена пайплайном хода, задачам не нужно читать её заново.
+    """
+
+    def __init__(self, session, step: int):
+        self.session = session
+        self.session_id: str = session.session_id
+        self.step = step
+
+
+async def run_step_schedules(context: TurnContext,
+                             concurrency: int = STEP_SCHEDULE_CONCURRENCY) -> dict:
+    """ Выполняет расписания шага внутри хода и дожидается их
+
+        Одновременно выполняется не больше concurrency расписаний.
+        Возвращает сводку {'schedules', 'executed', 'failed'}
+    """
+    schedules: list[StepSchedule] = await just_db.find(
+        StepSchedule.__tablename__, to_class=StepSchedule,
+        session_id=context.session_id, in_step=context.step
+    ) # type: ignore
+
+    slots = asyncio.Semaphore(concurrency)
+
+    async def run(schedule: StepSchedule) -> dict:
+        async with slots:
+            return await schedule.execute(context)
+
+    reports = await asyncio.gather(*(run(schedule) for schedule in schedules))
+
+    return {
+        "schedules": len(schedules),
+        "executed": sum(report["executed"] for report in reports),
+        "failed": [name for report in reports for name in report["failed"]]
+    }
@@ -4,6 +4,7 @@ import os
 from pprint import pprint
 import random
 from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse
 from contextlib import asynccontextmanager
 
 from game.item_price import ItemPrice
@@ -14,6 +15,9 @@ from global_modules.api_configurate import get_fastapi_app
 from modules.logs import *
 from modules.db import just_db
 from modules.sheduler import scheduler
+from modules.metrics import request_metrics
+from modules.pagination import keyset_indexes
+from modules.websocket_manager import websocket_manager
 from game.session import session_manager
 from game.exchange import Exchange
 from game.citie import Citie
@@ -38,17 +42,45 @@ async def lifespan(app: FastAPI):
     websocket_logger.info("Creating missing tables on startup...")
     # await just_db.drop_all() # Тестово
 
-    await just_db.create_table('sessions') # Таблица сессий
-    await just_db.create_table('users') # Таблица пользователей
-    await just_db.create_table('companies') # Таблица компаний
-    await just_db.create_table('time_schedule') # Таблица с задачами по времени
-    await just_db.create_table('step_schedule') # Таблица с задачами по шагам
-    await just_db.create_table('contracts') # Таблица с контрактами
+    # Индексы (фильтр, сортировка, id) под постраничные списки обработчиков get-*
+    await just_db.create_table('sessions', [ # Таблица сессий
+        *keyset_indexes('stage', ['session_id', 'step'], unique_field='session_id'),
+        # Без фильтра по стадии
+        'session_id', [('step', 1), ('session_id', 1)]
+    ])
+    await just_db.create_table('users', [ # Таблица пользователей
+        *keyset_indexes('session_id', ['id', 'username']),
+        *keyset_indexes('company_id', ['id'])
+    ])
+    await just_db.create_table('companies', # Таблица компаний
+        keyset_indexes('session_id', ['id', 'name', 'balance', 'reputation', 'economic_power']))
+    await just_db.create_table('time_schedule', ['execute_at']) # Таблица с задачами по времени
+    await just_db.create_table('step_schedule', [ # Таблица с задачами по шагам
+        [('session_id', 1), ('in_step', 1)]
+    ])
+    await just_db.create_table('contracts', [ # Таблица с контрактами
+        # Поиск контрактов компании одним $or по обеим сторонам
+        [('session_id', 1), ('supplier_company_id', 1)],
+        [('session_id', 1), ('customer_company_id', 1)],
+        *keyset_indexes('session_id', ['id', 'created_at_step', 'payment_amount', 'duration_turns'])
+    ])
     await just_db.create_table('cities') # Таблица с городами
-    await just_db.create_table('exchanges') # Таблица с биржей
-    await just_db.create_table('factories') # Таблица с заводами
+    await just_db.create_table('exchanges', # Таблица с биржей
+        # Списки по сессии отдаёт стакан в памяти, из базы - предложения компании
+        keyset_indexes('company_id', ['id', 'price', 'total_stock', 'created_at_step']))
+    await just_db.create_table('buy_orders') # Таблица с заявками на покупку
+    await just_db.create_table('factories', # Таблица с заводами
+        keyset_indexes('company_id', ['id', 'produced']))
     await just_db.create_table('item_price') # Таблица с ценами на товары
-    await just_db.create_table('logistics') # Таблица с логистикой
+    await just_db.create_table('price_history', [ # Таблица с историей сделок по товарам
+        [('session_id', 1), ('item_id', 1), ('ts', 1)]
+    ])
+    await just_db.create_table('price_history_steps', unique=[ # Таблица со свёрткой цен по ходам
+        # Ключ upsert свёртки: одна запись на товар и ход
+        [('session_id', 1), ('item_id', 1), ('step', 1)]
+    ])
+    await just_db.create_table('logistics', # Таблица с логистикой
+        keyset_indexes('session_id', ['id', 'created_step', 'distance_left', 'amount']))
     await just_db.create_table('statistics') # Таблица со статистикой
 
     websocket_logger.info("Loading sessions from database...")
@@ -89,6 +121,39 @@ async def root(request: Request):
 async def ping(request: Request):
     return {"message": "pong"}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics(request: Request):
+    """ Метрики в формате Prometheus: обработка сообщений, очереди отправки, планировщик """
+    queues = websocket_manager.get_queue_metrics()
+    scheduler_metrics = scheduler.get_metrics()
+
+    extra = [
+        "# TYPE seg_ws_connections gauge",
+        f"seg_ws_connections {websocket_manager.get_connection_count()}",
+        "# TYPE seg_ws_frames_sent_total counter",
+        f"seg_ws_frames_sent_total {queues['sent']}",
+        "# TYPE seg_ws_frames_dropped_total counter",
+        f"seg_ws_frames_dropped_total {queues['dropped']}",
+        "# TYPE seg_ws_slow_disconnects_total counter",
+        f"seg_ws_slow_disconnects_total {queues['slow_disconnects']}",
+        "# TYPE seg_ws_send_queue_depth gauge",
+        f"seg_ws_send_queue_depth {queues['total_depth']}",
+        "# TYPE seg_scheduler_tasks_total counter",
+        f"seg_scheduler_tasks_total {scheduler_metrics['executed']}",
+        "# TYPE seg_scheduler_task_errors_total counter",
+        f"seg_scheduler_task_errors_total {scheduler_metrics['failed']}",
+        "# TYPE seg_scheduler_lag_max_seconds gauge",
+        f"seg_scheduler_lag_max_seconds {scheduler_metrics['lag_max']}",
+        "# TYPE seg_scheduler_in_flight gauge",
+        f"seg_scheduler_in_flight {scheduler_metrics['in_flight']}",
+        "# TYPE seg_scheduler_pending gauge",
+        f"seg_scheduler_pending {scheduler_metrics['pending']}",
+    ]
+    return PlainTextResponse(
+        request_metrics.render_prometheus(extra),
+        media_type="text/plain; version=0.0.4"
+    )
+
 async def test1():
     
     from game.user import User
@@ -0,0 +1,140 @@
+import time
+from collections import deque
+from typing import Optional
+
+# Границы корзин гистограммы задержек (секунды)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Скользящее окно для /ws/status: длительность (секунды) и максимум замеров на тип
+ROLLING_WINDOW = 300
+ROLLING_SAMPLES = 2000
+
+
+class TypeMetrics:
+    """ Счётчики одного типа сообщений """
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.latency_sum = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS)  # Не кумулятивные
+        self.request_bytes = 0
+        self.response_bytes = 0
+        # (время окончания, задержка, ошибка)
+        self.recent: deque = deque(maxlen=ROLLING_SAMPLES)
+
+
+def _percentile(values: list[float], q: float) -> float:
+    index = min(len(values) - 1, int(q * len(values)))
+    return values[index]
+
+
+class RequestMetrics:
+    """ Метрики обработки WebSocket-сообщений по типам
+
+        Счётчики и гистограмма задержек за всё время - для Prometheus
+        (render_prometheus), скользящее окно с p50/p95/p99 - для /ws/status.
+    """
+
+    def __init__(self):
+        self._types: dict[str, TypeMetrics] = {}
+
+    def _get(self, message_type: str) -> TypeMetrics:
+        metrics = self._types.get(message_type)
+        if metrics is None:
+            metrics = self._types[message_type] = TypeMetrics()
+        return metrics
+
+    def started(self, message_type: str, request_bytes: int = 0):
+        metrics = self._get(message_type)
+        metrics.in_flight += 1
+        metrics.request_bytes += request_bytes
+
+    def finished(self, message_type: str, latency: float,
+                 error: bool = False, response_bytes: int = 0):
+        metrics = self._get(message_type)
+        metrics.in_flight -= 1
+        metrics.count += 1
+        metrics.errors += int(error)
+        metrics.latency_sum += latency
+        metrics.response_bytes += response_bytes
+
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if latency <= bound:
+                metrics.buckets[i] += 1
+                break
+
+        metrics.recent.append((time.monotonic(), latency, error))
+
+    def rolling(self, window: int = ROLLING_WINDOW) -> dict:
+        """ Сводка за последние window секунд: {тип: {count, rps, errors, p50, p95, p99 (мс), in_flight}} """
+        since = time.monotonic() - window
+        view = {}
+
+        for message_type, metrics in sorted(self._types.items()):
+            samples = [s for s in metrics.recent if s[0] >= since]
+            if not samples and not metrics.in_flight: continue
+
+            latencies = sorted(s[1] for s in samples)
+            view[message_type] = {
+                "count": len(samples),
+                "rps": round(len(samples) / window, 3),
+                "errors": sum(1 for s in samples if s[2]),
+                "p50_ms": round(_percentile(latencies, 0.5) * 1000, 1) if latencies else None,
+                "p95_ms": round(_percentile(latencies, 0.95) * 1000, 1) if latencies else None,
+                "p99_ms": round(_percentile(latencies, 0.99) * 1000, 1) if latencies else None,
+                "in_flight": metrics.in_flight
+            }
+        return view
+
+    def render_prometheus(self, extra: Optional[list[str]] = None) -> str:
+        """ Метрики в текстовом формате Prometheus """
+        lines = [
+            "# HELP seg_ws_requests_total Обработано WebSocket-сообщений",
+            "# TYPE seg_ws_requests_total counter",
+        ]
+        types = sorted(self._types.items())
+
+        def label(message_type: str) -> str:
+            escaped = message_type.replace("\\", "\\\\").replace('"', '\\"')
+            return f'type="{escaped}"'
+
+        for message_type, m in types:
+            lines.append(f"seg_ws_requests_total{{{label(message_type)}}} {m.count}")
+
+        lines += ["# HELP seg_ws_request_errors_total Сообщения, завершившиеся ошибкой",
+                  "# TYPE seg_ws_request_errors_total counter"]
+        for message_type, m in types:
+            lines.append(f"seg_ws_request_errors_total{{{label(message_type)}}} {m.errors}")
+
+        lines += ["# HELP seg_ws_requests_in_flight Сообщения в обработке",
+                  "# TYPE seg_ws_requests_in_flight gauge"]
+        for message_type, m in types:
+            lines.append(f"seg_ws_requests_in_flight{{{label(message_type)}}} {m.in_flight}")
+
+        lines += ["# HELP seg_ws_request_bytes_total Размер входящих кадров",
+                  "# TYPE seg_ws_request_bytes_total counter"]
+        for message_type, m in types:
+            lines.append(f"seg_ws_request_bytes_total{{{label(message_type)}}} {m.request_bytes}")
+
+        lines += ["# HELP seg_ws_response_bytes_total Размер ответов",
+                  "# TYPE seg_ws_response_bytes_total counter"]
+        for message_type, m in types:
+            lines.append(f"seg_ws_response_bytes_total{{{label(message_type)}}} {m.response_bytes}")
+
+        lines += ["# HELP seg_ws_request_duration_seconds Время обработки сообщения",
+                  "# TYPE seg_ws_request_duration_seconds histogram"]
+        for message_type, m in types:
+            cumulative = 0
+            for bound, amount in zip(LATENCY_BUCKETS, m.buckets):
+                cumulative += amount
+                lines.append(f'seg_ws_request_duration_seconds_bucket{{{label(message_type)},le="{bound}"}} {cumulative}')
+            lines.append(f'seg_ws_request_duration_seconds_bucket{{{label(message_type)},le="+Inf"}} {m.count}')
+            lines.append(f"seg_ws_request_duration_seconds_sum{{{label(message_type)}}} {m.latency_sum:.6f}")
+            lines.append(f"seg_ws_request_duration_seconds_count{{{label(message_type)}}} {m.count}")
+
+        lines += extra or []
+        return "\n".join(lines) + "\n"
+
+
+request_metrics = RequestMetrics()
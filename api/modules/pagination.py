@@ -0,0 +1,153 @@
+import base64
+import json
+from typing import Any, Optional
+from modules.db import just_db
+
+MAX_LIMIT = 200
+
+
+class PageRequest:
+    """ Параметры страницы списка
+
+        Общий контракт для обработчиков списков:
+        - limit: размер страницы (без limit обработчик отдаёт весь список, как раньше)
+        - cursor: next_cursor из предыдущего ответа (постраничный обход по индексу)
+        - offset: пропуск записей (для перехода на произвольную страницу)
+        - sort: поле сортировки из разрешённых обработчиком
+        - order: 'asc' или 'desc'
+
+        Ответ: {items, total, limit, next_cursor, sort, order}
+    """
+
+    def __init__(self, limit: int, sort: str, order: str = 'asc',
+                 cursor: Optional[str] = None, offset: int = 0,
+                 unique_field: str = 'id'):
+        self.limit = limit
+        self.sort = sort
+        self.order = order
+        self.cursor = cursor
+        self.offset = offset
+        self.unique_field = unique_field
+
+    @classmethod
+    def from_message(cls, message: dict,
+                     sort_fields: list[str],
+                     unique_field: str = 'id') -> Optional['PageRequest']:
+        """ Параметры страницы из сообщения, None - если limit не передан
+        """
+        limit = message.get("limit")
+        if limit is None: return None
+
+        limit = int(limit)
+        if limit <= 0:
+            raise ValueError("limit должен быть положительным.")
+        limit = min(limit, MAX_LIMIT)
+
+        sort = message.get("sort") or sort_fields[0]
+        if sort not in sort_fields:
+            raise ValueError(f"Сортировка по '{sort}' недоступна. Доступно: {', '.join(sort_fields)}")
+
+        order = message.get("order") or 'asc'
+        if order not in ('asc', 'desc'):
+            raise ValueError("order должен быть 'asc' или 'desc'.")
+
+        return cls(limit=limit, sort=sort, order=order,
+                   cursor=message.get("cursor"),
+                   offset=int(message.get("offset") or 0),
+                   unique_field=unique_field)
+
+    def encode_cursor(self, document: dict) -> str:
+        raw = json.dumps([document.get(self.sort), document.get(self.unique_field)])
+        return base64.urlsafe_b64encode(raw.encode()).decode()
+
+    def decode_cursor(self) -> tuple[Any, Any]:
+        try:
+            sort_value, unique_value = json.loads(
+                base64.urlsafe_b64decode(self.cursor.encode()).decode()) # type: ignore
+        except Exception:
+            raise ValueError("Недействительный cursor.")
+        return sort_value, unique_value
+
+    def cursor_condition(self) -> Optional[dict]:
+        """ Условие "после курсора" в порядке (sort, unique_field)
+        """
+        if not self.cursor: return None
+
+        sort_value, unique_value = self.decode_cursor()
+        op = '$gt' if self.order == 'asc' else '$lt'
+
+        if self.sort == self.unique_field:
+            return {self.unique_field: {op: unique_value}}
+
+        return {"$or": [
+            {self.sort: {op: sort_value}},
+            {self.sort: sort_value, self.unique_field: {op: unique_value}}
+        ]}
+
+    def mongo_sort(self) -> list[tuple]:
+        direction = 1 if self.order == 'asc' else -1
+        if self.sort == self.unique_field:
+            return [(self.unique_field, direction)]
+        return [(self.sort, direction), (self.unique_field, direction)]
+
+    def response(self, items: list, total: int, next_cursor: Optional[str]) -> dict:
+        return {
+            "items": items,
+            "total": total,
+            "limit": self.limit,
+            "next_cursor": next_cursor,
+            "sort": self.sort,
+            "order": self.order
+        }
+
+
+def keyset_indexes(prefix: str, sort_fields: list[str],
+                   unique_field: str = 'id') -> list[list[tuple]]:
+    """ Составные индексы (prefix, sort, unique_field) под постраничный обход
+
+        По индексу идёт и фильтр по prefix, и сортировка, и условие курсора
+        (в обе стороны - order desc читает индекс с конца)
+    """
+    return [
+        [(prefix, 1), (unique_field, 1)] if sort == unique_field
+        else [(prefix, 1), (sort, 1), (unique_field, 1)]
+        for sort in sort_fields
+    ]
+
+
+async def paginate(table_name: str, page: PageRequest,
+                   conditions: dict, to_class=None) -> tuple[list, int, Optional[str]]:
+    """ Страница записей коллекции по (sort, unique_field)
+
+        Возвращает (записи, общее количество подходящих, next_cursor)
+    """
+    query = dict(conditions)
+    after_cursor = page.cursor_condition()
+    if after_cursor:
+        query = {"$and": [conditions, after_cursor]} if conditions else after_cursor
+
+    # Одна лишняя запись показывает, есть ли следующая страница
+    documents: list[dict] = await just_db.find(
+        table_name,
+        sort=page.mongo_sort(),
+        skip=page.offset if not page.cursor else None,
+        limit=page.limit + 1,
+        **query
+    ) # type: ignore
+
+    total = await just_db.count(table_name, **conditions)
+
+    next_cursor = None
+    if len(documents) > page.limit:
+        documents = documents[:page.limit]
+        next_cursor = page.encode_cursor(documents[-1])
+
+    if to_class is None:
+        return documents, total, next_cursor
+
+    items = []
+    for document in documents:
+        instance = to_class()
+        instance.load_from_base(document)
+        items.append(instance)
+    return items, total, next_cursor
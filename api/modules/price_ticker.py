@@ -0,0 +1,77 @@
+import asyncio
+from typing import Dict, Optional
+
+from global_modules.load_config import ALL_CONFIGS, Settings
+from modules.logs import game_logger
+from modules.websocket_manager import websocket_manager
+
+settings: Settings = ALL_CONFIGS['settings']
+
+
+class PriceTickAggregator:
+    """ Собирает изменения цен по сессиям и отправляет их одним событием
+
+        Вместо отдельного сообщения на каждую сделку клиенты получают
+        api-item_prices_tick с последней ценой каждого изменившегося товара
+        не чаще, чем раз в price_tick_interval_ms.
+    """
+
+    def __init__(self, interval_ms: int):
+        self.interval: float = interval_ms / 1000
+
+        # {session_id: {item_id: последняя цена}}
+        self._pending: Dict[str, Dict[str, int]] = {}
+        # {session_id: задача отложенной отправки}
+        self._timers: Dict[str, asyncio.Task] = {}
+
+    def add(self, session_id: str, item_id: str, price: int):
+        """ Запомнить новую цену товара до ближайшей отправки
+        """
+        self._pending.setdefault(session_id, {})[item_id] = price
+
+        if session_id not in self._timers:
+            self._timers[session_id] = asyncio.create_task(
+                self._flush_later(session_id))
+
+    async def _flush_later(self, session_id: str):
+        try:
+            await asyncio.sleep(self.interval)
+        except asyncio.CancelledError:
+            return
+
+        # Отправка уже идёт, отменять её нельзя
+        self._timers.pop(session_id, None)
+        await self._send(session_id)
+
+    async def flush(self, session_id: str):
+        """ Немедленно отправить накопленные цены сессии (например, на смене стадии)
+        """
+        timer: Optional[asyncio.Task] = self._timers.pop(session_id, None)
+        if timer: timer.cancel()
+
+        await self._send(session_id)
+
+    async def _send(self, session_id: str):
+        prices = self._pending.pop(session_id, None)
+        if not prices: return
+
+        try:
+            await websocket_manager.broadcast({
+                "type": "api-item_prices_tick",
+                "data": {
+                    "session_id": session_id,
+                    "prices": prices
+                }
+            })
+        except Exception as e:
+            game_logger.error(f"Ошибка отправки цен сессии {session_id}: {e}")
+
+    def discard(self, session_id: str):
+        """ Сбросить накопленные цены удалённой сессии
+        """
+        timer = self._timers.pop(session_id, None)
+        if timer: timer.cancel()
+        self._pending.pop(session_id, None)
+
+
+price_ticker = PriceTickAggregator(settings.price_tick_interval_ms)
@@ -1,25 +1,74 @@
+import heapq
 import traceback
 from typing import Callable, Optional
 from modules.db import just_db
 from modules.utils import *
 import asyncio
-from datetime import datetime
+from datetime import datetime, timedelta
 import json
 from modules.logs import game_logger
+from global_modules.load_config import ALL_CONFIGS, Settings
+
+settings: Settings = ALL_CONFIGS['settings']
+
+# Опоздание задачи, о котором стоит написать в лог (секунды)
+LAG_WARNING = 1.0
 
 class TaskScheduler:
+    """ Планировщик задач по времени
+
+        Ближайшие задачи (до window секунд вперёд) держатся в памяти в куче
+        по времени выполнения, цикл спит ровно до ближайшей из них.
+        База (time_schedule) нужна для сохранности и восстановления после
+        перезапуска: задачи окна подгружаются запросом по индексу execute_at.
+
+        Менять время и удалять задачи нужно через reschedule / cancel,
+        чтобы куча и база не расходились.
+
+        Наступившие задачи запускаются отдельными asyncio-задачами: долгая
+        смена стадии одной сессии не задерживает таймеры других. Задачи одной
+        сессии (kwargs.session_id) выполняются строго по очереди, всего
+        одновременно выполняется не больше max_concurrency задач.
+    """
 
     __table_name__ = 'time_schedule'
 
-    def __init__(self, db=just_db):
+    def __init__(self, db=just_db, window: int = 3600,
+                 max_concurrency: int = settings.scheduler_max_concurrency):
         self.db = db
         self.running = False
+        self.window = timedelta(seconds=window)
+
+        self._slots = asyncio.Semaphore(max_concurrency)
+        # {session_id: [блокировка, сколько задач её ждут или держат]}
+        self._session_locks: dict[str, list] = {}
+        self._in_flight: set[asyncio.Task] = set()
+
+        # Опоздание запуска относительно execute_at
+        self.lag_stats = {
+            "executed": 0,
+            "failed": 0,
+            "lag_last": 0.0,
+            "lag_max": 0.0,
+            "lag_total": 0.0
+        }
+
+        # Куча (время выполнения, id). Записи, не совпадающие с _due, устарели
+        self._heap: list[tuple[datetime, int]] = []
+        # {task_id: время выполнения} - задачи, загруженные в память
+        self._due: dict[int, datetime] = {}
+        # Задачи с временем до loaded_until уже подгружены из базы
+        self._loaded_until: Optional[datetime] = None
+
+        self._wakeup = asyncio.Event()
+        self._callables: dict[str, Callable] = {}
+
         asyncio.create_task(self._init_schedule_table())
 
     async def _init_schedule_table(self):
         tables = await self.db.get_tables()
         if self.__table_name__ not in tables:
-            await self.db.create_table(self.__table_name__)
+            await self.db.create_table(self.__table_name__, ['execute_at'])
 
     async def start(self):
         if self.running: return
@@ -28,27 +77,142 @@ class TaskScheduler:
 
     def stop(self):
         self.running = False
+        self._wakeup.set()
+
+    def _push(self, task_id: int, execute_at: datetime):
+        """ Запомнить время задачи, если она попадает в загруженное окно """
+        if self._loaded_until is None or execute_at > self._loaded_until:
+            # Задача подгрузится из базы вместе со своим окном
+            self._due.pop(task_id, None)
+            return
+
+        self._due[task_id] = execute_at
+        heapq.heappush(self._heap, (execute_at, task_id))
+
+        if self._heap[0][1] == task_id:
+            self._wakeup.set()
+
+    async def _load_window(self):
+        """ Подгрузить из базы задачи до конца следующего окна """
+        until = datetime.now() + self.window
+
+        conditions = {'$lte': until.isoformat()}
+        if self._loaded_until is not None:
+            conditions['$gt'] = self._loaded_until.isoformat()
+
+        tasks: list[dict] = await self.db.find(
+            self.__table_name__, execute_at=conditions) # type: ignore
+
+        self._loaded_until = until
+        for task in tasks:
+            self._push(task['id'], datetime.fromisoformat(task['execute_at']))
+
+    def _next_due(self) -> Optional[tuple[datetime, int]]:
+        while self._heap:
+            execute_at, task_id = self._heap[0]
+            if self._due.get(task_id) == execute_at:
+                return execute_at, task_id
+            heapq.heappop(self._heap)  # Задача перенесена или удалена
+        return None
 
     async def _run_scheduler(self):
         while self.running:
             try:
+                if self._loaded_until is None or datetime.now() >= self._loaded_until:
+                    await self._load_window()
+
                 await self._check_and_execute_tasks()
+
+                # Спим до ближайшей задачи или до конца окна
+                wake_at: datetime = self._loaded_until # type: ignore
+                next_due = self._next_due()
+                if next_due and next_due[0] < wake_at:
+                    wake_at = next_due[0]
+
+                delay = (wake_at - datetime.now()).total_seconds()
+                if delay > 0:
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+
             except Exception as e:
                 print(f"Ошибка в планировщике: {e}")
-            await asyncio.sleep(1)
+                await asyncio.sleep(1)
 
     async def _check_and_execute_tasks(self):
         current_time = datetime.now()
-        tasks =  await self.db.find(self.__table_name__)
-        tasks: list[dict] = list(tasks)
 
-        for task in tasks:
-            task_time = datetime.fromisoformat(task['execute_at'])
-            if task_time <= current_time:
+        while self.running:
+            next_due = self._next_due()
+            if not next_due or next_due[0] > current_time: break
+
+            heapq.heappop(self._heap)
+            execute_at, task_id = next_due
+            del self._due[task_id]
+
+            run = asyncio.create_task(self._dispatch(task_id, execute_at))
+            self._in_flight.add(run)
+            run.add_done_callback(self._in_flight.discard)
+
+    async def _dispatch(self, task_id: int, execute_at: datetime):
+        task = await self.db.find_one(self.__table_name__, id=task_id)
+        if not task: return
+
+        session_id = (task.get('kwargs') or {}).get('session_id')
+        if session_id is None:
+            async with self._slots:
                 await self._execute_task(task)
+            return
+
+        entry = self._session_locks.setdefault(session_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                async with self._slots:
+                    # Пока задача ждала очереди, её могли перенести или удалить
+                    task = await self.db.find_one(self.__table_name__, id=task_id)
+                    if task and task['execute_at'] == execute_at.isoformat():
+                        await self._execute_task(task)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._session_locks.pop(session_id, None)
+
+    def _record_lag(self, lag: float, failed: bool):
+        lag = max(0.0, lag)
+
+        stats = self.lag_stats
+        stats["executed"] += 1
+        stats["failed"] += int(failed)
+        stats["lag_last"] = lag
+        stats["lag_max"] = max(stats["lag_max"], lag)
+        stats["lag_total"] += lag
+
+    def get_metrics(self) -> dict:
+        """ Метрики планировщика: опоздание запусков (секунды) и загрузка """
+        stats = self.lag_stats
+        executed = stats["executed"]
+        return {
+            "executed": executed,
+            "failed": stats["failed"],
+            "lag_last": round(stats["lag_last"], 3),
+            "lag_max": round(stats["lag_max"], 3),
+            "lag_avg": round(stats["lag_total"] / executed, 3) if executed else 0.0,
+            "in_flight": len(self._in_flight),
+            "pending": len(self._due)
+        }
+
+    def _resolve(self, function_path: str) -> Callable:
+        func = self._callables.get(function_path)
+        if func is None:
+            func = str_to_func(function_path)
+            self._callables[function_path] = func
+        return func
 
     async def _execute_task(self, task):
-        func = str_to_func(task['function_path'])
+        func = self._resolve(task['function_path'])
         args = task.get('args', [])
         kwargs = task.get('kwargs', {})
         repeat = task.get('repeat', False)
@@ -56,29 +220,33 @@ class TaskScheduler:
         add_at = datetime.fromisoformat(task['add_at'])
         execute_at = datetime.fromisoformat(task['execute_at'])
 
+        lag = (datetime.now() - execute_at).total_seconds()
+        if lag > LAG_WARNING:
+            game_logger.warning(f"Запланированная задача {task['id']} ({task['function_path']}) запущена с опозданием {lag:.2f} с.")
+
+        failed = False
         try:
             if asyncio.iscoroutinefunction(func):
                 await func(*args, **kwargs)
             else:
                 func(*args, **kwargs)
         except Exception as e:
+            failed = True
             game_logger.error(f"Ошибка при выполнении запланированной задачи {task['id']}: {traceback.format_exc()}")
 
+        self._record_lag(lag, failed)
+
         if repeat:
             interval = execute_at - add_at
-            next_execute_time = datetime.now() + interval
-            await self.db.update(self.__table_name__, 
-                           {'id': task['id']}, 
-                           {'execute_at': next_execute_time.isoformat()}
-                           )
+            await self.reschedule(task['id'], datetime.now() + interval)
 
         else:
             if not dont_delete:
-                await self.db.delete(self.__table_name__, id=task['id'])
+                await self.cancel(task['id'])
 
-    async def schedule_task(self, function: Callable, 
-                      execute_at: datetime, 
-                      args: Optional[list] = None, 
+    async def schedule_task(self, function: Callable,
+                      execute_at: datetime,
+                      args: Optional[list] = None,
                       kwargs: Optional[dict] = None,
                       repeat: bool = False,
                       dont_delete: bool = False,
@@ -97,7 +265,34 @@ class TaskScheduler:
             'delete_on_shutdown': delete_on_shutdown
         }
 
-        return await self.db.insert(self.__table_name__, task_data)
+        task_id = await self.db.insert(self.__table_name__, task_data)
+        self._push(task_id, execute_at)
+        return task_id
+
+    async def reschedule(self, task_id: int, execute_at: datetime) -> bool:
+        """ Перенести задачу на новое время
+        """
+        updated = await self.db.update(self.__table_name__,
+                       {'id': task_id},
+                       {'execute_at': execute_at.isoformat()}
+                       )
+        self._push(task_id, execute_at)
+        return updated > 0
+
+    async def cancel(self, task_id: int) -> int:
+        """ Удалить задачу
+        """
+        self._due.pop(task_id, None)
+        return await self.db.delete(self.__table_name__, id=task_id)
+
+    async def cancel_where(self, **conditions) -> int:
+        """ Удалить все задачи, подходящие под условия (например, "kwargs.session_id")
+        """
+        tasks: list[dict] = await self.db.find(
+            self.__table_name__, **conditions) # type: ignore
+        for task in tasks:
+            self._due.pop(task['id'], None)
+        return await self.db.delete(self.__table_name__, **conditions)
 
     async def cleanup_shutdown_tasks(self):
         """
@@ -105,13 +300,13 @@ class TaskScheduler:
         Этот метод следует вызывать при завершении работы приложения.
         """
         try:
-            deleted_count = await self.db.delete(self.__table_name__, delete_on_shutdown=True)
+            deleted_count = await self.cancel_where(delete_on_shutdown=True)
             print(f"Удалено {deleted_count} задач при завершении работы")
             return deleted_count
         except Exception as e:
             print(f"Ошибка при удалении задач завершения: {e}")
             return 0
-    
+
     async def get_scheduled_tasks(self, id: int):
         """
         Возвращает список всех запланированных задач.
@@ -119,4 +314,4 @@ class TaskScheduler:
         return await self.db.find_one(self.__table_name__, id=id)
 
 
-scheduler = TaskScheduler()
\ No newline at end of file
+scheduler = TaskScheduler()
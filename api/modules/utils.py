@@ -1,4 +1,5 @@
 import importlib
+from typing import Optional
 
 def func_to_str(func):
     """Преобразует функцию в строку вида 'модуль.имя_функции'."""
@@ -44,11 +45,143 @@ def get_neighboring_cells(x: int, y: int, radius: int, map_size: dict) -> list[t
     return neighbors
 
 
+# Маппинг типов клеток на ветки ресурсов
+CELL_TO_BRANCH = {
+    'water': 'oil',      # вода -> нефть
+    'mountain': 'metal',  # горы -> металл
+    'forest': 'wood',     # лес -> дерево
+    'field': 'cotton'     # поле -> хлопок
+}
+BRANCHES = ['oil', 'metal', 'wood', 'cotton']
+
+
+class NeighbourhoodStats:
+    """Статистика окрестностей клеток карты по веткам ресурсов.
+
+    Для каждой ветки строится двумерная префиксная сумма по сетке карты,
+    после чего количество клеток ветки в квадрате любого радиуса вокруг
+    любой клетки считается за O(1), без обхода соседей.
+    """
+
+    def __init__(self, cells: list[str], map_size: dict):
+        self.rows = map_size["rows"]
+        self.cols = map_size["cols"]
+        self.cells = cells
+
+        # prefix[branch][i][j] - клеток ветки в прямоугольнике [0, i) x [0, j)
+        self.prefix: dict[str, list[list[int]]] = {}
+        for branch in BRANCHES:
+            table = [[0] * (self.cols + 1) for _ in range(self.rows + 1)]
+            for x in range(self.rows):
+                row_sum = 0
+                for y in range(self.cols):
+                    index = x * self.cols + y
+                    if index < len(cells) and CELL_TO_BRANCH.get(cells[index]) == branch:
+                        row_sum += 1
+                    table[x + 1][y + 1] = table[x][y + 1] + row_sum
+            self.prefix[branch] = table
+
+    def branch_at(self, x: int, y: int) -> Optional[str]:
+        index = x * self.cols + y
+        if 0 <= index < len(self.cells):
+            return CELL_TO_BRANCH.get(self.cells[index])
+        return None
+
+    def counts(self, x: int, y: int, radius: int) -> dict[str, int]:
+        """Количество клеток каждой ветки в радиусе (без центральной клетки)"""
+        top, bottom = max(0, x - radius), min(self.rows, x + radius + 1)
+        left, right = max(0, y - radius), min(self.cols, y + radius + 1)
+
+        result = {}
+        for branch, table in self.prefix.items():
+            result[branch] = (table[bottom][right] - table[top][right]
+                              - table[bottom][left] + table[top][left])
+
+        center = self.branch_at(x, y)
+        if center:
+            result[center] -= 1
+        return result
+
+    def choose_branch(self, x: int, y: int,
+                      occupied_branches: dict[tuple[int, int], str]) -> str:
+        """Приоритетная ветка для города в (x, y) с учётом уже стоящих городов"""
+        import random
+
+        radius = 1
+        max_radius = max(self.rows, self.cols) // 2
+
+        while radius <= max_radius:
+            branch_counts = self.counts(x, y, radius)
+
+            # Исключаем ветки, занятые другими городами в этом радиусе
+            for (city_x, city_y), branch in occupied_branches.items():
+                if (city_x, city_y) != (x, y) and \
+                        abs(city_x - x) <= radius and abs(city_y - y) <= radius:
+                    # Уменьшаем приоритет занятой ветки
+                    branch_counts[branch] = max(0, branch_counts[branch] - 2)
+
+            # Находим ветку с максимальным количеством клеток
+            max_count = max(branch_counts.values())
+
+            if max_count > 0:
+                top_branches = [b for b, c in branch_counts.items() if c == max_count]
+
+                # Проверяем, не заняты ли все топовые ветки
+                available_branches = [b for b in top_branches if b not in occupied_branches.values()]
+
+                if available_branches:
+                    # Возвращаем случайную из доступных топовых веток
+                    return random.choice(available_branches)
+                elif len(top_branches) == 1 or max_count >= radius * 2:
+                    # Если только одна ветка лидирует или явное преимущество
+                    return top_branches[0]
+
+            # Увеличиваем радиус, если не нашли подходящую ветку
+            radius += 1
+
+        # Если ничего не нашли, возвращаем случайную ветку
+        available = [b for b in BRANCHES if b not in occupied_branches.values()]
+        return random.choice(available) if available else random.choice(BRANCHES)
+
+    def choose_branches(self, positions: list[tuple[int, int]],
+                        occupied_branches: Optional[dict[tuple[int, int], str]] = None
+                        ) -> dict[tuple[int, int], str]:
+        """Ветки для всех новых городов за один проход.
+        Каждый выбранный город учитывается при выборе следующих.
+        """
+        occupied = dict(occupied_branches or {})
+        result = {}
+        for x, y in positions:
+            branch = self.choose_branch(x, y, occupied)
+            occupied[(x, y)] = branch
+            result[(x, y)] = branch
+        return result
+
+
+async def get_occupied_branches(session_id: str) -> dict[tuple[int, int], str]:
+    """Ветки уже созданных городов сессии: {(x, y): branch}"""
+    from modules.db import just_db
+
+    cities: list[dict] = await just_db.find(
+        "cities", session_id=session_id) # type: ignore
+
+    occupied_branches = {}
+    for city in cities:
+        if city.get('branch'):
+            city_pos = city.get('cell_position', '').split('.')
+            if len(city_pos) == 2:
+                occupied_branches[(int(city_pos[0]), int(city_pos[1]))] = city['branch']
+    return occupied_branches
+
+
 async def determine_city_branch(
     x: int, y: int, 
     session_id: str, cells: list[str], 
     map_size: dict) -> str:
     """Определяет приоритетную ветку ресурсов для города на основе соседних клеток.
+
+    Для создания сразу всех городов карты используйте
+    NeighbourhoodStats.choose_branches.
     
     Args:
         x: координата X города
@@ -60,74 +193,5 @@ async def determine_city_branch(
     Returns:
         Название ветки ('oil', 'metal', 'wood', 'cotton')
     """
-    from modules.db import just_db
-    
-    # Маппинг типов клеток на ветки ресурсов
-    cell_to_branch = {
-        'water': 'oil',      # вода -> нефть
-        'mountain': 'metal',  # горы -> металл
-        'forest': 'wood',     # лес -> дерево
-        'field': 'cotton'     # поле -> хлопок
-    }
-    
-    # Получаем все города в сессии
-    cities: list[dict] = await just_db.find(
-        "cities", session_id=session_id) # type: ignore
-    occupied_branches = {}
-    
-    for city in cities:
-        if city.get('branch'):
-            city_pos = city.get('cell_position', '').split('.')
-            if len(city_pos) == 2:
-                city_x, city_y = int(city_pos[0]), int(city_pos[1])
-                occupied_branches[(city_x, city_y)] = city['branch']
-    
-    radius = 1
-    max_radius = max(map_size["rows"], map_size["cols"]) // 2
-    
-    while radius <= max_radius:
-        neighbors = get_neighboring_cells(x, y, radius, map_size)
-        branch_counts = {'oil': 0, 'metal': 0, 'wood': 0, 'cotton': 0}
-        
-        # Подсчитываем ресурсы в радиусе
-        for nx, ny in neighbors:
-            index = nx * map_size["cols"] + ny
-            if index < len(cells):
-                cell_type = cells[index]
-                if cell_type in cell_to_branch:
-                    branch = cell_to_branch[cell_type]
-                    branch_counts[branch] += 1
-        
-        # Исключаем ветки, занятые другими городами в этом радиусе
-        for (city_x, city_y), branch in occupied_branches.items():
-            if (city_x, city_y) in neighbors:
-                # Уменьшаем приоритет занятой ветки
-                branch_counts[branch] = max(0, branch_counts[branch] - 2)
-        
-        # Находим ветку с максимальным количеством клеток
-        max_count = max(branch_counts.values())
-        
-        if max_count > 0:
-            # Если есть явный лидер, возвращаем его
-            top_branches = [b for b, c in branch_counts.items() if c == max_count]
-            
-            # Проверяем, не заняты ли все топовые ветки
-            available_branches = [b for b in top_branches if b not in occupied_branches.values()]
-            
-            if available_branches:
-                # Возвращаем случайную из доступных топовых веток
-                import random
-                return random.choice(available_branches)
-            elif len(top_branches) == 1 or max_count >= radius * 2:
-                # Если только одна ветка лидирует или явное преимущество
-                return top_branches[0]
-        
-        # Увеличиваем радиус, если не нашли подходящую ветку
-        radius += 1
-    
-    # Если ничего не нашли, возвращаем случайную ветку
-    import random
-    available = [b for b in ['oil', 'metal', 'wood', 'cotton'] 
-                 if b not in occupied_branches.values()]
-    return random.choice(available) if available else random.choice(
-        ['oil', 'metal', 'wood', 'cotton'])
\ No newline at end of file
+    stats = NeighbourhoodStats(cells, map_size)
+    return stats.choose_branch(x, y, await get_occupied_branches(session_id))
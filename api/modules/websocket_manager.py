@@ -1,28 +1,112 @@
+import asyncio
+from contextlib import asynccontextmanager
 from pathlib import Path
 from fastapi import WebSocket, WebSocketDisconnect
-from typing import Dict, List, Any, Optional
+from typing import Callable, Dict, List, Any, Optional, Set, Iterable
 import json
 from modules.logs import websocket_logger
-import json
+from global_modules import codec
+from global_modules.codec import Frame
 from global_modules.load_config import load_json
 
 config_path = Path(__file__).parent.parent / "config"
 events = load_json("broadcast.json", config_path)
 
+# {event_type: {префикс клиента}} - кому из каналов broadcast.json положено событие
+event_prefixes: Dict[str, Set[str]] = {}
+for _prefix, _event_types in events.items():
+    for _event_type in _event_types:
+        event_prefixes.setdefault(_event_type, set()).add(_prefix)
+
+# Сколько кадров может ждать отправки одному клиенту
+SEND_QUEUE_SIZE = 1000
+# Сколько broadcast-кадров подряд можно выбросить отстающему клиенту до отключения
+SEND_DROP_LIMIT = 200
+
+# Пакетная доставка: окно накопления (мс) и максимум событий в одном api-batch
+BATCH_WINDOW_MS = 50
+BATCH_MAX_EVENTS = 500
+
+# Измерения подписки: тема -> ключ в data события
+SUBSCRIPTION_KEYS = {
+    "session": "session_id",
+    "company": "company_id"
+}
+
+
+def event_family(event_type: str) -> str:
+    """Семейство события: api-company_balance_changed -> company, api-city-trade -> city"""
+    name = event_type.removeprefix("api-")
+    return name.replace("-", "_").split("_", 1)[0]
+
+
 class WebSocketManager:
-    """Менеджер для управления WebSocket соединениями"""
+    """Менеджер для управления WebSocket соединениями
+
+    Broadcast-события получают клиенты, чей канал (первые 3 символа id)
+    указан для события в broadcast.json. Клиент может сузить поток подпиской
+    на темы: сессии, компании и семейства событий. Без подписки клиент
+    получает все события своего канала.
+
+    Отправка идёт через очередь клиента, которую разбирает отдельная
+    задача-писатель: broadcast кодирует сообщение один раз и только кладёт
+    его в очереди, медленный клиент не задерживает игру. Если очередь
+    переполнена, broadcast-кадры клиенту выбрасываются, а после
+    SEND_DROP_LIMIT выброшенных подряд (или при переполнении ответом
+    на запрос) клиент отключается.
+
+    Клиент может включить пакетную доставку (set_batching): события для него
+    копятся BATCH_WINDOW_MS или, внутри batch_scope (смена стадии), до конца
+    перехода и приходят одним кадром api-batch с упорядоченным списком событий.
+
+    Кодировка кадров выбирается при подключении: JSON (текстовые кадры)
+    или MessagePack (бинарные). Broadcast кодируется один раз на кодировку.
+    """
 
     def __init__(self):
         # Словарь активных соединений {client_id: websocket}
         self.active_connections: Dict[str, WebSocket] = {}
-
-    async def connect(self, websocket: WebSocket, client_id: str) -> bool:
+        # {client_id: кодировка кадров}
+        self._encodings: Dict[str, str] = {}
+
+        # {префикс канала: {client_id}}
+        self._by_prefix: Dict[str, Set[str]] = {}
+        # {client_id: {измерение: {значения}}} - подписки клиентов
+        self._subscriptions: Dict[str, Dict[str, Set[Any]]] = {}
+        # {"session:<id>" | "company:<id>" | "family:<name>": {client_id}}
+        self._topics: Dict[str, Set[str]] = {}
+        # {измерение: {client_id}} - клиенты, ограничившие это измерение
+        self._restricted: Dict[str, Set[str]] = {
+            dimension: set() for dimension in (*SUBSCRIPTION_KEYS, "family")}
+
+        # {client_id: очередь закодированных кадров}
+        self._queues: Dict[str, asyncio.Queue] = {}
+        # {client_id: задача-писатель}
+        self._writers: Dict[str, asyncio.Task] = {}
+        # {client_id: выброшено кадров подряд}
+        self._dropped_streak: Dict[str, int] = {}
+        # Счётчики очередей за всё время
+        self.queue_stats = {"sent": 0, "dropped": 0, "slow_disconnects": 0}
+
+        # {client_id: закодированные события, ждущие кадра api-batch}
+        self._batches: Dict[str, List[Frame]] = {}
+        # {client_id: таймер отправки пакета}
+        self._batch_timers: Dict[str, asyncio.Task] = {}
+        # {session_id: сколько batch_scope этой сессии сейчас открыто}
+        self._batch_scopes: Dict[str, int] = {}
+
+        # Наблюдатели за всеми broadcast-событиями (например, синхронизация состояния)
+        self._listeners: List[Callable[[dict], None]] = []
+
+    async def connect(self, websocket: WebSocket, client_id: str,
+                      encoding: str = codec.JSON) -> bool:
         """
         Подключить новое WebSocket соединение
 
         Args:
             websocket: WebSocket соединение
             client_id: Уникальный ID клиента
+            encoding: Кодировка кадров (codec.JSON или codec.MSGPACK)
 
         Returns:
             bool: True если подключение успешно, False если клиент уже подключен
@@ -35,6 +119,14 @@ class WebSocketManager:
                 await self.disconnect(client_id)
 
             self.active_connections[client_id] = websocket
+            self._encodings[client_id] = encoding
+            self._by_prefix.setdefault(client_id[:3], set()).add(client_id)
+
+            queue: asyncio.Queue = asyncio.Queue(maxsize=SEND_QUEUE_SIZE)
+            self._queues[client_id] = queue
+            self._dropped_streak[client_id] = 0
+            self._writers[client_id] = asyncio.create_task(
+                self._writer(client_id, websocket, queue))
             websocket_logger.info(f"WebSocket подключение установлено для клиента: {client_id}")
             return True
 
@@ -61,6 +153,16 @@ class WebSocketManager:
                     pass  # Соединение уже может быть закрыто
 
                 del self.active_connections[client_id]
+                self._encodings.pop(client_id, None)
+                self._by_prefix.get(client_id[:3], set()).discard(client_id)
+                self.unsubscribe(client_id)
+
+                self._queues.pop(client_id, None)
+                self._dropped_streak.pop(client_id, None)
+                self.set_batching(client_id, False, flush=False)
+                writer = self._writers.pop(client_id, None)
+                if writer and writer is not asyncio.current_task():
+                    writer.cancel()
                 websocket_logger.info(f"WebSocket соединение закрыто для клиента: {client_id}")
                 return True
 
@@ -71,6 +173,67 @@ class WebSocketManager:
             websocket_logger.error(f"Ошибка при отключении WebSocket для {client_id}: {e}")
             return False
 
+    @staticmethod
+    def encode(message: Any, encoding: str = codec.JSON) -> Frame:
+        """Кодирует сообщение в кадр (JSON-строка или MessagePack-байты)"""
+        return codec.encode(message, encoding)
+
+    def get_encoding(self, client_id: str) -> str:
+        return self._encodings.get(client_id, codec.JSON)
+
+    async def _writer(self, client_id: str, websocket: WebSocket, queue: asyncio.Queue):
+        """Отправляет кадры из очереди клиента по одному"""
+        try:
+            while True:
+                frame = await queue.get()
+                if isinstance(frame, bytes):
+                    await websocket.send_bytes(frame)
+                else:
+                    await websocket.send_text(frame)
+
+                self._dropped_streak[client_id] = 0
+                self.queue_stats["sent"] += 1
+
+        except asyncio.CancelledError:
+            pass
+        except WebSocketDisconnect:
+            websocket_logger.warning(f"Клиент {client_id} отключился")
+            await self._disconnect_if_current(client_id, websocket)
+        except Exception as e:
+            websocket_logger.error(f"Ошибка при отправке сообщения клиенту {client_id}: {e}")
+            # Отключаем клиента при ошибке, чтобы избежать цикла повторных попыток
+            await self._disconnect_if_current(client_id, websocket)
+
+    async def _disconnect_if_current(self, client_id: str, websocket: WebSocket):
+        # Клиент мог уже переподключиться с новым соединением
+        if self.active_connections.get(client_id) is websocket:
+            await self.disconnect(client_id)
+
+    def _enqueue(self, client_id: str, frame: Frame, droppable: bool) -> bool:
+        """Кладёт кадр в очередь клиента, применяя политику для отстающих"""
+        queue = self._queues.get(client_id)
+        if queue is None:
+            return False
+
+        try:
+            queue.put_nowait(frame)
+            return True
+        except asyncio.QueueFull:
+            pass
+
+        self.queue_stats["dropped"] += 1
+        streak = self._dropped_streak.get(client_id, 0) + 1
+        self._dropped_streak[client_id] = streak
+
+        if not droppable or streak >= SEND_DROP_LIMIT:
+            # Больше ничего не ставим в очередь, клиент будет отключен
+            self._queues.pop(client_id, None)
+            self.queue_stats["slow_disconnects"] += 1
+            websocket_logger.warning(f"Клиент {client_id} не успевает принимать сообщения (в очереди {queue.qsize()}), отключаем")
+            asyncio.create_task(self._disconnect_if_current(
+                client_id, self.active_connections.get(client_id)))
+        return False
+
     async def send_message(self, client_id: str, message: Any, log: bool = True) -> bool:
         """
         Отправить сообщение конкретному клиенту
@@ -80,35 +243,196 @@ class WebSocketManager:
             message: Сообщение (словарь, строка или любой JSON-сериализуемый объект)
             
         Returns:
-            bool: True если сообщение отправлено успешно
+            bool: True если сообщение поставлено в очередь отправки
         """
+        if client_id not in self.active_connections:
+            websocket_logger.warning(f"Попытка отправить сообщение несуществующему клиенту: {client_id}")
+            return False
+
         try:
-            if client_id not in self.active_connections:
-                websocket_logger.warning(f"Попытка отправить сообщение несуществующему клиенту: {client_id}")
-                return False
+            frame = self.encode(message, self.get_encoding(client_id))
+        except Exception as e:
+            websocket_logger.error(f"Ошибка при кодировании сообщения клиенту {client_id}: {e}\nmessage: {message}")
+            return False
 
-            websocket = self.active_connections[client_id]
+        # Накопленные события уходят раньше ответа, чтобы не нарушить порядок
+        self._flush_batch(client_id)
 
-            # Конвертируем сообщение в JSON если это не строка
-            if isinstance(message, str):
-                await websocket.send_text(message)
-            else:
-                await websocket.send_text(json.dumps(message, ensure_ascii=False))
+        # Ответы на запросы не выбрасываются: переполнение - отключение
+        queued = self._enqueue(client_id, frame, droppable=False)
+        if queued and log:
+            websocket_logger.info(f"Sent message to {client_id}")
+        return queued
 
-            if log:
-                websocket_logger.info(f"Sent message to {client_id}")
+    def set_batching(self, client_id: str, enabled: bool, flush: bool = True):
+        """Включить или выключить пакетную доставку событий клиенту"""
+        if enabled:
+            self._batches.setdefault(client_id, [])
+            return
 
-            return True
+        if flush:
+            self._flush_batch(client_id)
+        self._batches.pop(client_id, None)
+        timer = self._batch_timers.pop(client_id, None)
+        if timer: timer.cancel()
 
-        except WebSocketDisconnect:
-            websocket_logger.warning(f"Клиент {client_id} отключился")
-            await self.disconnect(client_id)
-            return False
-        except Exception as e:
-            websocket_logger.error(f"Ошибка при отправке сообщения клиенту {client_id}: {e}\nmessage: {message}")
-            # Отключаем клиента при ошибке, чтобы избежать цикла повторных попыток
-            await self.disconnect(client_id)
-            return False
+    def is_batching(self, client_id: str) -> bool:
+        return client_id in self._batches
+
+    def _add_to_batch(self, client_id: str, frame: Frame,
+                      session_id: Optional[str] = None) -> bool:
+        batch = self._batches[client_id]
+        batch.append(frame)
+
+        if len(batch) >= BATCH_MAX_EVENTS:
+            return self._flush_batch(client_id)
+
+        # События перехода сессии уйдут при закрытии её batch_scope
+        if session_id in self._batch_scopes: return True
+
+        if client_id not in self._batch_timers:
+            self._batch_timers[client_id] = asyncio.create_task(
+                self._flush_later(client_id))
+        return True
+
+    async def _flush_later(self, client_id: str):
+        try:
+            await asyncio.sleep(BATCH_WINDOW_MS / 1000)
+        except asyncio.CancelledError:
+            return
+
+        self._batch_timers.pop(client_id, None)
+        self._flush_batch(client_id)
+
+    def _flush_batch(self, client_id: str) -> bool:
+        """Отправить накопленные события клиента одним кадром api-batch"""
+        timer = self._batch_timers.pop(client_id, None)
+        if timer and timer is not asyncio.current_task():
+            timer.cancel()
+
+        batch = self._batches.get(client_id)
+        if not batch: return True
+        self._batches[client_id] = []
+
+        # События уже закодированы, кадр собирается без повторного кодирования
+        frame = codec.encode_batch(batch, self.get_encoding(client_id))
+        return self._enqueue(client_id, frame, droppable=True)
+
+    def flush_batches(self):
+        """Отправить накопленные события всем клиентам с пакетной доставкой"""
+        for client_id in list(self._batches):
+            self._flush_batch(client_id)
+
+    @asynccontextmanager
+    async def batch_scope(self, session_id: str):
+        """
+        Переход сессии (например, смена стадии), события которого клиенты
+        с пакетной доставкой получат одним api-batch по завершении
+        """
+        self._batch_scopes[session_id] = self._batch_scopes.get(session_id, 0) + 1
+        try:
+            yield
+        finally:
+            self._batch_scopes[session_id] -= 1
+            if not self._batch_scopes[session_id]:
+                del self._batch_scopes[session_id]
+                self.flush_batches()
+
+    def add_listener(self, listener: Callable[[dict], None]):
+        """Подписать функцию на все broadcast-события (вызывается синхронно)"""
+        self._listeners.append(listener)
+
+    def get_queue_metrics(self) -> dict:
+        """
+        Метрики очередей отправки
+
+        Returns:
+            dict: Глубина очереди каждого клиента и общие счётчики
+        """
+        depths = {client_id: queue.qsize() for client_id, queue in self._queues.items()}
+        return {
+            **self.queue_stats,
+            "max_depth": max(depths.values(), default=0),
+            "total_depth": sum(depths.values()),
+            "queue_size": SEND_QUEUE_SIZE,
+            "clients": depths
+        }
+
+    def subscribe(self, client_id: str,
+                  sessions: Optional[Iterable[Any]] = None,
+                  companies: Optional[Iterable[Any]] = None,
+                  families: Optional[Iterable[str]] = None) -> dict:
+        """
+        Заменить подписку клиента
+
+        Пустое измерение не ограничивает поток. Событие без session_id
+        или company_id не отсекается соответствующим измерением.
+
+        Returns:
+            dict: Текущая подписка клиента
+        """
+        self.unsubscribe(client_id)
+
+        subscription = {
+            "session": set(sessions or []),
+            "company": set(companies or []),
+            "family": set(families or [])
+        }
+        subscription = {k: v for k, v in subscription.items() if v}
+        if not subscription:
+            return {}
+
+        self._subscriptions[client_id] = subscription
+        for dimension, values in subscription.items():
+            self._restricted[dimension].add(client_id)
+            for value in values:
+                self._topics.setdefault(f"{dimension}:{value}", set()).add(client_id)
+
+        return {dimension: sorted(values, key=str) for dimension, values in subscription.items()}
+
+    def unsubscribe(self, client_id: str):
+        """Снять все подписки клиента (снова получает все события канала)"""
+        subscription = self._subscriptions.pop(client_id, None)
+        if not subscription: return
+
+        for dimension, values in subscription.items():
+            self._restricted[dimension].discard(client_id)
+            for value in values:
+                topic = f"{dimension}:{value}"
+                subscribers = self._topics.get(topic)
+                if subscribers is None: continue
+                subscribers.discard(client_id)
+                if not subscribers:
+                    del self._topics[topic]
+
+    def _recipients(self, message: dict) -> Set[str]:
+        """Клиенты, которым положено событие, по индексам каналов и тем"""
+        event_type = message.get('type', '')
+
+        allowed: Set[str] = set()
+        for prefix in event_prefixes.get(event_type, ()):
+            allowed |= self._by_prefix.get(prefix, set())
+        if not allowed or not self._subscriptions:
+            return allowed
+
+        subscribed = allowed & self._subscriptions.keys()
+        recipients = allowed - subscribed
+
+        data = message.get('data')
+        data = data if isinstance(data, dict) else {}
+
+        values = {dimension: data.get(key) for dimension, key in SUBSCRIPTION_KEYS.items()}
+        values["family"] = event_family(event_type)
+
+        for dimension, value in values.items():
+            if not subscribed: break
+            if value is None: continue
+
+            # Подходит, если подписан на это значение или не ограничивал измерение
+            restricted = self._restricted[dimension]
+            subscribed &= self._topics.get(f"{dimension}:{value}", set()) | (subscribed - restricted)
+
+        return recipients | subscribed
 
     async def broadcast(self, message: Any, 
                         exclude: Optional[List[str]] = None) -> int:
@@ -120,24 +444,39 @@ class WebSocketManager:
             exclude: Список ID клиентов, которых нужно исключить
 
         Returns:
-            int: Количество клиентов, которым успешно доставлено сообщение
+            int: Количество клиентов, которым сообщение поставлено в очередь
         """
         exclude = exclude or []
         success_count = 0
         event_type = message.get('type')
 
-        # Создаем копию списка клиентов, чтобы избежать изменения во время итерации
-        clients = list(self.active_connections.keys())
+        for listener in self._listeners:
+            try:
+                listener(message)
+            except Exception as e:
+                websocket_logger.error(f"Ошибка наблюдателя broadcast ({event_type}): {e}")
 
+        # Получатели по каналам broadcast.json и подпискам клиентов
+        clients = self._recipients(message) - set(exclude)
+        if not clients:
+            return 0
+
+        # Кодируем один раз на кодировку для всех получателей
+        frames: Dict[str, Frame] = {}
+        session_id = (message.get('data') or {}).get('session_id')
         for client_id in clients:
-            if client_id not in exclude:
-                # Получаем первые 3 символа ID клиента
-                client_prefix = client_id[:3]
-
-                # Проверяем, есть ли префикс в events и событие в списке
-                if client_prefix in events and event_type in events[client_prefix]:
-                    if await self.send_message(client_id, message, False):
-                        success_count += 1
+            encoding = self.get_encoding(client_id)
+            frame = frames.get(encoding)
+            if frame is None:
+                frame = frames[encoding] = self.encode(message, encoding)
+
+            if client_id in self._batches:
+                queued = self._add_to_batch(client_id, frame, session_id)
+            else:
+                queued = self._enqueue(client_id, frame, droppable=True)
+
+            if queued:
+                success_count += 1
 
         if success_count:
             websocket_logger.info(
@@ -1,16 +1,26 @@
 # Реестр обработчиков сообщений
-from typing import Callable, Dict, List, Union
+import asyncio
+import time
+from typing import Callable, Dict, List, Optional, Union
 from modules.websocket_manager import websocket_manager
 from modules.logs import websocket_logger
 from modules.logs import routers_logger
+from modules.metrics import request_metrics
+from global_modules.load_config import ALL_CONFIGS, Settings
 import traceback
 
+settings: Settings = ALL_CONFIGS['settings']
+
+# Сколько подзапросов может быть в одном batch
+BATCH_MAX_REQUESTS = 50
+
 MESSAGE_HANDLERS: Dict[str, dict[str, Union[Callable, str]]] = {}
 
 def message_handler(message_type: str, 
                     doc: str = "", 
                     datatypes: list[str] = [],
-                    messages: list[str] = []
+                    messages: list[str] = [],
+                    ordered: Optional[bool] = None
                     ):
     """
     Декоратор для регистрации обработчиков сообщений
@@ -26,34 +36,50 @@ def message_handler(message_type: str,
         doc: Описание обработчика
         datatypes: Список типов данных, которые ожидает обработчик [user_id: int, action: Optional[str], ...]
         messages: На какие типы сообщений отправляет ответ при обработке
+        ordered: Обрабатывать строго по порядку получения: после всех
+            ранее полученных запросов соединения и до всех последующих.
+            По умолчанию параллельно выполняются только читающие get-*,
+            изменяющие игру обработчики идут по очереди (они сохраняют
+            объекты целиком и не должны перезаписывать друг друга)
     """
+    if ordered is None:
+        ordered = not message_type.startswith("get-")
+
     def decorator(func: Callable):
         MESSAGE_HANDLERS[message_type] = {
             "handler": func, "doc": doc,
             "datatypes": datatypes,
-            "messages": messages
+            "messages": messages,
+            "ordered": ordered
             }
         websocket_logger.info(f"Зарегистрирован обработчик для типа сообщения: {message_type}")
         return func
     return decorator
 
-async def handle_message(client_id: str, message: dict):
+async def handle_message(client_id: str, message: dict, request_bytes: int = 0):
     """
     Обработчик входящих сообщений от клиентов через систему декораторов
     
     Args:
         client_id: ID клиента, отправившего сообщение
         message: Сообщение от клиента
+        request_bytes: Размер кадра сообщения (для метрик)
     """
     message_type = message.get("type", "unknown")
 
     # Ищем зарегистрированный обработчик
     if message_type in MESSAGE_HANDLERS:
+        request_metrics.started(message_type, request_bytes)
+        started = time.perf_counter()
+        error = False
+        response_bytes = 0
+
         try:
             routers_logger.info(f"Обработка сообщения типа {message_type} от клиента {client_id}")
 
             handler = MESSAGE_HANDLERS[message_type]["handler"]
             result = await handler(client_id, message)
+            error = isinstance(result, dict) and "error" in result
 
             if 'request_id' in message:
                 # Если есть request_id, отправляем ответ
@@ -62,10 +88,15 @@ async def handle_message(client_id: str, message: dict):
                     "request_id": message["request_id"],
                     "data": result
                 }
+                frame = websocket_manager.encode(
+                    response, websocket_manager.get_encoding(client_id))
+                response_bytes = len(frame) if isinstance(frame, bytes) else len(frame.encode())
+
                 routers_logger.info(f"Отправка ответа на request_id {message['request_id']} клиенту {client_id}")
-                await websocket_manager.send_message(client_id, response)
+                await websocket_manager.send_message(client_id, frame)
 
         except Exception as e:
+            error = True
             print(traceback.format_exc())
             websocket_logger.error(f"Ошибка в обработчике {message_type}: {e}\n{traceback.format_exc()}")
             # Проверяем, что клиент все еще подключен перед отправкой ошибки
@@ -79,6 +110,10 @@ async def handle_message(client_id: str, message: dict):
                 routers_logger.error(
                     f"Ошибка в роутере {message_type} для клиента {client_id}: {error_message}")
 
+        finally:
+            request_metrics.finished(
+                message_type, time.perf_counter() - started, error, response_bytes)
+
     else:
         # Неизвестный тип сообщения
         websocket_logger.warning(f"Неизвестный тип сообщения от {client_id}: {message_type}")
@@ -96,6 +131,112 @@ async def handle_message(client_id: str, message: dict):
             }
             await websocket_manager.send_message(client_id, error_message)
 
+def is_ordered(message: dict) -> bool:
+    """ Нужно ли выполнять сообщение по порядку (batch - если таков хоть один подзапрос) """
+    message_type = message.get("type", "unknown")
+    if message_type == "batch":
+        requests = message.get("requests")
+        return not isinstance(requests, list) or any(
+            is_ordered(request) for request in requests if isinstance(request, dict))
+
+    info = MESSAGE_HANDLERS.get(message_type)
+    return bool(info and info.get("ordered"))
+
+async def _call_sub_request(client_id: str, message: dict):
+    """ Выполнить подзапрос batch и вернуть результат (ошибка - {"error": ...}) """
+    message_type = message.get("type", "unknown")
+    info = MESSAGE_HANDLERS.get(message_type)
+    if info is None or message_type == "batch":
+        return {"error": f"Неизвестный тип сообщения: {message_type}"}
+
+    request_metrics.started(message_type)
+    started = time.perf_counter()
+    result = None
+    try:
+        result = await info["handler"](client_id, message)
+        return result
+    except Exception as e:
+        websocket_logger.error(f"Ошибка в обработчике {message_type} (batch): {e}\n{traceback.format_exc()}")
+        result = {"error": str(e)}
+        return result
+    finally:
+        request_metrics.finished(
+            message_type, time.perf_counter() - started,
+            isinstance(result, dict) and "error" in result)
+
+async def run_batch(client_id: str, requests: list, shared: Optional[dict] = None) -> list:
+    """
+    Выполнить несколько запросов и вернуть результаты в том же порядке
+
+    Подзапросы выполняются параллельно, а если среди них есть упорядоченные
+    (ordered) - по очереди. shared - поля, добавляемые в каждый подзапрос.
+    """
+    if not isinstance(requests, list) or not requests:
+        raise ValueError("requests должен быть непустым списком запросов.")
+
+    if len(requests) > BATCH_MAX_REQUESTS:
+        raise ValueError(f"В batch может быть не больше {BATCH_MAX_REQUESTS} запросов.")
+
+    if not all(isinstance(request, dict) for request in requests):
+        raise ValueError("Каждый запрос batch должен быть объектом с полем type.")
+
+    messages = [{**(shared or {}), **request} for request in requests]
+
+    if any(is_ordered(m) for m in messages):
+        return [await _call_sub_request(client_id, m) for m in messages]
+
+    return list(await asyncio.gather(
+        *(_call_sub_request(client_id, m) for m in messages)))
+
+class RequestDispatcher:
+    """ Конкурентная обработка запросов одного соединения
+
+        Запросы выполняются параллельно (не больше limit одновременно,
+        дальше чтение соединения ждёт), ответы сопоставляются по request_id.
+        Запрос с ordered-обработчиком (по умолчанию - все, кроме get-*)
+        ждёт все ранее полученные запросы, а последующие запросы ждут его.
+    """
+
+    def __init__(self, client_id: str,
+                 limit: int = settings.ws_max_inflight_requests):
+        self.client_id = client_id
+        self._slots = asyncio.Semaphore(limit)
+        self._in_flight: set[asyncio.Task] = set()
+        # Последний упорядоченный запрос
+        self._barrier: Optional[asyncio.Task] = None
+
+    async def submit(self, message: dict, request_bytes: int = 0):
+        """ Запустить обработку сообщения, не дожидаясь её окончания """
+        await self._slots.acquire()
+
+        ordered = is_ordered(message)
+        if ordered:
+            wait_for = set(self._in_flight)
+        elif self._barrier and not self._barrier.done():
+            wait_for = {self._barrier}
+        else:
+            wait_for = set()
+
+        task = asyncio.create_task(self._run(message, wait_for, request_bytes))
+        if ordered:
+            self._barrier = task
+
+        self._in_flight.add(task)
+        task.add_done_callback(self._in_flight.discard)
+
+    async def _run(self, message: dict, wait_for: set, request_bytes: int):
+        try:
+            if wait_for:
+                await asyncio.wait(wait_for)
+            await handle_message(self.client_id, message, request_bytes)
+        except Exception as e:
+            websocket_logger.error(f"Ошибка при обработке сообщения от {self.client_id}: {e}\n{traceback.format_exc()}")
+        finally:
+            self._slots.release()
+
+    def in_flight(self) -> int:
+        return len(self._in_flight)
+
 # Функция для получения списка зарегистрированных обработчиков
 def get_registered_handlers():
     """Получить список всех зарегистрированных типов сообщений"""
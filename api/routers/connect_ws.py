@@ -2,9 +2,11 @@ from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Query, HTTPExcept
 from fastapi.responses import JSONResponse
 import json
 
-from modules.ws_hadnler import get_registered_handlers, handle_message
+from global_modules import codec
+from modules.ws_hadnler import get_registered_handlers, RequestDispatcher
 from modules.websocket_manager import websocket_manager
 from modules.logs import websocket_logger
+from modules.metrics import request_metrics
 
 router = APIRouter(prefix="/ws", tags=["WebSocket"])
 
@@ -12,38 +14,61 @@ router = APIRouter(prefix="/ws", tags=["WebSocket"])
 @router.websocket("/connect")
 async def websocket_endpoint(
     websocket: WebSocket,
-    client_id: str = Query(..., description="Уникальный ID клиента")
+    client_id: str = Query(..., description="Уникальный ID клиента"),
+    encoding: str = Query(codec.JSON, description="Кодировка кадров: json или msgpack")
 ):
     """
     WebSocket эндпоинт для подключения клиентов
+
+    Сжатие (permessage-deflate) согласуется самим WebSocket-рукопожатием,
+    если клиент его предлагает. Кодировку кадров выбирает параметр encoding:
+    json - текстовые кадры, msgpack - бинарные кадры MessagePack.
     
     Args:
         websocket: WebSocket соединение
         client_id: Уникальный идентификатор клиента
+        encoding: Кодировка кадров
     """
-    connection_successful = await websocket_manager.connect(websocket, client_id)
+    frame_encoding = codec.resolve_encoding(encoding)
+    if frame_encoding != encoding.lower():
+        websocket_logger.warning(f"Кодировка {encoding} недоступна для {client_id}, используется {frame_encoding}")
+
+    connection_successful = await websocket_manager.connect(
+        websocket, client_id, frame_encoding)
     
     if not connection_successful:
         await websocket.close(code=1000, reason="Ошибка подключения")
         return
+
+    # Запросы соединения обрабатываются параллельно, следующий кадр читается сразу
+    dispatcher = RequestDispatcher(client_id)
     
     try:
         # Основной цикл получения сообщений
         while True:
             try:
-                # Ожидаем сообщение от клиента
-                data = await websocket.receive_text()
-                websocket_logger.info(f"Получено сообщение от {client_id}: {data}")
+                # Ожидаем сообщение от клиента (текстовый или бинарный кадр)
+                received = await websocket.receive()
+                if received["type"] == "websocket.disconnect":
+                    raise WebSocketDisconnect(received.get("code", 1000))
+
+                data = received.get("text")
+                if data is None:
+                    data = received.get("bytes") or b""
+                    websocket_logger.info(f"Получено сообщение от {client_id}: <{len(data)} байт>")
+                else:
+                    websocket_logger.info(f"Получено сообщение от {client_id}: {data}")
 
                 try:
-                    # Пытаемся распарсить JSON
-                    message = json.loads(data)
+                    # JSON для текстовых кадров, MessagePack для бинарных
+                    message = codec.decode(data)
                 except json.JSONDecodeError:
                     # Если не JSON, обрабатываем как текст
                     message = {"type": "text", "content": data}
                 
                 # Обработка различных типов сообщений
-                await handle_message(client_id, message)
+                size = len(data) if isinstance(data, bytes) else len(data.encode())
+                await dispatcher.submit(message, size)
 
             except WebSocketDisconnect:
                 websocket_logger.info(f"Клиент {client_id} отключился")
@@ -93,6 +118,9 @@ async def get_websocket_status():
             elif len(info["datatypes"]) > 0:
                 available_types[-1]["args"] = ', '.join(info.get("datatypes", []))
 
+            if info.get("ordered"):
+                available_types[-1]["ordered"] = True
+
             if info.get("messages") and len(info["messages"]) > 0:
                 available_types[-1]["responses"] = info.get("messages", [])
             else:
@@ -103,6 +131,8 @@ async def get_websocket_status():
             "total_connections": connection_count,
             "connected_clients": connected_clients,
             "server_status": "running",
+            "encodings": codec.available_encodings(),
+            "handlers": request_metrics.rolling(),
             "supported_message_types": available_types
         })
 
@@ -122,6 +152,7 @@ async def get_connections():
             "total_connections": connection_count,
             "connected_clients": connected_clients,
             "server_status": "running",
+            "send_queues": websocket_manager.get_queue_metrics()
         })
     
     except Exception as e:
@@ -97,6 +97,49 @@ async def handle_sell_to_city(client_id: str, message: dict):
     except ValueError as e:
         return {"error": str(e)}
 
+@message_handler(
+    "sell-to-city-batch", 
+    doc="Обработчик продажи городу нескольких ресурсов одним заказом. Заказ проходит целиком или не проходит. Если отправка части позиций не удалась, ответ - {error, lines} с уже проданными позициями. Отправляет ответ на request_id.",
+    datatypes=[
+        "city_id: int",
+        "company_id: int",
+        "lines: list[dict] ({resource_id: str, amount: int})",
+        "password: str",
+        "request_id: str"
+    ],
+    messages=["api-city-trade (broadcast)"]
+)
+async def handle_sell_to_city_batch(client_id: str, message: dict):
+    """Обработчик продажи городу нескольких ресурсов"""
+
+    password = message.get("password")
+    city_id = message.get("city_id")
+    company_id = message.get("company_id")
+    lines = message.get("lines")
+
+    for i in [password, city_id, company_id, lines]:
+        if i is None:
+            return {"error": "Missing required fields"}
+
+    if not isinstance(lines, list) or not all(isinstance(line, dict) for line in lines):
+        return {"error": "lines должен быть списком {resource_id, amount}"}
+
+    try:
+        check_password(password)
+
+        city = await Citie(city_id).reupdate()
+        if not city:
+            raise ValueError("Город не найден.")
+
+        sold, error = await city.sell_resources(company_id, lines)
+        if error:
+            # Часть позиций уже продана - клиент узнаёт о них вместе с ошибкой
+            return {"error": error, "lines": sold}
+        return {"success": True, "lines": sold}
+
+    except ValueError as e:
+        return {"error": str(e)}
+
 @message_handler(
     "get-city-demands", 
     doc="Обработчик получения спроса города на товары. Отправляет ответ на request_id.", 
@@ -120,6 +163,6 @@ async def handle_get_city_demands(client_id: str, message: dict):
 
     return {
         "city_id": city.id,
-        "demands": city.demands,
+        "demands": city.active_demands(),
         "branch": city.branch
     }
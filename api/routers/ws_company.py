@@ -3,16 +3,22 @@ from modules.websocket_manager import websocket_manager
 from modules.check_password import check_password
 from modules.ws_hadnler import message_handler
 from modules.db import just_db
+from modules.pagination import PageRequest, paginate
 from game.company import Company
 from game.statistic import Statistic
 
 @message_handler(
     "get-companies", 
-    doc="Обработчик получения списка компаний. Отправляет ответ на request_id", 
+    doc="Обработчик получения списка компаний. С limit ответ постраничный: {items, total, limit, next_cursor, sort, order}. Отправляет ответ на request_id", 
     datatypes=[
         "session_id: Optional[int]", 
         "in_prison: Optional[bool]",
         "cell_position: Optional[str]",
+        "limit: Optional[int]",
+        "cursor: Optional[str]",
+        "offset: Optional[int]",
+        "sort: Optional[str] (id, name, balance, reputation, economic_power)",
+        "order: Optional[Literal['asc', 'desc']]",
         "request_id: str"
         ])
 async def handle_get_companies(client_id: str, message: dict):
@@ -24,9 +30,22 @@ async def handle_get_companies(client_id: str, message: dict):
         "session_id": message.get("session_id")
     }
 
+    filters = {k: v for k, v in conditions.items() if v is not None}
+
+    try:
+        page = PageRequest.from_message(
+            message, ["id", "name", "balance", "reputation", "economic_power"])
+        if page:
+            companies, total, next_cursor = await paginate(
+                'companies', page, filters, to_class=Company)
+            return page.response(
+                [await company.to_dict() for company in companies], total, next_cursor)
+    except ValueError as e:
+        return {"error": str(e)}
+
     # Получаем список компаний из базы данных
     companies: list[Company] = await just_db.find('companies', to_class=Company,
-                         **{k: v for k, v in conditions.items() if v is not None}) # type: ignore
+                         **filters) # type: ignore
 
     return [await company.to_dict() for company in companies]
 
@@ -706,7 +725,8 @@ async def handle_notforgame_to_prison(
         "session_id: str",
         "request_id: str"
     ],
-    messages=[]
+    messages=[],
+    ordered=False
 )
 async def handle_company_get_statistics(client_id: str, message: dict):
     """Обработчик получения статистики компании"""
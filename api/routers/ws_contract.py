@@ -3,16 +3,23 @@ from modules.websocket_manager import websocket_manager
 from modules.check_password import check_password
 from modules.ws_hadnler import message_handler
 from modules.db import just_db
+from modules.pagination import PageRequest, paginate
 
 @message_handler(
     "get-contracts", 
-    doc="Обработчик получения списка контрактов. Отправляет ответ на request_id", 
+    doc="Обработчик получения списка контрактов. С limit ответ постраничный: {items, total, limit, next_cursor, sort, order}. Отправляет ответ на request_id", 
     datatypes=[
         "session_id: Optional[str]", 
         "supplier_company_id: Optional[int]",
         "customer_company_id: Optional[int]",
+        "company_id: Optional[int] (поставщик или заказчик)",
         "accepted: Optional[bool]",
         "resource: Optional[str]",
+        "limit: Optional[int]",
+        "cursor: Optional[str]",
+        "offset: Optional[int]",
+        "sort: Optional[str] (id, created_at_step, payment_amount, duration_turns)",
+        "order: Optional[Literal['asc', 'desc']]",
         "request_id: str"
         ])
 async def handle_get_contracts(client_id: str, message: dict):
@@ -26,9 +33,29 @@ async def handle_get_contracts(client_id: str, message: dict):
         "resource": message.get("resource")
     }
 
+    filters = {k: v for k, v in conditions.items() if v is not None}
+
+    company_id = message.get("company_id")
+    if company_id is not None:
+        # Контракты компании с обеих сторон одним запросом
+        filters["$or"] = [
+            {"supplier_company_id": company_id},
+            {"customer_company_id": company_id}
+        ]
+
+    try:
+        page = PageRequest.from_message(
+            message, ["id", "created_at_step", "payment_amount", "duration_turns"])
+        if page:
+            contracts, total, next_cursor = await paginate(
+                'contracts', page, filters, to_class=Contract)
+            return page.response(
+                [contract.to_dict() for contract in contracts], total, next_cursor)
+    except ValueError as e:
+        return {"error": str(e)}
+
     # Получаем список контрактов из базы данных
-    contracts_data: list[dict] = await just_db.find('contracts',
-                         **{k: v for k, v in conditions.items() if v is not None}) # type: ignore
+    contracts_data: list[dict] = await just_db.find('contracts', **filters) # type: ignore
 
     contracts = []
     for contract_data in contracts_data:
@@ -2,16 +2,25 @@ from modules.websocket_manager import websocket_manager
 from modules.check_password import check_password
 from modules.ws_hadnler import message_handler
 from modules.db import just_db
-from game.exchange import Exchange
+from modules.pagination import PageRequest, paginate
+from game.exchange import Exchange, order_book
+from game.buy_order import BuyOrder
 
 @message_handler(
     "get-exchanges", 
-    doc="Обработчик получения списка предложений на бирже. Отправляет ответ на request_id.", 
+    doc="Обработчик получения списка предложений на бирже. Предложения сессии отдаются из стакана по возрастанию цены за единицу. С limit ответ постраничный: {items, total, limit, next_cursor, sort, order}. Отправляет ответ на request_id.", 
     datatypes=[
         "session_id: Optional[str]",
         "company_id: Optional[int]",
         "sell_resource: Optional[str]",
         "offer_type: Optional[str]",
+        "min_price: Optional[float] (цена за единицу, только с session_id)",
+        "max_price: Optional[float] (цена за единицу, только с session_id)",
+        "limit: Optional[int]",
+        "cursor: Optional[str]",
+        "offset: Optional[int]",
+        "sort: Optional[str] (unit_price с session_id; иначе id, price, total_stock, created_at_step)",
+        "order: Optional[Literal['asc', 'desc']] (только без session_id)",
         "request_id: str"
     ])
 async def handle_get_exchanges(client_id: str, 
@@ -25,12 +34,48 @@ async def handle_get_exchanges(client_id: str,
         "offer_type": message.get("offer_type")
     }
 
-    # Получаем список предложений из базы данных
-    offers = await just_db.find('exchanges',
-                         **{k: v for k, v in conditions.items() if v is not None},
-                         to_class=Exchange)
+    try:
+        if conditions["session_id"] is not None:
+            page = PageRequest.from_message(message, ["unit_price"])
+            if page and page.order != 'asc':
+                raise ValueError("Стакан отдаётся только по возрастанию цены.")
+
+            offers, total = await order_book.query(
+                session_id=conditions["session_id"],
+                sell_resource=conditions["sell_resource"],
+                offer_type=conditions["offer_type"],
+                company_id=conditions["company_id"],
+                min_price=message.get("min_price"),
+                max_price=message.get("max_price"),
+                after=page.decode_cursor() if page and page.cursor else None,
+                offset=page.offset if page and not page.cursor else 0,
+                limit=page.limit + 1 if page else None
+            )
+            if not page: return offers
+
+            next_cursor = None
+            if len(offers) > page.limit:
+                offers = offers[:page.limit]
+                next_cursor = page.encode_cursor(offers[-1])
+
+            return page.response(offers, total, next_cursor)
+
+        filters = {k: v for k, v in conditions.items() if v is not None}
+        page = PageRequest.from_message(
+            message, ["id", "price", "total_stock", "created_at_step"])
+
+        if page:
+            found, total, next_cursor = await paginate(
+                'exchanges', page, filters, to_class=Exchange)
+            return page.response(
+                [offer.to_dict() for offer in found], total, next_cursor)
+
+        # Получаем список предложений из базы данных
+        offers = await just_db.find('exchanges', **filters, to_class=Exchange)
+        return [offer.to_dict() for offer in offers] # type: ignore
 
-    return [offer.to_dict() for offer in offers] # type: ignore
+    except ValueError as e:
+        return {"error": str(e)}
 
 @message_handler(
     "get-exchange", 
@@ -275,4 +320,119 @@ async def handle_buy_exchange_offer(
     except ValueError as e:
         return {"error": str(e)}
 
-    return result
\ No newline at end of file
+    return result
+
+@message_handler(
+    "create-buy-order", 
+    doc="Обработчик создания заявки на покупку (лимитная цена за единицу). Деньги резервируются сразу, заявка исполняется по встречным предложениям. Требуется пароль для взаимодействия.",
+    datatypes=[
+        "company_id: int",
+        "session_id: str",
+        "resource: str",
+        "amount: int",
+        "unit_price: int",
+
+        "password: str",
+        "request_id: str"
+    ],
+    messages=["api-buy_order_created (broadcast)", "api-exchange_orders_matched (broadcast)"]
+)
+async def handle_create_buy_order(client_id: str, message: dict):
+    """Обработчик создания заявки на покупку"""
+
+    company_id = message.get("company_id")
+    session_id = message.get("session_id")
+    resource = message.get("resource")
+    amount = message.get("amount")
+    unit_price = message.get("unit_price")
+    password = message.get("password")
+
+    required_fields = [company_id, session_id, resource, amount, unit_price, password]
+    if any(field is None for field in required_fields):
+        return {"error": "Missing required fields."}
+
+    try:
+        check_password(password)
+
+        order = await BuyOrder().create(
+            company_id=company_id,
+            session_id=session_id,
+            resource=resource,
+            amount=amount,
+            unit_price=unit_price
+        )
+
+    except ValueError as e:
+        return {"error": str(e)}
+
+    return {
+        "session_id": order.session_id,
+        "order": order.to_dict(),
+        "status": "filled" if order.amount <= 0 else "open"
+    }
+
+@message_handler(
+    "cancel-buy-order", 
+    doc="Обработчик отмены заявки на покупку (возврат зарезервированных денег). Требуется пароль для взаимодействия.",
+    datatypes=[
+        "order_id: int",
+        "password: str",
+        "request_id: str"
+    ],
+    messages=["api-buy_order_cancelled (broadcast)"]
+)
+async def handle_cancel_buy_order(client_id: str, message: dict):
+    """Обработчик отмены заявки на покупку"""
+
+    order_id = message.get("order_id")
+    password = message.get("password")
+
+    if order_id is None or password is None:
+        return {"error": "Missing required fields: order_id, password"}
+
+    try:
+        check_password(password)
+
+        order = await BuyOrder(id=order_id).reupdate()
+        if not order:
+            raise ValueError("Заявка на покупку не найдена.")
+
+        await order.cancel()
+
+    except ValueError as e:
+        return {"error": str(e)}
+
+    return {
+        "session_id": order.session_id,
+        "order_id": order_id,
+        "company_id": order.company_id,
+        "status": "cancelled"
+    }
+
+@message_handler(
+    "get-buy-orders", 
+    doc="Обработчик получения заявок на покупку (по убыванию цены за единицу). Отправляет ответ на request_id.", 
+    datatypes=[
+        "session_id: str",
+        "company_id: Optional[int]",
+        "resource: Optional[str]",
+        "request_id: str"
+    ])
+async def handle_get_buy_orders(client_id: str, message: dict):
+    """Обработчик получения заявок на покупку"""
+
+    conditions = {
+        "session_id": message.get("session_id"),
+        "company_id": message.get("company_id"),
+        "resource": message.get("resource")
+    }
+
+    if conditions["session_id"] is None:
+        return {"error": "Missing required fields."}
+
+    orders = await just_db.find(BuyOrder.__tablename__,
+                         to_class=BuyOrder,
+                         sort=[("unit_price", -1), ("id", 1)],
+                         **{k: v for k, v in conditions.items() if v is not None})
+
+    return [order.to_dict() for order in orders] # type: ignore
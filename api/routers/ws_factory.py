@@ -1,17 +1,23 @@
 
 from modules.ws_hadnler import message_handler
 from modules.db import just_db
+from modules.pagination import PageRequest, paginate
 from game.factory import Factory
 from modules.check_password import check_password
 
 @message_handler(
     "get-factories", 
-    doc="Обработчик получения списка всех фабрик. Отправляет ответ на request_id", 
+    doc="Обработчик получения списка всех фабрик. С limit ответ постраничный: {items, total, limit, next_cursor, sort, order}. Отправляет ответ на request_id", 
     datatypes=[
         "company_id: Optional[int]",
         "complectation: Optional[str]",
         "produce: Optional[bool]",
         "is_auto: Optional[bool]",
+        "limit: Optional[int]",
+        "cursor: Optional[str]",
+        "offset: Optional[int]",
+        "sort: Optional[str] (id, produced)",
+        "order: Optional[Literal['asc', 'desc']]",
 
         "request_id: str"
         ])
@@ -25,10 +31,22 @@ async def handle_get_factories(client_id: str, message: dict):
         "is_auto": message.get("is_auto"),
     }
 
+    filters = {k: v for k, v in conditions.items() if v is not None}
+
+    try:
+        page = PageRequest.from_message(message, ["id", "produced"])
+        if page:
+            factories, total, next_cursor = await paginate(
+                'factories', page, filters, to_class=Factory)
+            return page.response(
+                [await factory.to_dict() for factory in factories], total, next_cursor)
+    except ValueError as e:
+        return {"error": str(e)}
+
     # Получаем список фабрик из базы данных
     factories = await just_db.find('factories',
                              to_class=Factory,
-                         **{k: v for k, v in conditions.items() if v is not None})
+                         **filters)
 
     return [await factory.to_dict() for factory in factories]
 
@@ -1,13 +1,14 @@
 
 
 from modules.websocket_manager import websocket_manager
-from modules.ws_hadnler import message_handler
+from modules.ws_hadnler import message_handler, run_batch
 from modules.logs import websocket_logger
 
 @message_handler(
     "ping", 
     doc="Обработчик ping сообщений. Отправляет pong в ответ.", 
-    datatypes=["timestamp: str", "content: Any"])
+    datatypes=["timestamp: str", "content: Any"],
+    ordered=False)
 async def handle_ping(client_id: str, message: dict):
     """Обработчик ping сообщений"""
     pong_message = {
@@ -18,4 +19,74 @@ async def handle_ping(client_id: str, message: dict):
     }
 
     await websocket_manager.send_message(client_id, pong_message)
-    websocket_logger.debug(f"Отправлен pong клиенту {client_id}")
\ No newline at end of file
+    websocket_logger.debug(f"Отправлен pong клиенту {client_id}")
+
+
+@message_handler(
+    "subscribe", 
+    doc="Подписка на broadcast-события. Заменяет прошлую подписку. Пустые списки не ограничивают поток, без подписки приходят все события канала. Отправляет ответ на request_id.", 
+    datatypes=[
+        "sessions: Optional[list[str]]",
+        "companies: Optional[list[int]]",
+        "events: Optional[list[str]] (семейства: company, exchange, logistics, city, ...)",
+        "request_id: Optional[str]"
+    ],
+    ordered=True)
+async def handle_subscribe(client_id: str, message: dict):
+    """Обработчик подписки на темы"""
+    for key in ("sessions", "companies", "events"):
+        if message.get(key) is not None and not isinstance(message.get(key), list):
+            return {"error": f"{key} должен быть списком"}
+
+    subscription = websocket_manager.subscribe(
+        client_id,
+        sessions=message.get("sessions"),
+        companies=message.get("companies"),
+        families=message.get("events")
+    )
+    return {"success": True, "subscription": subscription}
+
+
+@message_handler(
+    "unsubscribe", 
+    doc="Снять подписку: снова приходят все broadcast-события канала. Отправляет ответ на request_id.", 
+    datatypes=["request_id: Optional[str]"],
+    ordered=True)
+async def handle_unsubscribe(client_id: str, message: dict):
+    """Обработчик отмены подписки"""
+    websocket_manager.unsubscribe(client_id)
+    return {"success": True}
+
+
+@message_handler(
+    "batch", 
+    doc="Несколько запросов в одном кадре. Подзапросы выполняются параллельно (по очереди, если среди них есть упорядоченные), ответ - список результатов в порядке requests, ошибка подзапроса - {error}. password передаётся во все подзапросы. Отправляет ответ на request_id.", 
+    datatypes=[
+        "requests: list[dict] ({type, ...поля запроса})",
+        "password: Optional[str]",
+        "request_id: str"
+    ])
+async def handle_batch(client_id: str, message: dict):
+    """Обработчик пакета запросов"""
+    shared = {"password": message["password"]} if "password" in message else {}
+
+    try:
+        return await run_batch(client_id, message.get("requests"), shared) # type: ignore
+    except ValueError as e:
+        return {"error": str(e)}
+
+
+@message_handler(
+    "set-batching", 
+    doc="Пакетная доставка broadcast-событий: события за короткое окно или за смену стадии приходят одним кадром api-batch {events: [...]} в исходном порядке. Отправляет ответ на request_id.", 
+    datatypes=[
+        "enabled: bool",
+        "request_id: Optional[str]"
+    ],
+    messages=["api-batch"],
+    ordered=True)
+async def handle_set_batching(client_id: str, message: dict):
+    """Обработчик включения пакетной доставки"""
+    enabled = bool(message.get("enabled", True))
+    websocket_manager.set_batching(client_id, enabled)
+    return {"success": True, "batching": enabled}
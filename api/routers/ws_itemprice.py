@@ -1,9 +1,10 @@
-from game.item_price import ItemPrice
+from game.item_price import ItemPrice, item_price_cache
 from modules.websocket_manager import websocket_manager
 from modules.check_password import check_password
 from modules.ws_hadnler import message_handler
 from modules.db import just_db
 from game.session import session_manager
+from game.price_history import price_history
 
 @message_handler(
     "get-items-price", 
@@ -30,7 +31,14 @@ async def handle_get_items_price(client_id: str, message: dict):
                                 session_id=session_id
                                 ) # type: ignore
         
-        item_list = [item.to_dict() for item in items]
+        prices = await item_price_cache.get_prices(session_id)
+
+        item_list = []
+        for item in items:
+            item_data = item.to_dict()
+            item_data["effective_price"] = prices.get(
+                item.id, item.get_effective_price())
+            item_list.append(item_data)
         return item_list
 
     except Exception as e:
@@ -72,4 +80,48 @@ async def handle_get_item_price_by_id(client_id: str, message: dict):
         return item.to_dict()
 
     except Exception as e:
-        return {"error": str(e)}
\ No newline at end of file
+        return {"error": str(e)}
+
+
+@message_handler(
+    "get-price-history", 
+    doc="Обработчик получения истории цен (OHLC по ходам) для графиков. Отправляет ответ на request_id.", 
+    datatypes=[
+        "session_id: str", 
+        "item_ids: Optional[list[str]] (по умолчанию все товары)",
+        "from_step: Optional[int]",
+        "to_step: Optional[int]",
+        "max_points: Optional[int] (0 - без прореживания)",
+        "request_id: str"
+    ])
+async def handle_get_price_history(client_id: str, message: dict):
+    """Обработчик получения истории цен"""
+
+    session_id = message.get("session_id")
+    item_ids = message.get("item_ids")
+    from_step = message.get("from_step", 0)
+    to_step = message.get("to_step")
+    max_points = message.get("max_points", 0)
+
+    for i in [session_id]:
+        if i is None: return {"error": "Missing required fields."}
+
+    try:
+        session = await session_manager.get_session(session_id=session_id)
+        if not session: 
+            raise ValueError("Сессия не найдена.")
+
+        if item_ids is not None and not isinstance(item_ids, list):
+            item_ids = [item_ids]
+
+        series = await price_history.get_series(
+            session_id=session_id,
+            item_ids=item_ids,
+            from_step=int(from_step),
+            to_step=int(to_step) if to_step is not None else None,
+            max_points=int(max_points)
+        )
+        return {"session_id": session_id, "series": series}
+
+    except Exception as e:
+        return {"error": str(e)}
@@ -3,11 +3,12 @@ from modules.websocket_manager import websocket_manager
 from modules.check_password import check_password
 from modules.ws_hadnler import message_handler
 from modules.db import just_db
+from modules.pagination import PageRequest, paginate
 from typing import cast
 
 @message_handler(
     "get-logistics", 
-    doc="Обработчик получения списка логистик. Отправляет ответ на request_id", 
+    doc="Обработчик получения списка логистик. С limit ответ постраничный: {items, total, limit, next_cursor, sort, order}. Отправляет ответ на request_id", 
     datatypes=[
         "session_id: Optional[str]", 
         "from_company_id: Optional[int]",
@@ -16,6 +17,11 @@ from typing import cast
         "logistics_id: Optional[int]",
         "destination_type: Literal['company', 'city']",
         "status: Literal['in_transit', 'waiting_pickup', 'delivered', 'failed']",
+        "limit: Optional[int]",
+        "cursor: Optional[str]",
+        "offset: Optional[int]",
+        "sort: Optional[str] (id, created_step, distance_left, amount)",
+        "order: Optional[Literal['asc', 'desc']]",
 
         "request_id: str"
         ])
@@ -33,11 +39,21 @@ async def handle_get_logistics(client_id: str, message: dict):
     }
 
 
+    filters = {k: v for k, v in conditions.items() if v is not None}
+
     try:
+        page = PageRequest.from_message(
+            message, ["id", "created_step", "distance_left", "amount"])
+        if page:
+            logistics_list, total, next_cursor = await paginate(
+                'logistics', page, filters, to_class=Logistics)
+            return page.response(
+                [logistics.to_dict() for logistics in logistics_list], total, next_cursor)
+
         logistics_list: list[Logistics] = await just_db.find(
             'logistics',
             to_class=Logistics,
-            **{k: v for k, v in conditions.items() if v is not None}) # type: ignore
+            **filters) # type: ignore
 
         return [logistics.to_dict() for logistics in logistics_list]
 
@@ -75,12 +91,12 @@ async def handle_logistics_pickup(client_id: str, message: dict):
         check_password(password)
 
         # Получаем логистику
-        logistics = cast(Logistics, Logistics(logistics_id).reupdate())
+        logistics = cast(Logistics, await Logistics(logistics_id).reupdate())
         if not logistics:
             raise ValueError("Логистика не найдена")
 
         # Выполняем получение груза
-        success = logistics.pick_up(company_id)
+        success = await logistics.pick_up(company_id)
         
         if success:
             return {
@@ -95,3 +111,43 @@ async def handle_logistics_pickup(client_id: str, message: dict):
         return {"error": str(e)}
     except Exception as e:
         return {"error": f"Произошла ошибка: {str(e)}"}
+
+@message_handler(
+    "logistics-pickup-batch", 
+    doc="Обработчик получения нескольких ожидающих грузов компанией за один запрос. Забираются все грузы или ни один. Требуется пароль для взаимодействия.",
+    datatypes=[
+        "logistics_ids: list[int]",
+        "company_id: int",
+        "password: str",
+        "request_id: str"
+    ],
+    messages=["api-logistics_picked_up_batch (broadcast)"]
+)
+async def handle_logistics_pickup_batch(client_id: str, message: dict):
+    """Обработчик получения нескольких ожидающих грузов"""
+
+    logistics_ids = message.get("logistics_ids")
+    company_id = message.get("company_id")
+    password = message.get("password")
+
+    if not isinstance(logistics_ids, list):
+        return {"error": "Отсутствует обязательное поле: logistics_ids"}
+    if company_id is None:
+        return {"error": "Отсутствует обязательное поле: company_id"}
+    if password is None:
+        return {"error": "Отсутствует обязательное поле: password"}
+
+    try:
+        check_password(password)
+
+        shipments = await Logistics.pick_up_many(company_id, logistics_ids)
+        return {
+            "success": True,
+            "message": "Грузы успешно получены",
+            "logistics": [logistics.to_dict() for logistics in shipments]
+        }
+
+    except ValueError as e:
+        return {"error": str(e)}
+    except Exception as e:
+        return {"error": f"Произошла ошибка: {str(e)}"}
@@ -2,7 +2,9 @@ from datetime import datetime, timedelta
 from modules.websocket_manager import websocket_manager
 from modules.ws_hadnler import message_handler
 from modules.db import just_db
+from modules.pagination import PageRequest, paginate
 from game.session import session_manager, Session, SessionStages
+from game.session_sync import session_sync
 from modules.check_password import check_password
 from game.statistic import Statistic
 
@@ -11,9 +13,14 @@ settings: Settings = ALL_CONFIGS['settings']
 
 @message_handler(
     "get-sessions", 
-    doc="Обработчик получения списка сессий. Отправляет ответ на request_id", 
+    doc="Обработчик получения списка сессий. С limit ответ постраничный: {items, total, limit, next_cursor, sort, order}. Отправляет ответ на request_id", 
     datatypes=[
         "stage: Optional[str]", 
+        "limit: Optional[int]",
+        "cursor: Optional[str]",
+        "offset: Optional[int]",
+        "sort: Optional[str] (session_id, step)",
+        "order: Optional[Literal['asc', 'desc']]",
         "request_id: str"
         ])
 async def handle_get_sessions(client_id: str, message: dict):
@@ -23,10 +30,23 @@ async def handle_get_sessions(client_id: str, message: dict):
         "stage": message.get("stage"),
     }
 
+    filters = {k: v for k, v in conditions.items() if v is not None}
+
+    try:
+        page = PageRequest.from_message(
+            message, ["session_id", "step"], unique_field="session_id")
+        if page:
+            sessions, total, next_cursor = await paginate(
+                'sessions', page, filters, to_class=Session)
+            return page.response(
+                [await s.to_dict() for s in sessions], total, next_cursor)
+    except ValueError as e:
+        return {"error": str(e)}
+
     # Получаем список сессий из базы данных
     sessions = await just_db.find('sessions',
                             to_class=Session,
-                         **{k: v for k, v in conditions.items() if v is not None})
+                         **filters)
 
     return [await s.to_dict() for s in sessions]
 
@@ -53,6 +73,46 @@ async def handle_get_session(client_id: str, message: dict):
 
     return await session.to_dict() if session else None
 
+@message_handler(
+    "subscribe-session-state", 
+    doc="Подписка на состояние сессии. Ответ: {session_id, version, snapshot} или, если передана известная version и недостающие патчи ещё хранятся, {session_id, version, patches}. Дальше приходят api-session-state-patch {session_id, version, base_version, ops}; при base_version, не равной своей версии, нужно переподписаться со своей version. Отправляет ответ на request_id.", 
+    datatypes=[
+        "session_id: str",
+        "version: Optional[int]",
+        "request_id: str"
+        ],
+    messages=["api-session-state-patch"],
+    ordered=True)
+async def handle_subscribe_session_state(client_id: str, message: dict):
+    """Обработчик подписки на состояние сессии"""
+
+    session_id = message.get("session_id")
+    version = message.get("version")
+
+    try:
+        if not session_id:
+            raise ValueError("session_id обязателен.")
+
+        return await session_sync.subscribe(
+            client_id, session_id,
+            int(version) if version is not None else None)
+    except ValueError as e:
+        return {"error": str(e)}
+
+@message_handler(
+    "unsubscribe-session-state", 
+    doc="Отписка от состояния сессии (без session_id - от всех сессий). Отправляет ответ на request_id.", 
+    datatypes=[
+        "session_id: Optional[str]",
+        "request_id: Optional[str]"
+        ],
+    ordered=True)
+async def handle_unsubscribe_session_state(client_id: str, message: dict):
+    """Обработчик отписки от состояния сессии"""
+
+    session_sync.unsubscribe(client_id, message.get("session_id"))
+    return {"success": True}
+
 @message_handler(
     "create-session", 
     doc="Обработчик создания сессии. Отправляет ответ на request_id. Требуется пароль для взаимодействия.",
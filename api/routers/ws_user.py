@@ -3,14 +3,20 @@ from game.user import User
 from modules.check_password import check_password
 from modules.ws_hadnler import message_handler
 from modules.db import just_db
+from modules.pagination import PageRequest, paginate
 from game.session import Session, session_manager
 
 @message_handler(
     "get-users", 
-    doc="Обработчик получения списка пользователей. Отправляет ответ на request_id.", 
+    doc="Обработчик получения списка пользователей. С limit ответ постраничный: {items, total, limit, next_cursor, sort, order}. Отправляет ответ на request_id.", 
     datatypes=[
         "company_id: Optional[int]", 
         "session_id: Optional[int]", 
+        "limit: Optional[int]",
+        "cursor: Optional[str]",
+        "offset: Optional[int]",
+        "sort: Optional[str] (id, username)",
+        "order: Optional[Literal['asc', 'desc']]",
         "request_id: str"
         ])
 async def handle_get_users(client_id: str, message: dict):
@@ -21,10 +27,22 @@ async def handle_get_users(client_id: str, message: dict):
         "session_id": message.get("session_id")
     }
 
+    filters = {k: v for k, v in conditions.items() if v is not None}
+
+    try:
+        page = PageRequest.from_message(message, ["id", "username"])
+        if page:
+            users, total, next_cursor = await paginate(
+                'users', page, filters, to_class=User)
+            return page.response(
+                [user.to_dict() for user in users], total, next_cursor)
+    except ValueError as e:
+        return {"error": str(e)}
+
     # Получаем список пользователей из базы данных
     users = await just_db.find('users',
                          to_class=User,
-                         **{k: v for k, v in conditions.items() if v is not None})
+                         **filters)
 
     return [user.to_dict() for user in users]
 
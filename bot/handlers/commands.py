@@ -374,6 +374,8 @@ async def on_update_session_stage(message: dict):
 @ws_client.on_event("disconnect")
 async def on_disconnect():
     print("❌ Отключено от WebSocket сервера")
+    # Подписки на состояние сессий не переживают переподключение
+    session_states.clear()
 
     for _ in range(15, 0, -1):
         print(f"🔄 Попытка подключения...")
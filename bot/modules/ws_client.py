@@ -2,6 +2,7 @@ import os
 import time
 from typing import Optional, Literal, Any
 from global_modules.api_client import create_client
+from global_modules.state_patch import apply_patch
 from global_modules.logs import Logger
 
 
@@ -14,17 +15,36 @@ bot_logger = Logger.get_logger("bot")
 ws_client = create_client(
     client_id=f"bot_client_{int(time.time())}", 
     uri=os.getenv("WS_SERVER_URI", "ws://localhost:81/ws/connect"),
-    logger=bot_logger
+    logger=bot_logger,
+    encoding=os.getenv("WS_ENCODING", "msgpack")
 )
 
+async def batch(*requests: dict, **shared):
+    """Несколько запросов одним кадром, результаты в том же порядке
+
+    Пример: company, users = await batch(
+        {"type": "get-company", "id": 1},
+        {"type": "get-users", "company_id": 1})
+    """
+    results = await ws_client.send_batch(list(requests), **shared)
+    if not isinstance(results, list):
+        return [results] * len(requests)
+    return results
+
 # Функции для работы с компаниями
-async def get_companies(session_id: Optional[str] = None, in_prison: Optional[bool] = None, cell_position: Optional[str] = None):
-    """Получение списка компаний"""
+async def get_companies(session_id: Optional[str] = None, in_prison: Optional[bool] = None, cell_position: Optional[str] = None,
+                        **page):
+    """Получение списка компаний
+    
+    Постраничный режим (page): limit, cursor, offset, sort, order. С limit
+    возвращается словарь {items, total, limit, next_cursor, sort, order}
+    """
     return await ws_client.send_message(
         "get-companies",
         session_id=session_id,
         in_prison=in_prison,
         cell_position=cell_position,
+        **page,
         wait_for_response=True,
         timeout=50
     )
@@ -196,7 +216,8 @@ async def get_logistics(session_id: Optional[str] = None,
                        to_city_id: Optional[int] = None,
                        logistics_id: Optional[int] = None,
                        destination_type: Optional[Literal['company', 'city']] = None,
-                       status: Optional[Literal['in_transit', 'waiting_pickup', 'delivered', 'failed']] = None):
+                       status: Optional[Literal['in_transit', 'waiting_pickup', 'delivered', 'failed']] = None,
+                       **page):
     """Получение списка логистики (доставок)
     
     Args:
@@ -207,6 +228,8 @@ async def get_logistics(session_id: Optional[str] = None,
         logistics_id: ID конкретной логистики
         destination_type: Тип назначения ('company' или 'city')
         status: Статус доставки ('in_transit', 'waiting_pickup', 'delivered', 'failed')
+        page: limit, cursor, offset, sort, order - постраничный режим,
+            с limit возвращается {items, total, limit, next_cursor, sort, order}
     """
     return await ws_client.send_message(
         "get-logistics",
@@ -217,6 +240,7 @@ async def get_logistics(session_id: Optional[str] = None,
         logistics_id=logistics_id,
         destination_type=destination_type,
         status=status,
+        **page,
         wait_for_response=True
     )
 
@@ -235,12 +259,29 @@ async def logistics_pickup(logistics_id: int, company_id: int):
         wait_for_response=True
     )
 
+async def logistics_pickup_batch(logistics_ids: list[int], company_id: int):
+    """Получение нескольких ожидающих грузов компанией за один запрос
+    
+    Args:
+        logistics_ids: ID логистик
+        company_id: ID компании, которая забирает грузы
+    """
+    return await ws_client.send_message(
+        "logistics-pickup-batch",
+        logistics_ids=logistics_ids,
+        company_id=company_id,
+        password=UPDATE_PASSWORD,
+        wait_for_response=True
+    )
+
 # Функции для работы с контрактами
 async def get_contracts(session_id: Optional[str] = None, 
                        supplier_company_id: Optional[int] = None,
                        customer_company_id: Optional[int] = None,
                        accepted: Optional[bool] = None,
-                       resource: Optional[str] = None):
+                       resource: Optional[str] = None,
+                       company_id: Optional[int] = None,
+                       **page):
     """Получение списка контрактов с фильтрацией
     
     Args:
@@ -249,6 +290,9 @@ async def get_contracts(session_id: Optional[str] = None,
         customer_company_id: ID компании-заказчика
         accepted: Фильтр по статусу принятия (True/False/None)
         resource: Фильтр по ресурсу
+        company_id: Контракты компании с любой стороны (поставщик или заказчик)
+        page: limit, cursor, offset, sort, order - постраничный режим,
+            с limit возвращается {items, total, limit, next_cursor, sort, order}
     """
     return await ws_client.send_message(
         "get-contracts",
@@ -257,6 +301,8 @@ async def get_contracts(session_id: Optional[str] = None,
         customer_company_id=customer_company_id,
         accepted=accepted,
         resource=resource,
+        company_id=company_id,
+        **page,
         wait_for_response=True
     )
 
@@ -619,14 +665,20 @@ async def notforgame_update_company_name(company_id: int, new_name: str):
 # Функции для работы с фабриками
 async def get_factories(company_id: Optional[int] = None, 
                         complectation: Optional[str] = None, 
-                       produce: Optional[bool] = None, is_auto: Optional[bool] = None):
-    """Получение списка фабрик"""
+                       produce: Optional[bool] = None, is_auto: Optional[bool] = None,
+                       **page):
+    """Получение списка фабрик
+    
+    Постраничный режим (page): limit, cursor, offset, sort, order. С limit
+    возвращается словарь {items, total, limit, next_cursor, sort, order}
+    """
     return await ws_client.send_message(
         "get-factories",
         company_id=company_id,
         complectation=complectation,
         produce=produce,
         is_auto=is_auto,
+        **page,
         wait_for_response=True
     )
 
@@ -667,11 +719,16 @@ async def factory_set_auto(factory_id: int, is_auto: bool):
     )
 
 # Функции для работы с сессиями
-async def get_sessions(stage: Optional[str] = None):
-    """Получение списка сессий"""
+async def get_sessions(stage: Optional[str] = None, **page):
+    """Получение списка сессий
+    
+    Постраничный режим (page): limit, cursor, offset, sort, order. С limit
+    возвращается словарь {items, total, limit, next_cursor, sort, order}
+    """
     return await ws_client.send_message(
         "get-sessions",
         stage=stage,
+        **page,
         wait_for_response=True
     )
 
@@ -684,6 +741,64 @@ async def get_session(session_id: Optional[str] = None, stage: Optional[str] = N
         wait_for_response=True
     )
 
+async def subscribe_session_state(session_id: str, version: Optional[int] = None):
+    """Подписка на состояние сессии: снимок или недостающие патчи с version"""
+    return await ws_client.send_message(
+        "subscribe-session-state",
+        session_id=session_id,
+        version=version,
+        wait_for_response=True
+    )
+
+# Зеркала состояния сессий {session_id: {"version": int, "state": dict}}
+session_states: dict[str, dict] = {}
+
+async def sync_session_state(session_id: str) -> Optional[dict]:
+    """Догнать состояние сессии с сервера (снимком или патчами)"""
+    mirror = session_states.get(session_id)
+    response = await subscribe_session_state(
+        session_id, mirror["version"] if mirror else None)
+
+    if not isinstance(response, dict) or "error" in response:
+        session_states.pop(session_id, None)
+        return None
+
+    if "snapshot" in response:
+        mirror = {"version": response["version"], "state": response["snapshot"]}
+        session_states[session_id] = mirror
+    elif mirror:
+        for patch in response.get("patches", []):
+            apply_patch(mirror["state"], patch["ops"])
+        mirror["version"] = response["version"]
+
+    return mirror["state"] if mirror else None
+
+async def get_session_state(session_id: str) -> Optional[dict]:
+    """Состояние сессии из зеркала (companies, users, cities, item_prices - словари по id)
+
+    Первое обращение подписывает на сессию, дальше зеркало обновляется патчами
+    без повторных запросов
+    """
+    mirror = session_states.get(session_id)
+    if mirror: return mirror["state"]
+    return await sync_session_state(session_id)
+
+@ws_client.on_message("api-session-state-patch")
+async def on_session_state_patch(message: dict):
+    data = message.get("data", {})
+    session_id = data.get("session_id")
+
+    mirror = session_states.get(session_id)
+    if not mirror: return
+
+    if data.get("base_version") != mirror["version"]:
+        # Пропущен патч - догоняем
+        await sync_session_state(session_id)
+        return
+
+    apply_patch(mirror["state"], data["ops"])
+    mirror["version"] = data["version"]
+
 async def create_session(session_id: Optional[str] = None, 
                         map_pattern: Optional[str] = None,
                         size: Optional[int] = None,
@@ -792,6 +907,22 @@ async def get_item_price_by_id(session_id: str, item_id: str):
         wait_for_response=True
     )
 
+async def get_price_history(session_id: str,
+                            item_ids: Optional[list[str]] = None,
+                            from_step: int = 0,
+                            to_step: Optional[int] = None,
+                            max_points: int = 0):
+    """Получение истории цен товаров (OHLC по ходам) для графиков"""
+    return await ws_client.send_message(
+        "get-price-history",
+        session_id=session_id,
+        item_ids=item_ids,
+        from_step=from_step,
+        to_step=to_step,
+        max_points=max_points,
+        wait_for_response=True
+    )
+
 async def get_all_item_prices(session_id: str):
     """Получение всех цен товаров в сессии"""
     return await ws_client.send_message(
@@ -956,6 +1087,23 @@ async def sell_to_city(city_id: int, company_id: int, resource_id: str, amount:
         wait_for_response=True
     )
 
+async def sell_to_city_batch(city_id: int, company_id: int, lines: list[dict]):
+    """Продажа городу нескольких ресурсов одним заказом
+    
+    Args:
+        city_id: ID города
+        company_id: ID компании
+        lines: Позиции заказа [{'resource_id': str, 'amount': int}, ...]
+    """
+    return await ws_client.send_message(
+        "sell-to-city-batch",
+        city_id=city_id,
+        company_id=company_id,
+        lines=lines,
+        password=UPDATE_PASSWORD,
+        wait_for_response=True
+    )
+
 async def get_city_demands(city_id: int):
     """Получение спроса города на товары"""
     return await ws_client.send_message(
@@ -965,12 +1113,17 @@ async def get_city_demands(city_id: int):
     )
 
 # Функции для работы с пользователями
-async def get_users(company_id: Optional[int] = None, session_id: Optional[str] = None):
-    """Получение списка пользователей"""
+async def get_users(company_id: Optional[int] = None, session_id: Optional[str] = None, **page):
+    """Получение списка пользователей
+    
+    Постраничный режим (page): limit, cursor, offset, sort, order. С limit
+    возвращается словарь {items, total, limit, next_cursor, sort, order}
+    """
     return await ws_client.send_message(
         "get-users",
         company_id=company_id,
         session_id=session_id,
+        **page,
         wait_for_response=True
     )
 
@@ -1019,14 +1172,26 @@ async def delete_user(user_id: int):
 
 # Функции биржи (Exchange)
 async def get_exchanges(session_id: Optional[str] = None, company_id: Optional[int] = None, 
-                       sell_resource: Optional[str] = None, offer_type: Optional[str] = None):
-    """Получить список предложений биржи с фильтрацией"""
+                       sell_resource: Optional[str] = None, offer_type: Optional[str] = None,
+                       min_price: Optional[float] = None, max_price: Optional[float] = None,
+                       offset: int = 0, limit: Optional[int] = None,
+                       cursor: Optional[str] = None):
+    """Получить список предложений биржи с фильтрацией
+    
+    Предложения отсортированы по цене за единицу. Если указан limit,
+    возвращается словарь {items, total, limit, next_cursor, sort, order}
+    """
     return await ws_client.send_message(
         "get-exchanges",
         session_id=session_id,
         company_id=company_id,
         sell_resource=sell_resource,
         offer_type=offer_type,
+        min_price=min_price,
+        max_price=max_price,
+        offset=offset,
+        limit=limit,
+        cursor=cursor,
         wait_for_response=True
     )
 
@@ -1120,6 +1285,48 @@ async def buy_exchange_offer(offer_id: int, buyer_company_id: int, quantity: int
         wait_for_response=True
     )
 
+async def create_buy_order(company_id: int, session_id: str, resource: str,
+                           amount: int, unit_price: int):
+    """Создать заявку на покупку (деньги резервируются, исполнение автоматическое)
+    
+    Args:
+        company_id: ID компании-покупателя
+        session_id: ID сессии
+        resource: Покупаемый ресурс
+        amount: Количество единиц
+        unit_price: Максимальная цена за единицу
+    """
+    return await ws_client.send_message(
+        "create-buy-order",
+        company_id=company_id,
+        session_id=session_id,
+        resource=resource,
+        amount=amount,
+        unit_price=unit_price,
+        password=UPDATE_PASSWORD,
+        wait_for_response=True
+    )
+
+async def cancel_buy_order(order_id: int):
+    """Отменить заявку на покупку (возврат зарезервированных денег)"""
+    return await ws_client.send_message(
+        "cancel-buy-order",
+        order_id=order_id,
+        password=UPDATE_PASSWORD,
+        wait_for_response=True
+    )
+
+async def get_buy_orders(session_id: str, company_id: Optional[int] = None,
+                         resource: Optional[str] = None):
+    """Получить заявки на покупку"""
+    return await ws_client.send_message(
+        "get-buy-orders",
+        session_id=session_id,
+        company_id=company_id,
+        resource=resource,
+        wait_for_response=True
+    )
+
 # Утилитарные функции
 async def ping(timestamp: str = "", content: Any = None):
     """Ping сообщение"""
@@ -4,7 +4,7 @@ from oms.utils import callback_generator
 from modules.ws_client import (
     get_sessions, get_session, create_session, delete_session, update_session_stage,
     get_companies, get_company, notforgame_update_company_name,
-    get_users, get_user, update_user, delete_user
+    get_users, get_user, update_user, delete_user, batch
 )
 import math
 
@@ -497,7 +497,10 @@ class AdminPanelPage(Page):
         scene_data = self.scene.get_data('scene')
         company_id = scene_data.get('admin_temp_data', {}).get('info_company_id')
         
-        company = await get_company(id=company_id)
+        company, users = await batch(
+            {"type": "get-company", "id": company_id},
+            {"type": "get-users", "company_id": company_id}
+        )
         if not company or 'error' in company:
             return f"❌ Компания с ID `{company_id}` не найдена"
         
@@ -514,7 +517,6 @@ class AdminPanelPage(Page):
         
         # Владелец и участники
         owner_id = company.get('owner', 0)
-        users = await get_users(company_id=cid)
         
         # Склад
         warehouses = company.get('warehouses', {})
@@ -332,7 +332,8 @@ class ContractExecutePage(OneUserPage):
         if session_id is None or company_id is None:
             return []
 
-        response = await get_contracts(session_id=session_id)
+        response = await get_contracts(
+            session_id=session_id, supplier_company_id=company_id, accepted=True)
         if isinstance(response, dict) and response.get("error"):
             await self.scene.update_key(self.__page_name__, "error", str(response.get("error")))
             return []
@@ -185,7 +185,7 @@ class ContractViewMyPage(OneUserPage):
         if session_id is None or company_id is None:
             return []
 
-        contracts_list = await get_contracts(session_id=session_id)
+        contracts_list = await get_contracts(session_id=session_id, company_id=company_id)
         contracts = []
         if isinstance(contracts_list, list):
             for c in contracts_list:
@@ -94,15 +94,10 @@ class ExchangeFilter(OneUserPage):
             return
         
         # Проверяем, есть ли предложения с этим ресурсом
-        # Проверяем наличие через основной кеш, при необходимости делаем запрос
-        exchanges = self.scene.get_key('exchange-main-page', 'exchanges_list')
-        if exchanges is None:
-            exchanges = await get_exchanges(session_id=session_id, sell_resource=resource_id)
-        else:
-            # Если в кеше все предложения без фильтра — отфильтруем локально
-            exchanges = [e for e in exchanges if e.get('sell_resource') == resource_id]
+        # Достаточно узнать общее количество - запрашиваем одно предложение
+        response = await get_exchanges(session_id=session_id, sell_resource=resource_id, limit=1)
         
-        if isinstance(exchanges, str) or not exchanges or len(exchanges) == 0:
+        if not isinstance(response, dict) or not response.get('total'):
             resource_name = self.item_filter.get_resource_name(resource_id)
             await callback.answer(
                 f"❌ Нет предложений с ресурсом {resource_name}",
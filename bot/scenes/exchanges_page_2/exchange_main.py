@@ -11,22 +11,44 @@ class ExchangeMain(OneUserPage):
     """Главная страница биржи со списком предложений"""
     
     __page_name__ = "exchange-main-page"
+    items_per_page = 5
+
     async def data_preparate(self):
-        """Единичная подгрузка списка предложений с учетом фильтра."""
+        """Подгрузка текущей страницы предложений с учетом фильтра.
+        Сортировка и пагинация выполняются на сервере (стакан биржи)."""
         scene_data = self.scene.get_data('scene')
         session_id = scene_data.get('session')
         filter_resource = scene_data.get('filter_resource', None)
+        current_page = scene_data.get('list_page', 0)
         if not session_id:
             await self.scene.update_key(self.__page_name__, 'exchanges_list', [])
+            await self.scene.update_key(self.__page_name__, 'exchanges_total', 0)
             return
-        # Загружаем и кешируем предложения
-        if filter_resource:
-            exchanges = await get_exchanges(session_id=session_id, sell_resource=filter_resource)
-        else:
-            exchanges = await get_exchanges(session_id=session_id)
+
+        response = await get_exchanges(
+            session_id=session_id, sell_resource=filter_resource,
+            offset=current_page * self.items_per_page, limit=self.items_per_page
+        )
+        # Страница вышла за пределы (предложения раскупили) - возвращаемся в начало
+        if isinstance(response, dict) and not response.get('items') and response.get('total', 0) > 0:
+            scene_data['list_page'] = 0
+            await self.scene.set_data('scene', scene_data)
+            response = await get_exchanges(
+                session_id=session_id, sell_resource=filter_resource,
+                offset=0, limit=self.items_per_page
+            )
+
         # В случае ошибки сохраняем пустой список, а текст ошибки покажем в контенте
-        await self.scene.update_key(self.__page_name__, 'exchanges_error', exchanges if isinstance(exchanges, str) else None)
-        await self.scene.update_key(self.__page_name__, 'exchanges_list', exchanges if isinstance(exchanges, list) else [])
+        if isinstance(response, dict) and 'items' in response:
+            exchanges, total = response['items'], response.get('total', 0)
+        else:
+            exchanges, total = [], 0
+        error = response if isinstance(response, str) else (
+            response.get('error') if isinstance(response, dict) else None)
+
+        await self.scene.update_key(self.__page_name__, 'exchanges_error', error)
+        await self.scene.update_key(self.__page_name__, 'exchanges_list', exchanges)
+        await self.scene.update_key(self.__page_name__, 'exchanges_total', total)
     
     async def content_worker(self):
         """Генерация контента - список предложений"""
@@ -80,22 +102,17 @@ class ExchangeMain(OneUserPage):
                 offers_text=offers_text
             )
         
-        # Пагинация (5 предложений на страницу)
-        items_per_page = 5
-        total_pages = max(1, (len(exchanges) + items_per_page - 1) // items_per_page)
+        # Пагинация (страница уже загружена с сервера)
+        total = self.scene.get_key(self.__page_name__, 'exchanges_total') or len(exchanges)
+        total_pages = max(1, (total + self.items_per_page - 1) // self.items_per_page)
         
-        # Нормализуем номер страницы
-        current_page = current_page % total_pages
-        scene_data['list_page'] = current_page
+        current_page = scene_data.get('list_page', 0)
         scene_data['total_pages'] = total_pages
         await self.scene.set_data('scene', scene_data)
         
-    # Получаем предложения для текущей страницы
-        start_idx = current_page * items_per_page
-        end_idx = start_idx + items_per_page
-        page_exchanges = exchanges[start_idx:end_idx]
+        page_exchanges = exchanges
         
-        offers_text = f"Найдено предложений: {len(exchanges)}\n"
+        offers_text = f"Найдено предложений: {total}\n"
         offers_text += f"Страница: {current_page + 1}/{total_pages}\n\n"
         
         # Отображаем предложения (краткая информация)
@@ -143,14 +160,11 @@ class ExchangeMain(OneUserPage):
             exchanges = self.scene.get_key(self.__page_name__, 'exchanges_list')
         
         if isinstance(exchanges, list) and len(exchanges) > 0:
-            # Пагинация
-            items_per_page = 5
+            # Пагинация (в кеше только текущая страница)
             current_page = scene_data.get('list_page', 0)
             total_pages = scene_data.get('total_pages', 1)
             
-            start_idx = current_page * items_per_page
-            end_idx = start_idx + items_per_page
-            page_exchanges = exchanges[start_idx:end_idx]
+            page_exchanges = exchanges
             
             # Кнопки предложений
             for exchange in page_exchanges:
@@ -282,6 +296,8 @@ class ExchangeMain(OneUserPage):
         
         scene_data['list_page'] = page
         await self.scene.set_data('scene', scene_data)
+        # Новая страница запрашивается с сервера
+        await self.scene.update_key(self.__page_name__, 'exchanges_list', None)
         
         await self.scene.update_message()
         await callback.answer()
@@ -328,6 +344,7 @@ class ExchangeMain(OneUserPage):
         # Сброс кеша списка предложений
         await self.scene.update_key(self.__page_name__, 'exchanges_list', None)
         await self.scene.update_key(self.__page_name__, 'exchanges_error', None)
+        await self.scene.update_key(self.__page_name__, 'exchanges_total', None)
         
         # Переходим на страницу главного меню
         await self.scene.update_page('main-page')
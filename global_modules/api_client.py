@@ -7,15 +7,23 @@ from os import getenv
 import logging
 import uuid
 
+from global_modules import codec
+
 
 class WebSocketClient:
     """
     Простой WebSocket клиент с поддержкой декораторов для обработки сообщений
+
+    encoding: кодировка кадров (codec.JSON или codec.MSGPACK, если установлен msgpack)
+    compression: предлагать серверу сжатие permessage-deflate
     """
 
-    def __init__(self, uri: str, client_id: str, logger = None):
+    def __init__(self, uri: str, client_id: str, logger = None,
+                 encoding: str = codec.JSON, compression: bool = True):
         self.uri = uri
         self.client_id = client_id
+        self.encoding = codec.resolve_encoding(encoding)
+        self.compression = compression
         self.websocket: Optional[websockets.WebSocketServerProtocol] = None
         self.connected = False
         self.message_handlers: Dict[str, list[Callable]] = {}
@@ -82,10 +90,13 @@ class WebSocketClient:
         """
         for attempt in range(1, max_attempts + 1):
             try:
-                full_uri = f"{self.uri}?client_id={self.client_id}"
+                full_uri = f"{self.uri}?client_id={self.client_id}&encoding={self.encoding}"
                 self.logger.info(f"Подключение к {full_uri} (попытка {attempt}/{max_attempts})")
 
-                self.websocket = await websockets.connect(full_uri)
+                self.websocket = await websockets.connect(
+                    full_uri,
+                    compression="deflate" if self.compression else None
+                )
                 self.connected = True
 
                 if self._on_connect: 
@@ -132,10 +143,10 @@ class WebSocketClient:
             self.logger.error(f"Ошибка при прослушивании: {e}")
             self.connected = False
 
-    async def _handle_message(self, message: str):
+    async def _handle_message(self, message: codec.Frame):
         """Обработка полученного сообщения"""
         try:
-            data = json.loads(message)
+            data = codec.decode(message)
             message_type = data.get("type", "unknown")
             request_id = data.get("request_id")
 
@@ -198,7 +209,7 @@ class WebSocketClient:
                 future = asyncio.Future()
                 self.pending_requests[request_id] = future
 
-            await self.websocket.send(json.dumps(message, ensure_ascii=False))
+            await self.websocket.send(codec.encode(message, self.encoding))
 
             if getenv("DEBUG") == 'true':
                 self.logger.debug(f"Отправлено: {message_type}")
@@ -224,6 +235,23 @@ class WebSocketClient:
             self.logger.error(f"Ошибка отправки сообщения: {e}")
             return False
 
+    async def send_batch(self, requests: list[dict],
+                         timeout: float = 20.0, **kwargs) -> Any:
+        """
+        Отправка нескольких запросов одним кадром
+
+        Args:
+            requests: Запросы [{"type": "get-company", "id": 1}, ...]
+            timeout: Время ожидания ответа в секундах
+            **kwargs: Поля для всех подзапросов (например, password)
+
+        Returns:
+            Список результатов в порядке requests (ошибка подзапроса - {"error": ...})
+        """
+        return await self.send_message(
+            "batch", requests=requests,
+            wait_for_response=True, timeout=timeout, **kwargs)
+
     async def ping(self) -> bool: return await self.send_message("ping")
 
     def is_connected(self) -> bool: return self.connected
@@ -233,13 +261,17 @@ class WebSocketClient:
 # Фабричная функция для создания клиента
 def create_client(uri: str = "ws://localhost:81/ws/connect", 
                  client_id: Optional[str] = None,
-                 logger = None) -> WebSocketClient:
+                 logger = None,
+                 encoding: str = codec.JSON,
+                 compression: bool = True) -> WebSocketClient:
     """
     Создать WebSocket клиент
 
     Args:
         uri: URI WebSocket сервера
         client_id: ID клиента (если None, будет сгенерирован)
+        encoding: Кодировка кадров (json или msgpack)
+        compression: Предлагать сжатие permessage-deflate
 
     Returns:
         WebSocketClient
@@ -247,4 +279,4 @@ def create_client(uri: str = "ws://localhost:81/ws/connect",
     if client_id is None:
         client_id = f"client_{int(time.time())}"
 
-    return WebSocketClient(uri, client_id, logger)
\ No newline at end of file
+    return WebSocketClient(uri, client_id, logger, encoding, compression)
\ No newline at end of file
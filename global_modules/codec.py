@@ -0,0 +1,69 @@
+import json
+import struct
+from typing import Any, Union
+
+try:
+    import msgpack
+except ImportError:  # Без msgpack доступен только JSON
+    msgpack = None
+
+JSON = "json"
+MSGPACK = "msgpack"
+
+Frame = Union[str, bytes]
+
+
+def available_encodings() -> list[str]:
+    """ Кодировки кадров, которые можно выбрать при подключении """
+    return [JSON, MSGPACK] if msgpack else [JSON]
+
+
+def resolve_encoding(encoding: str) -> str:
+    """ Кодировка для соединения: запрошенная, если она доступна, иначе JSON """
+    encoding = (encoding or JSON).lower()
+    return encoding if encoding in available_encodings() else JSON
+
+
+def encode(message: Any, encoding: str = JSON) -> Frame:
+    """ Кодирует сообщение в кадр: JSON - текстовый, MessagePack - бинарный
+
+        Строка считается уже закодированным JSON-кадром, байты - бинарным
+    """
+    if isinstance(message, bytes):
+        return message
+
+    if encoding == MSGPACK:
+        return msgpack.packb(message, default=str, use_bin_type=True)
+
+    if isinstance(message, str):
+        return message
+    return json.dumps(message, ensure_ascii=False)
+
+
+def decode(frame: Frame) -> Any:
+    """ Декодирует кадр: текстовые - JSON, бинарные - MessagePack """
+    if isinstance(frame, str):
+        return json.loads(frame)
+
+    if msgpack is None:
+        raise ValueError("Бинарные кадры не поддерживаются: msgpack не установлен.")
+    return msgpack.unpackb(frame, raw=False)
+
+
+def _msgpack_array_header(size: int) -> bytes:
+    if size < 16:
+        return bytes([0x90 | size])
+    if size < 0x10000:
+        return b"\xdc" + struct.pack(">H", size)
+    return b"\xdd" + struct.pack(">I", size)
+
+
+def encode_batch(frames: list[Frame], encoding: str = JSON) -> Frame:
+    """ Кадр api-batch из уже закодированных событий (без повторного кодирования) """
+    if encoding == MSGPACK:
+        head = msgpack.packb({"type": "api-batch", "data": {}})
+        # Заменяем пустую data ({} = 0x80) на {"events": [...]}
+        return (head[:-1] + b"\x81" + msgpack.packb("events")
+                + _msgpack_array_header(len(frames)) + b"".join(frames)) # type: ignore
+
+    return '{"type": "api-batch", "data": {"events": [' + ', '.join(frames) + ']}}' # type: ignore
@@ -2,7 +2,7 @@ import asyncio
 from typing import Any, Dict, List, Optional, Union, TYPE_CHECKING, Type, overload, TypeVar
 from datetime import datetime
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase, AsyncIOMotorCollection
-from pymongo import IndexModel
+from pymongo import IndexModel, ReturnDocument, UpdateOne
 import os
 from copy import deepcopy
 
@@ -62,14 +62,29 @@ class MongoDatabase:
             self._collections[table_name] = self.db[table_name]
         return self._collections[table_name]
 
-    async def create_table(self, table_name: str, indexes: Optional[List[str]] = None):
-        """Создаёт новую коллекцию с индексами"""
+    async def create_table(self, table_name: str, 
+                           indexes: Optional[List[Union[str, List[tuple]]]] = None,
+                           unique: Optional[List[Union[str, List[tuple]]]] = None):
+        """Создаёт новую коллекцию с индексами
+
+        indexes: имена полей или составные ключи [(поле, 1 | -1), ...]
+        unique: то же для уникальных индексов
+        """
         if self.db is None:
             raise RuntimeError("Database not connected")
 
         if table_name not in await self.db.list_collection_names():
             await self.db.create_collection(table_name)
 
+        models = [
+            IndexModel([(index, 1)] if isinstance(index, str) else list(index),
+                       unique=is_unique)
+            for is_unique, group in ((False, indexes), (True, unique))
+            for index in group or []
+        ]
+        if models:
+            await self._get_collection(table_name).create_indexes(models)
+
     async def insert(self, table_name: str, record: Dict[str, Any]) -> int:
         """Вставляет запись в коллекцию"""
         if self.db is None:
@@ -91,6 +106,15 @@ class MongoDatabase:
         result = await collection.insert_one(record)
         return record['id']
 
+    async def append(self, table_name: str, record: Dict[str, Any]):
+        """Вставляет запись журнала без числового id (без поиска максимального id)"""
+        if self.db is None:
+            await self.connect()
+
+        record = dict(record)
+        record['created_at'] = datetime.now()
+        await self._get_collection(table_name).insert_one(record)
+
     @overload
     async def find(self, 
                    table_name: str,
@@ -218,6 +242,58 @@ class MongoDatabase:
         
         return result.modified_count
 
+    async def find_one_and_update(self,
+                                  table_name: str,
+                                  conditions: Dict[str, Any],
+                                  operations: Dict[str, Any],
+                                  upsert: bool = False) -> Optional[Dict[str, Any]]:
+        """Атомарно обновляет одну запись операторами MongoDB ($inc, $push, ...)
+           и возвращает её новую версию (None, если под условия ничего не попало)"""
+        if self.db is None:
+            await self.connect()
+
+        if not isinstance(conditions, dict):
+            raise ValueError(f"conditions must be a dictionary, got {type(conditions)} ({conditions})")
+
+        if not operations or not all(key.startswith('$') for key in operations):
+            raise ValueError(f"operations must be a non-empty dict of MongoDB operators, got {operations}")
+
+        collection = self._get_collection(table_name)
+
+        operations = deepcopy(operations)
+        operations.setdefault('$set', {})['updated_at'] = datetime.now()
+
+        return await collection.find_one_and_update(
+            conditions, operations,
+            upsert=upsert,
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def bulk_update(self,
+                          table_name: str,
+                          operations: List[tuple]) -> int:
+        """Выполняет пачку обновлений одним запросом
+
+        operations: [(условия, операторы MongoDB), ...], каждое обновляет одну запись
+        """
+        if self.db is None:
+            await self.connect()
+
+        if not operations: return 0
+
+        requests = []
+        for conditions, update in operations:
+            if not update or not all(key.startswith('$') for key in update):
+                raise ValueError(f"operations must be non-empty dicts of MongoDB operators, got {update}")
+
+            update = deepcopy(update)
+            update.setdefault('$set', {})['updated_at'] = datetime.now()
+            requests.append(UpdateOne(conditions, update))
+
+        collection = self._get_collection(table_name)
+        result = await collection.bulk_write(requests, ordered=False)
+        return result.modified_count
+
     async def delete(self, table_name: str, **conditions) -> int:
         """Удаляет записи"""
         if self.db is None:
@@ -1,5 +1,6 @@
+from collections import deque
 from dataclasses import dataclass, field
-from typing import Dict
+from typing import Dict, List
 
 
 @dataclass
@@ -62,4 +63,34 @@ class Resources:
 
     def get_produced_resources(self) -> Dict[str, Resource]:
         """Получить все производимые ресурсы"""
-        return {rid: res for rid, res in self.resources.items() if res.production is not None}
\ No newline at end of file
+        return {rid: res for rid, res in self.resources.items() if res.production is not None}
+
+    def get_production_order(self) -> List[str]:
+        """Получить ID всех ресурсов в порядке рецептов:
+        каждый материал идёт раньше ресурсов, которые из него производятся"""
+        dependents: Dict[str, List[str]] = {rid: [] for rid in self.resources}
+        in_degree: Dict[str, int] = {rid: 0 for rid in self.resources}
+
+        for rid, res in self.resources.items():
+            if res.production is None:
+                continue
+            for mat_id in res.production.materials:
+                if mat_id in dependents:
+                    dependents[mat_id].append(rid)
+                    in_degree[rid] += 1
+
+        queue = deque(rid for rid, degree in in_degree.items() if degree == 0)
+        order: List[str] = []
+        while queue:
+            rid = queue.popleft()
+            order.append(rid)
+            for dependent in dependents[rid]:
+                in_degree[dependent] -= 1
+                if in_degree[dependent] == 0:
+                    queue.append(dependent)
+
+        if len(order) != len(self.resources):
+            cycle = [rid for rid, degree in in_degree.items() if degree > 0]
+            raise ValueError(f"Циклическая зависимость в рецептах ресурсов: {cycle}")
+
+        return order
\ No newline at end of file
@@ -39,6 +39,10 @@ class Settings:
     
     city_mod: float  # Модификатор количества товара в городе
 
+    price_tick_interval_ms: int  # Интервал отправки изменений цен клиентам (мс)
+    scheduler_max_concurrency: int  # Сколько задач по времени может выполняться одновременно
+    ws_max_inflight_requests: int  # Сколько запросов одного WebSocket-соединения обрабатывается одновременно
+
     @classmethod
     def load_from_json(cls, data: dict):
         start_improvements = StartImprovementsLevel(**data["start_improvements_level"])
@@ -0,0 +1,48 @@
+from typing import Any
+
+
+def _escape(key: Any) -> str:
+    return str(key).replace("~", "~0").replace("/", "~1")
+
+
+def _unescape(token: str) -> str:
+    return token.replace("~1", "/").replace("~0", "~")
+
+
+def diff(old: Any, new: Any, path: str = "") -> list[dict]:
+    """ Патч от old к new: операции add / replace / remove в духе JSON Patch
+
+        Словари сравниваются по ключам, списки и значения заменяются целиком
+    """
+    if isinstance(old, dict) and isinstance(new, dict):
+        ops = []
+        for key in old:
+            if key not in new:
+                ops.append({"op": "remove", "path": f"{path}/{_escape(key)}"})
+
+        for key, value in new.items():
+            child = f"{path}/{_escape(key)}"
+            if key not in old:
+                ops.append({"op": "add", "path": child, "value": value})
+            else:
+                ops.extend(diff(old[key], value, child))
+        return ops
+
+    if old == new: return []
+    return [{"op": "replace", "path": path, "value": new}]
+
+
+def apply_patch(state: dict, ops: list[dict]) -> dict:
+    """ Применяет патч к состоянию на месте и возвращает его """
+    for op in ops:
+        *parents, last = [_unescape(token) for token in op["path"].split("/")[1:]]
+
+        target = state
+        for token in parents:
+            target = target[token]
+
+        if op["op"] == "remove":
+            target.pop(last, None)
+        else:
+            target[last] = op["value"]
+    return state
@@ -19,6 +19,9 @@ export class WebSocketManager {
     
     this.pendingCallbacks = new Map();
     this._pollInterval = null;
+
+    // Versioned session state: { session_id, version, state } (subscribe-session-state)
+    this.sessionSync = null;
     
     // Auto-reconnection settings
     this.reconnectInterval = null;
@@ -105,6 +108,9 @@ export class WebSocketManager {
       console.log('[WS] Connected to server');
       this.gameState.setConnected(true);
       this.gameState.setError(null);
+
+      // Broadcast events arrive as api-batch frames
+      this.socket.send(JSON.stringify({ type: "set-batching", enabled: true }));
       
       // Try to rejoin stored session after connection is established
       this.attemptSessionRejoin();
@@ -114,6 +120,7 @@ export class WebSocketManager {
 
     this.socket.onclose = () => {
       console.log('[WS] Disconnected from server');
+      this.sessionSync = null;
       this.gameState.setConnected(false);
       this.gameState.setConnecting(false);
       
@@ -363,6 +370,134 @@ export class WebSocketManager {
       })
     );
 
+    // Only receive broadcasts of the joined session
+    this.subscribe({ sessions: [session_id] });
+
+    // Snapshot + patches instead of re-fetching session, companies and users
+    this.subscribe_session_state(session_id);
+
+    return request_id;
+  }
+
+  subscribe_session_state(session_id, version = null) {
+    if (!this.socket || this.socket.readyState !== WebSocket.OPEN) return null;
+
+    const request_id = `session_state_${Date.now()}_${Math.random()
+      .toString(36)
+      .substr(2, 9)}`;
+
+    this.socket.send(
+      JSON.stringify({
+        type: "subscribe-session-state",
+        session_id: session_id,
+        version: version,
+        request_id: request_id,
+      })
+    );
+    return request_id;
+  }
+
+  handleSessionStateResponse(message) {
+    const data = message.data;
+    if (!data || data.error) {
+      console.warn('[WS] Session state subscription failed:', data && data.error);
+      this.sessionSync = null;
+      return;
+    }
+
+    if (data.snapshot) {
+      this.sessionSync = {
+        session_id: data.session_id,
+        version: data.version,
+        state: data.snapshot,
+      };
+    } else if (this.sessionSync && this.sessionSync.session_id === data.session_id) {
+      for (const patch of data.patches || []) {
+        this.applySessionPatch(this.sessionSync.state, patch.ops);
+      }
+      this.sessionSync.version = data.version;
+    } else {
+      return;
+    }
+
+    this.publishSessionState();
+  }
+
+  handleSessionStatePatch(message) {
+    const data = message.data || {};
+    const sync = this.sessionSync;
+    if (!sync || sync.session_id !== data.session_id) return;
+
+    if (data.base_version !== sync.version) {
+      // Missed a patch - catch up from our version
+      this.subscribe_session_state(sync.session_id, sync.version);
+      return;
+    }
+
+    this.applySessionPatch(sync.state, data.ops);
+    sync.version = data.version;
+    this.publishSessionState();
+  }
+
+  applySessionPatch(state, ops) {
+    for (const op of ops) {
+      const tokens = op.path
+        .split("/")
+        .slice(1)
+        .map((token) => token.replace(/~1/g, "/").replace(/~0/g, "~"));
+      const last = tokens.pop();
+
+      let target = state;
+      for (const token of tokens) target = target[token];
+
+      if (op.op === "remove") {
+        delete target[last];
+      } else {
+        target[last] = op.value;
+      }
+    }
+  }
+
+  publishSessionState() {
+    const state = this.sessionSync.state;
+
+    this.gameState.updateSession({ ...state, session_id: state.id });
+    this.gameState.updateCompanies(Object.values(state.companies));
+    this.gameState.updateUsers(Object.values(state.users));
+
+    if (state.next_stage_at) {
+      const seconds = Math.max(
+        0,
+        Math.ceil((new Date(state.next_stage_at) - Date.now()) / 1000)
+      );
+      this.gameState.updateTimeToNextStage(seconds);
+    }
+  }
+
+  subscribe(topics = {}, callback = null) {
+    if (!this.socket || this.socket.readyState !== WebSocket.OPEN) {
+      const error = "WebSocket is not connected";
+      this.gameState.setError(error);
+      if (callback) callback({ success: false, error });
+      return null;
+    }
+
+    const request_id = `subscribe_${Date.now()}_${Math.random()
+      .toString(36)
+      .substr(2, 9)}`;
+    if (callback && typeof callback === "function") {
+      this.pendingCallbacks.set(request_id, callback);
+    }
+
+    this.socket.send(
+      JSON.stringify({
+        type: "subscribe",
+        sessions: topics.sessions,
+        companies: topics.companies,
+        events: topics.events,
+        request_id: request_id,
+      })
+    );
     return request_id;
   }
 
@@ -602,6 +737,37 @@ export class WebSocketManager {
     return request_id;
   }
 
+  get_price_history(options = {}, callback = null, source = 'manual') {
+    if (!this.socket || this.socket.readyState !== WebSocket.OPEN) {
+      const error = "WebSocket is not connected";
+      this.gameState.setError(error);
+      if (callback) callback({ success: false, error });
+      return null;
+    }
+    
+    this.trackRequest('get-price-history', source);
+    
+    const request_id = `get_price_history_${Date.now()}_${Math.random()
+      .toString(36)
+      .substr(2, 9)}`;
+    if (callback && typeof callback === "function") {
+      this.pendingCallbacks.set(request_id, callback);
+    }
+    
+    this.socket.send(
+      JSON.stringify({
+        type: "get-price-history",
+        session_id: this.gameState.state.session.id || undefined,
+        item_ids: options.item_ids,
+        from_step: options.from_step,
+        to_step: options.to_step,
+        max_points: options.max_points,
+        request_id: request_id,
+      })
+    );
+    return request_id;
+  }
+
   get_cities(callback = null, source = 'manual') {
     if (!this.socket || this.socket.readyState !== WebSocket.OPEN) {
       const error = "WebSocket is not connected";
@@ -911,8 +1077,11 @@ export class WebSocketManager {
       return;
     }
     
+    // Session, companies and users come as state patches when synced
+    const synced = this.sessionSync !== null;
+
     // 1. Session state and map (includes time_to_next_stage)
-    this.get_session(null, 'polling');
+    if (!synced) this.get_session(null, 'polling');
     
     // 2. Explicitly fetch time to ensure it's always fresh
     this.get_time_to_next_stage(null, 'polling');
@@ -921,8 +1090,10 @@ export class WebSocketManager {
     this.get_session_event(null, 'polling');
     
     // 4. Companies and their users
-    this.get_companies(null, 'polling');
-    this.get_users(null, 'polling');
+    if (!synced) {
+      this.get_companies(null, 'polling');
+      this.get_users(null, 'polling');
+    }
     
     // 5. Cities
     this.get_cities(null, 'polling');
@@ -947,16 +1118,21 @@ export class WebSocketManager {
       return;
     }
     
+    // Session, companies and users come as state patches when synced
+    const synced = this.sessionSync !== null;
+
     // 1. Session state and time
-    this.get_session();
+    if (!synced) this.get_session();
     this.get_time_to_next_stage();
     
     // 2. Event data
     this.get_session_event();
     
     // 3. Companies and users (can change frequently)
-    this.get_companies();
-    this.get_users();
+    if (!synced) {
+      this.get_companies();
+      this.get_users();
+    }
     
     // 4. Exchanges (active data)
     this.get_exchanges();
@@ -987,7 +1163,9 @@ export class WebSocketManager {
     const message = JSON.parse(event.data);
 
     if (message.type === "response" && message.request_id) {
-      if (
+      if (message.request_id.startsWith("session_state_")) {
+        this.handleSessionStateResponse(message);
+      } else if (
         message.request_id.startsWith("check_session_") ||
         message.request_id.startsWith("join_session_") ||
         message.request_id.startsWith("get_session_")
@@ -1031,6 +1209,11 @@ export class WebSocketManager {
         // Generic handler for other responses
         this.handleGenericResponse(message);
       }
+    } else if (message.type === "api-batch") {
+      // Events of one window / stage change, in server order
+      for (const event of message.data?.events || []) {
+        this.handleBroadcast(event);
+      }
     } else if (message.type && message.type.startsWith("api-")) {
       this.handleBroadcast(message);
     } else if (message.type === "error") {
@@ -1546,6 +1729,10 @@ export class WebSocketManager {
     
     // Handle different broadcast types with debouncing
     switch (message.type) {
+      case 'api-session-state-patch':
+        this.handleSessionStatePatch(message);
+        break;
+
       case 'api-create_company':
       case 'api-company_deleted':
       case 'api-user_added_to_company':
@@ -1709,11 +1896,13 @@ export class WebSocketManager {
         this.debounceRequest('companies', () => this.get_companies(null, 'broadcast'), 1000, 'broadcast');
         break;
         
-      case 'api-item_price_updated':
-        console.log('[WS] Item price updated broadcast received:', message.data);
-        // Update item prices in game state if needed
-        if (message.data && message.data.item_id && message.data.price !== undefined) {
-          this.gameState.updateItemPrice(message.data.item_id, message.data.price);
+      case 'api-item_prices_tick':
+        console.log('[WS] Item prices tick received:', message.data);
+        // Tick carries the latest price of every item changed since the previous one
+        if (message.data && message.data.prices) {
+          Object.entries(message.data.prices).forEach(([itemId, price]) => {
+            this.gameState.updateItemPrice(itemId, price);
+          });
         }
         // Debounced refresh all item prices to stay in sync
         this.debounceRequest('item_prices', () => this.get_all_item_prices(null, 'broadcast'), 1000, 'broadcast');
@@ -1985,6 +2174,14 @@ export class WebSocketManager {
   // Leave current session
   leaveSession() {
     this.stopPolling();
+
+    if (this.sessionSync && this.socket && this.socket.readyState === WebSocket.OPEN) {
+      this.socket.send(JSON.stringify({
+        type: "unsubscribe-session-state",
+        session_id: this.sessionSync.session_id,
+      }));
+    }
+    this.sessionSync = null;
     this.gameState.clearSession();
     
     // Clear stored session when explicitly leaving